@@ -0,0 +1,70 @@
+"""
+Cold-start benchmark for lambda_function.
+
+Each run starts a fresh interpreter (like a new Lambda container) and measures how long
+importing the module takes, how long the first request needing one S3 client takes
+(generating a presigned URL, which makes no network call), and how long a warmup event
+takes to build every remaining client.
+
+    python -m assement.src.benchmark.cold_start --runs 20 --output cold_start.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+# Runs inside the fresh interpreter; prints the timings as JSON
+PROBE = """
+import json, time
+start = time.perf_counter()
+from assement.src.file_manager import lambda_function
+imported = time.perf_counter()
+lambda_function.image_handler.s3.generate_presigned_url(
+    'get_object', Params={'Bucket': 'image-bucket', 'Key': 'probe.jpg'}, ExpiresIn=60)
+first_request = time.perf_counter()
+if hasattr(lambda_function, 'handle_warmup'):
+    lambda_function.handle_warmup()
+warm = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000,
+                  "first_request_ms": (first_request - imported) * 1000,
+                  "warmup_ms": (warm - first_request) * 1000}))
+"""
+
+
+def run_once(python_path):
+    env = dict(os.environ, PYTHONPATH=python_path, AWS_EC2_METADATA_DISABLED="true")
+    output = subprocess.run([sys.executable, "-c", PROBE], env=env, check=True, capture_output=True, text=True).stdout
+    # lambda_function may print while importing; the timings are the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    return {
+        "p50": round(statistics.median(samples), 2),
+        "min": round(min(samples), 2),
+        "max": round(max(samples), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    # The package is imported as assement.src..., so its parent directory goes on the path
+    python_path = str(Path(__file__).parents[3])
+    runs = [run_once(python_path) for _ in range(args.runs)]
+    results = {"runs": args.runs, **{metric: summarize([run[metric] for run in runs]) for metric in runs[0]}}
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
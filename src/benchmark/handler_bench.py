@@ -0,0 +1,245 @@
+"""
+Benchmark suite for lambda_handler.
+
+Drives every action through lambda_handler against moto's in-process S3/DynamoDB
+stand-in (pip install moto), so it needs neither LocalStack nor the network. For each
+scenario it reports p50/p95/p99 latency, throughput and the process peak RSS, and
+optionally the peak Python allocation (--trace-memory), then writes everything as JSON.
+The stand-in keeps every uploaded object in memory, so the stream_decode scenarios time
+and trace the upload body's decoding on its own: its peak stays flat as the size grows.
+Seeding the 100k-key listing takes a few minutes; --list-sizes 1000 skips it.
+
+    python -m assement.src.benchmark.handler_bench --output bench.json
+    python -m assement.src.benchmark.handler_bench --output new.json --compare bench.json
+"""
+import argparse
+import base64
+import contextlib
+import json
+import os
+import platform
+import resource
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+try:
+    from moto import mock_aws
+except ImportError:  # the benchmark is the only user of moto
+    mock_aws = None
+
+BUCKET_NAME = "bench-bucket"
+TABLE_NAME = "BenchImageMetadata"
+UPLOAD_SIZES = {"1KB": 1024, "100KB": 100 * 1024, "1MB": 1024 * 1024, "10MB": 10 * 1024 * 1024}
+LIST_SIZES = [1000, 100000]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(call, iterations, trace_memory=False, setup=None):
+    """
+    Times `call` (a function of the iteration number) and returns the scenario statistics.
+    :param setup: optional untimed function of the iteration number run before each call
+    """
+    if trace_memory:
+        tracemalloc.reset_peak()
+        traced_before = tracemalloc.get_traced_memory()[0]
+    latencies = []
+    for i in range(iterations):
+        if setup:
+            setup(i)
+        start = time.perf_counter()
+        response = call(i)
+        latencies.append(time.perf_counter() - start)
+        if response["statusCode"] >= 400:
+            raise RuntimeError(f"Benchmark request failed: {response['body'][:200]}")
+
+    result = {
+        "iterations": iterations,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        "throughput_per_s": round(iterations / sum(latencies), 2),
+        # ru_maxrss is in KiB on Linux; it is the peak of the whole process so far
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+    if trace_memory:
+        # Growth over what was already allocated, i.e. what the scenario itself needed at its peak
+        result["peak_traced_mb"] = round((tracemalloc.get_traced_memory()[1] - traced_before) / (1024 * 1024), 2)
+    return result
+
+
+def drain(body):
+    """
+    Reads an upload body the way botocore does, block by block, and throws the bytes away.
+    """
+    from assement.src.file_manager.streaming import Base64Reader
+
+    reader = Base64Reader(body)
+    while reader.read(64 * 1024):
+        pass
+    return {"statusCode": 200}
+
+
+def build_environment():
+    """
+    Creates the bucket and table in the stand-in and points lambda_function at them.
+    Must run inside mock_aws().
+    """
+    from assement.src.file_manager import aws_clients, lambda_function
+    from assement.src.file_manager.db_client import table_definition
+    from assement.src.file_manager.file_handler import FileHandler
+    from assement.src.file_manager.file_search import FileSearch
+
+    aws_clients.reset()
+    config = {"endpoint_url": None, "aws_access_key_id": "test", "aws_secret_access_key": "test"}
+    s3 = aws_clients.client('s3', **config)
+    s3.create_bucket(Bucket=BUCKET_NAME)
+    aws_clients.client('dynamodb', **config).create_table(**table_definition(TABLE_NAME))
+
+    lambda_function.image_handler = FileHandler(bucket_name=BUCKET_NAME, table_name=TABLE_NAME, **config)
+    lambda_function.file_search = FileSearch(bucket_name=BUCKET_NAME, table_name=TABLE_NAME, **config)
+    return lambda_function, s3
+
+
+def event(http_method, body=None, **query_params):
+    return {
+        "httpMethod": http_method,
+        "queryStringParameters": query_params,
+        "body": body,
+        "headers": {"Content-Type": "application/json"}
+    }
+
+
+def run(iterations, upload_sizes, list_sizes, trace_memory):
+    from assement.src.file_manager.file_handler import download_cache
+    from assement.src.file_manager.listing_index import ListingIndex
+    from assement.src.file_manager.list_cache import ListCache
+    from assement.src.file_manager.delete_queue import LocalQueue
+
+    lambda_function, s3 = build_environment()
+    handler = lambda_function.lambda_handler
+    results = {}
+
+    for label, size in upload_sizes.items():
+        body = base64.b64encode(os.urandom(size)).decode('ascii')
+        results[f"upload_{label}"] = measure(
+            lambda i: handler(event("POST", body, action="upload", fileName=f"upload/{label}/{i}.jpg", metadata="{}"), {}),
+            iterations, trace_memory)
+        results[f"stream_decode_{label}"] = measure(lambda i: drain(body), iterations, trace_memory)
+
+    handler(event("POST", base64.b64encode(b"x" * 1024).decode('ascii'), action="upload", fileName="hot.jpg",
+                  metadata="{}"), {})
+    results["download"] = measure(lambda i: handler(event("GET", action="download", imageName="hot.jpg"), {}),
+                                  iterations, trace_memory, setup=lambda i: download_cache.clear())
+    results["download_cached"] = measure(lambda i: handler(event("GET", action="download", imageName="hot.jpg"), {}),
+                                         iterations, trace_memory)
+    # End to end for a small image: the URL plus the client's GET from S3, against the image in the response
+    def download_and_fetch(i):
+        response = handler(event("GET", action="download", imageName="hot.jpg"), {})
+        s3.get_object(Bucket=BUCKET_NAME, Key="hot.jpg")["Body"].read()
+        return response
+    results["download_and_fetch"] = measure(download_and_fetch, iterations, trace_memory,
+                                            setup=lambda i: download_cache.clear())
+    results["download_inline"] = measure(
+        lambda i: handler(event("GET", action="download", imageName="hot.jpg", inline="true"), {}),
+        iterations, trace_memory, setup=lambda i: download_cache.clear())
+
+    for count in list_sizes:
+        prefix = f"list{count}/"
+        for i in range(count):
+            s3.put_object(Bucket=BUCKET_NAME, Key=f"{prefix}{i:07d}.jpg", Body=b"")
+        results[f"list_{count}_keys"] = measure(
+            lambda i: handler(event("GET", action="list", prefix=prefix, limit="30"), {}), iterations, trace_memory)
+
+        # The same listing repeated against the container's list cache
+        lambda_function.file_search.list_cache = ListCache()
+        results[f"list_{count}_keys_cached"] = measure(
+            lambda i: handler(event("GET", action="list", prefix=prefix, limit="30"), {}), iterations, trace_memory)
+        lambda_function.file_search.list_cache = None
+
+        # The same listing answered from the in-memory index built off a snapshot
+        listing = ListingIndex(BUCKET_NAME)
+        listing.rebuild(s3)
+        listing.save(s3)
+        lambda_function.file_search.listing = listing
+        results[f"list_{count}_keys_indexed"] = measure(
+            lambda i: handler(event("GET", action="list", prefix=prefix, limit="30"), {}), iterations, trace_memory)
+        lambda_function.file_search.listing = None
+        s3.delete_object(Bucket=BUCKET_NAME, Key=listing.snapshot_key)
+
+    def upload_victim(i):
+        handler(event("POST", base64.b64encode(b"x").decode('ascii'), action="upload", fileName=f"delete/{i}.jpg",
+                      metadata="{}"), {})
+    results["delete"] = measure(lambda i: handler(event("GET", action="delete", imageName=f"delete/{i}.jpg"), {}),
+                                iterations, trace_memory, setup=upload_victim)
+
+    # The deferred delete: a tombstone and a queued name, purged later by the delete drain
+    lambda_function.image_handler.delete_queue = LocalQueue()
+    results["delete_queued"] = measure(
+        lambda i: handler(event("GET", action="delete", imageName=f"delete/{i}.jpg"), {}),
+        iterations, trace_memory, setup=upload_victim)
+    lambda_function.image_handler.delete_queue = None
+    return results
+
+
+def compare(results, baseline):
+    """
+    Prints the p50 change of every scenario present in both runs.
+    """
+    for name, scenario in results.items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before:
+            change = (scenario["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100 if before["p50_ms"] else 0.0
+            print(f"{name:24} p50 {before['p50_ms']:10.3f} -> {scenario['p50_ms']:10.3f} ms ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--upload-sizes", default=",".join(UPLOAD_SIZES),
+                        help="comma-separated subset of " + ", ".join(UPLOAD_SIZES))
+    parser.add_argument("--list-sizes", default=",".join(map(str, LIST_SIZES)),
+                        help="comma-separated key counts to seed for the list scenarios")
+    parser.add_argument("--trace-memory", action="store_true", help="also report peak Python allocations")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+    if mock_aws is None:
+        parser.error("the benchmark needs moto: pip install moto")
+
+    upload_sizes = {label: UPLOAD_SIZES[label] for label in args.upload_sizes.split(",") if label}
+    list_sizes = [int(count) for count in args.list_sizes.split(",") if count]
+    if args.trace_memory:
+        tracemalloc.start()
+
+    # The handler logs every event; keep that off the terminal but still pay for it
+    with mock_aws(), open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        scenarios = run(args.iterations, upload_sizes, list_sizes, args.trace_memory)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": args.iterations
+        },
+        "scenarios": scenarios
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(scenarios, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
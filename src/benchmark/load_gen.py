@@ -0,0 +1,159 @@
+"""
+HTTP load generator for the local server (file_manager.http_server), or any HTTP/1.1 endpoint.
+
+Opens --concurrency keep-alive connections. Each connection sends requests back to back, cycling
+through the given URLs, until --duration seconds have passed or --requests have been sent in all.
+It then reports the throughput, latency percentiles and status counts as JSON. "{i}" in a URL is
+replaced with the request's number, e.g. to give every upload its own name.
+
+    python -m assement.src.benchmark.load_gen "http://127.0.0.1:8080/?action=list&prefix=img" --concurrency 64
+    python -m assement.src.benchmark.load_gen "http://127.0.0.1:8080/?action=upload&fileName=load/{i}.jpg" \\
+        --method POST --body-file cat.jpg --content-type image/jpeg --requests 1000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+from assement.src.benchmark.handler_bench import percentile
+
+CONCURRENCY = 16
+DURATION = 10.0
+# Seconds to wait for one response before counting it as an error
+TIMEOUT = 30.0
+
+
+async def _read_response(reader):
+    """
+    Reads one response, Content-Length or chunked.
+    :return: the status code and whether the server keeps the connection open
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode('latin-1').partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if status == 100:
+        return await _read_response(reader)
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    else:
+        await reader.readexactly(int(headers.get("content-length", 0)))
+    return status, headers.get("connection", "").lower() != "close"
+
+
+async def _connection(urls, counter, deadline, limit, method, body, headers, samples, statuses, errors):
+    """
+    One client connection, sending requests until the deadline or the request limit; reconnects
+    when the server closes it.
+    """
+    reader = writer = None
+    try:
+        while time.monotonic() < deadline:
+            number = next(counter)
+            if limit is not None and number >= limit:
+                return
+            url = urlsplit(urls[number % len(urls)].replace("{i}", str(number)))
+            if writer is None:
+                reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+            target = (url.path or "/") + (f"?{url.query}" if url.query else "")
+            head = f"{method} {target} HTTP/1.1\r\nHost: {url.netloc}\r\nContent-Length: {len(body)}\r\n" + \
+                   "".join(f"{name}: {value}\r\n" for name, value in headers.items()) + "\r\n"
+            start = time.perf_counter()
+            try:
+                writer.write(head.encode('latin-1') + body)
+                await writer.drain()
+                status, keep_alive = await asyncio.wait_for(_read_response(reader), TIMEOUT)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+                errors[type(e).__name__] += 1
+                writer.close()
+                reader = writer = None
+                continue
+            samples.append((time.perf_counter() - start) * 1000)
+            statuses[str(status)] += 1
+            if not keep_alive:
+                writer.close()
+                reader = writer = None
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def run_load(urls, concurrency=CONCURRENCY, duration=DURATION, requests=None, method="GET", body=b"",
+                   headers=None):
+    """
+    :param urls: URLs to cycle through
+    :param duration: seconds to run for
+    :param requests: total requests to send, or None to run for the whole duration
+    :param body: request body bytes
+    :param headers: extra request headers
+    :return: the report: request and error counts, throughput, latency percentiles and status counts
+    """
+    samples, statuses, errors = [], Counter(), Counter()
+    counter = itertools.count()
+    start = time.monotonic()
+    await asyncio.gather(*(
+        _connection(urls, counter, start + duration, requests, method, body, headers or {}, samples, statuses, errors)
+        for _ in range(concurrency)
+    ))
+    elapsed = time.monotonic() - start
+    report = {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": dict(errors),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "statuses": dict(statuses)
+    }
+    if samples:
+        report.update({
+            "p50_ms": round(percentile(samples, 50), 3),
+            "p95_ms": round(percentile(samples, 95), 3),
+            "p99_ms": round(percentile(samples, 99), 3),
+            "max_ms": round(max(samples), 3),
+            "mean_ms": round(statistics.fmean(samples), 3)
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("urls", nargs="+", help="URLs to request, in turn")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds to run for")
+    parser.add_argument("--requests", type=int, help="stop after this many requests")
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--body-file", help="send this file as the request body")
+    parser.add_argument("--content-type", help="Content-Type of the body")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args()
+
+    body = b""
+    if args.body_file:
+        with open(args.body_file, "rb") as body_file:
+            body = body_file.read()
+    headers = {"Content-Type": args.content_type} if args.content_type else {}
+    duration = args.duration if args.requests is None else float("inf")
+    report = asyncio.run(run_load(args.urls, args.concurrency, duration, args.requests, args.method.upper(), body,
+                                  headers))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import json
+import re
+from decimal import Decimal, InvalidOperation
+from boto3.dynamodb.conditions import Key
+from assement.src.file_manager.concurrency import run_concurrently
+from assement.src.file_manager.db_client import SEARCH_SHARDS, search_shard
+
+# Numbers are indexed as fixed-width strings so they sort numerically; values outside
+# +/- NUMBER_LIMIT are stored on the row but not indexed.
+NUMBER_LIMIT = 10 ** 15
+NUMBER_PLACES = 6
+# Predicates matching more images than this are checked against the metadata rows instead
+MAX_POSTINGS = 50000
+# Separates the encoded value from the image id in a posting's sort key
+SEPARATOR = "\x1f"
+_PREDICATE = re.compile(r"^\s*([\w.-]+)\s*(>=|<=|=|>|<)\s*(.*?)\s*$")
+# Numbers DynamoDB can store: magnitudes within these bounds, with up to 38 significant digits
+DYNAMODB_NUMBER_MAX = Decimal("9.9999999999999999999999999999999999999E+125")
+DYNAMODB_NUMBER_MIN = Decimal("1E-130")
+DYNAMODB_NUMBER_DIGITS = 38
+
+
+def parse_metadata(metadata):
+    """
+    Turns upload metadata into the native value stored on the row: a JSON string is parsed,
+    with decimals as Decimal since DynamoDB has no floats. Text that is not JSON is kept as is.
+    :raises ValueError: when the JSON holds a number DynamoDB cannot store: NaN, Infinity, or
+                        one out of its range or with more than 38 significant digits
+    """
+    try:
+        text = metadata if isinstance(metadata, str) else json.dumps(metadata)
+        value = json.loads(text, parse_float=Decimal, parse_constant=Decimal)
+    except (TypeError, ValueError):
+        return metadata
+    _check_numbers(value)
+    return value
+
+
+def _check_numbers(value):
+    """
+    Raises ValueError for the first number in parsed metadata that DynamoDB would reject.
+    """
+    if isinstance(value, dict):
+        for element in value.values():
+            _check_numbers(element)
+    elif isinstance(value, list):
+        for element in value:
+            _check_numbers(element)
+    elif isinstance(value, (int, Decimal)) and not isinstance(value, bool):
+        number = Decimal(value)
+        digits = ''.join(map(str, number.as_tuple().digits)).strip('0') if number.is_finite() else ''
+        if not number.is_finite() or (number and not DYNAMODB_NUMBER_MIN <= abs(number) <= DYNAMODB_NUMBER_MAX) \
+                or len(digits) > DYNAMODB_NUMBER_DIGITS:
+            raise ValueError(f"Metadata number {value} cannot be stored: use finite numbers of magnitude "
+                             f"1E-130 to 9.99E+125 with at most {DYNAMODB_NUMBER_DIGITS} significant digits.")
+
+
+def parse_predicates(where):
+    """
+    Parses "format=JPEG;dimensions.width>=1920" into (attribute, operator, value) triples.
+    Values that look like numbers are compared as numbers.
+    :raises ValueError: when a predicate is malformed, or orders a string
+    """
+    predicates = []
+    for text in filter(None, (part.strip() for part in (where or '').split(';'))):
+        match = _PREDICATE.match(text)
+        if not match or not match.group(3):
+            raise ValueError(f"Invalid predicate '{text}'; use attribute=value, >=, <=, > or <.")
+        attribute, operator, value = match.groups()
+        value = _number(value) if _number(value) is not None else value
+        if operator != "=" and not isinstance(value, Decimal):
+            raise ValueError(f"'{attribute}{operator}' needs a number.")
+        predicates.append((attribute, operator, value))
+    if not predicates:
+        raise ValueError("Provide at least one predicate in 'where'.")
+    return predicates
+
+
+def matches(metadata, predicate):
+    """
+    Evaluates a predicate against a row's metadata; list values match if any element does.
+    """
+    attribute, operator, target = predicate
+    values = _lookup(metadata, attribute)
+    for value in values if isinstance(values, list) else [values]:
+        value = _indexable(value)
+        if value is None or isinstance(value, Decimal) != isinstance(target, Decimal):
+            continue
+        if (operator == "=" and value == target) or (operator == ">=" and value >= target) or \
+                (operator == "<=" and value <= target) or (operator == ">" and value > target) or \
+                (operator == "<" and value < target):
+            return True
+    return False
+
+
+def attribute_table_definition(table_name):
+    """
+    create_table arguments for the attribute value -> image table used by AttributeIndex.
+    """
+    return {
+        "TableName": table_name,
+        "KeySchema": [
+            {'AttributeName': 'posting', 'KeyType': 'HASH'},
+            {'AttributeName': 'entry', 'KeyType': 'RANGE'},
+        ],
+        "AttributeDefinitions": [
+            {'AttributeName': 'posting', 'AttributeType': 'S'},
+            {'AttributeName': 'entry', 'AttributeType': 'S'},
+        ],
+        "BillingMode": 'PAY_PER_REQUEST',
+    }
+
+
+class AttributeIndex:
+    """
+    Inverted index from metadata attribute values to images, for a configured set of attributes
+    (dotted paths into the metadata map, e.g. "dimensions.width"). Postings are partitioned like
+    the search GSIs: "<attribute>#<search_shard>", sorted by encoded value and then image id,
+    so equality and numeric range predicates are each one Query per shard.
+    """
+
+    def __init__(self, db_client, attributes):
+        self.db_client = db_client
+        self.attributes = tuple(attributes)
+
+    def update(self, old_items=(), new_items=()):
+        """
+        Replaces the postings of removed or overwritten rows with those of the rows written.
+        :return: write requests still unprocessed after the retries
+        """
+        old = {key: posting for item in old_items if item for key, posting in self._postings(item)}
+        new = {key: posting for item in new_items for key, posting in self._postings(item)}
+        return self.db_client.batch_write_items(
+            items=[posting for key, posting in new.items() if key not in old],
+            delete_keys=[{"posting": posting, "entry": entry} for posting, entry in old if (posting, entry) not in new]
+        )
+
+    def lookup(self, predicate):
+        """
+        Reads the images matching one predicate from every shard.
+        :return: (set of image ids, False if a shard had more than MAX_POSTINGS and the set is partial)
+        :raises ValueError: when the attribute is not indexed
+        """
+        attribute, operator, value = predicate
+        if attribute not in self.attributes:
+            raise ValueError(f"'{attribute}' is not indexed; indexed attributes are {', '.join(self.attributes)}.")
+        if isinstance(value, Decimal) and abs(value) >= NUMBER_LIMIT:
+            raise ValueError(f"Numbers in predicates must be within +/-{NUMBER_LIMIT}.")
+        encoded = _encode(value)
+        if operator == "=":
+            condition = Key('entry').begins_with(encoded + SEPARATOR)
+        elif operator in (">=", ">"):
+            condition = Key('entry').between(encoded, "n;")
+        else:
+            condition = Key('entry').between("n:", encoded + chr(ord(SEPARATOR) + 1))
+
+        shards = run_concurrently(*(
+            (lambda shard=shard: self._query(f"{attribute}#{shard}", condition)) for shard in range(SEARCH_SHARDS)))
+        image_ids = set()
+        complete = True
+        for shard in shards:
+            postings, shard_complete = shard.result()
+            complete = complete and shard_complete
+            # The encoding rounds to NUMBER_PLACES and ranges are inclusive, so check the exact values
+            image_ids.update(posting["image_id"] for posting in postings
+                             if matches({"value": posting["value"]}, ("value", operator, value)))
+        return image_ids, complete
+
+    def _query(self, posting, condition):
+        items = []
+        start_key = None
+        while len(items) <= MAX_POSTINGS:
+            response = self.db_client.query_items(Key('posting').eq(posting) & condition, MAX_POSTINGS + 1 - len(items),
+                                                  start_key)
+            items.extend(response.get('Items', []))
+            start_key = response.get('LastEvaluatedKey')
+            if not start_key:
+                return items, True
+        return items, False
+
+    def _postings(self, item):
+        """
+        ((posting, entry), posting item) for every indexed value of a metadata row.
+        """
+        metadata = item.get("metadata")
+        if not isinstance(metadata, dict):
+            return
+        shard = search_shard(item["image_id"])
+        for attribute in self.attributes:
+            values = _lookup(metadata, attribute)
+            for value in values if isinstance(values, list) else [values]:
+                value = _indexable(value)
+                if value is None:
+                    continue
+                key = (f"{attribute}#{shard}", f"{_encode(value)}{SEPARATOR}{item['image_id']}")
+                yield key, {"posting": key[0], "entry": key[1], "image_id": item["image_id"], "value": value}
+
+
+def _lookup(metadata, attribute):
+    value = metadata
+    for name in attribute.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(name)
+    return value
+
+
+def _number(text):
+    try:
+        number = Decimal(text)
+    except InvalidOperation:
+        return None
+    return number if number.is_finite() else None
+
+
+def _indexable(value):
+    """
+    The value as a string or Decimal, or None for values that are not indexed.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        value = Decimal(str(value))
+        return value if abs(value) < NUMBER_LIMIT else None
+    return value if isinstance(value, str) else None
+
+
+def _encode(value):
+    """
+    Sort-preserving string form: "n:" plus a fixed-width offset number, or "s:" plus the string.
+    """
+    if isinstance(value, Decimal):
+        offset = (value + NUMBER_LIMIT).quantize(Decimal(1).scaleb(-NUMBER_PLACES))
+        return "n:" + format(offset, f"0{len(str(NUMBER_LIMIT)) + NUMBER_PLACES + 1}.{NUMBER_PLACES}f")
+    return "s:" + value
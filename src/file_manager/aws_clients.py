@@ -0,0 +1,85 @@
+import threading
+import boto3
+from botocore.config import Config
+from assement.src.file_manager import metrics, rate_limit
+
+# One tuned config for every client: a connection pool large enough for the
+# concurrent calls a request makes, TCP keep-alive so warm containers reuse
+# connections, short connect timeouts and adaptive (client-side rate limited) retries.
+CLIENT_CONFIG = Config(
+    max_pool_connections=32,
+    tcp_keepalive=True,
+    connect_timeout=2,
+    read_timeout=10,
+    retries={"max_attempts": 5, "mode": "adaptive"}
+)
+# DynamoDB calls are paced by rate_limit's per-table limiters instead of botocore's per-client one,
+# so they retry in standard mode: exponential backoff with full jitter.
+DYNAMODB_CONFIG = CLIENT_CONFIG.merge(Config(retries={"max_attempts": 6, "mode": "standard"}))
+
+_session = None
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_session():
+    """
+    The boto3 session shared by every client in this container, created on first use.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = boto3.session.Session()
+        return _session
+
+
+def client(service_name, endpoint_url=None, aws_access_key_id=None, aws_secret_access_key=None, region_name='us-east-1'):
+    """
+    Returns the shared low-level client for these connection settings, creating it on first use.
+    """
+    return _get('client', service_name, endpoint_url, aws_access_key_id, aws_secret_access_key, region_name)
+
+
+def resource(service_name, endpoint_url=None, aws_access_key_id=None, aws_secret_access_key=None, region_name='us-east-1'):
+    """
+    Returns the shared resource for these connection settings, creating it on first use.
+    """
+    return _get('resource', service_name, endpoint_url, aws_access_key_id, aws_secret_access_key, region_name)
+
+
+def reset():
+    """
+    Drops every cached client and the DynamoDB rate limiters, e.g. between tests or benchmark runs.
+    """
+    global _session
+    with _lock:
+        _clients.clear()
+        _session = None
+    rate_limit.reset()
+
+
+def _get(kind, service_name, endpoint_url, aws_access_key_id, aws_secret_access_key, region_name):
+    key = (kind, service_name, endpoint_url, aws_access_key_id, aws_secret_access_key, region_name)
+    existing = _clients.get(key)
+    if existing is not None:
+        return existing
+
+    session = get_session()
+    # boto3 sessions are not thread-safe while building clients
+    with _lock:
+        if key not in _clients:
+            factory = session.client if kind == 'client' else session.resource
+            created = factory(
+                service_name,
+                endpoint_url=endpoint_url,
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                region_name=region_name,
+                config=DYNAMODB_CONFIG if service_name == 'dynamodb' else CLIENT_CONFIG
+            )
+            events = (created if kind == 'client' else created.meta.client).meta.events
+            metrics.instrument(events)
+            if service_name == 'dynamodb':
+                rate_limit.install(events)
+            _clients[key] = created
+        return _clients[key]
@@ -0,0 +1,102 @@
+import hashlib
+import uuid
+from botocore.exceptions import ClientError
+from assement.src.file_manager.key_layout import BLOB_PREFIX
+from assement.src.file_manager.streaming import put_stream
+
+
+def content_hash(content):
+    """
+    sha256 of the content, hashed in place through a memoryview so the bytes are not copied.
+    """
+    return hashlib.sha256(memoryview(content)).hexdigest()
+
+
+def blob_table_definition(table_name):
+    """
+    create_table arguments for the hash -> object table used by BlobStore.
+    """
+    return {
+        "TableName": table_name,
+        "KeySchema": [{'AttributeName': 'content_hash', 'KeyType': 'HASH'}],
+        "AttributeDefinitions": [{'AttributeName': 'content_hash', 'AttributeType': 'S'}],
+        "BillingMode": 'PAY_PER_REQUEST',
+    }
+
+
+class BlobStore:
+    """
+    Content-addressed storage: one S3 object per distinct content, shared by every image
+    name with that content and reference counted in a DynamoDB table keyed on content_hash.
+
+    Every blob row gets a fresh object key when it is created, so an upload that races
+    with the removal of the last reference writes a new object instead of one being deleted.
+    A row is only marked `stored` once its object has been written; until then every upload
+    of that content writes the object itself, so no name points at a blob that is not in S3.
+    """
+
+    def __init__(self, db_client, bucket_name):
+        self.db_client = db_client
+        self.bucket_name = bucket_name
+
+    def acquire(self, s3, content, digest, content_type):
+        """
+        Takes a reference on the blob for `digest`, storing the content only if no blob exists yet.
+        :param content: bytes or a streaming.Base64Reader
+        :return: (object key of the blob, True if this call wrote the content)
+        """
+        new_key = f"{BLOB_PREFIX}{digest}/{uuid.uuid4().hex}"
+        blob = self.db_client.table.update_item(
+            Key={"content_hash": digest},
+            UpdateExpression="ADD ref_count :one SET object_key = if_not_exists(object_key, :key), "
+                             "#size = if_not_exists(#size, :size), content_type = if_not_exists(content_type, :type)",
+            ExpressionAttributeNames={"#size": "size"},
+            ExpressionAttributeValues={":one": 1, ":key": new_key, ":size": len(content), ":type": content_type},
+            ReturnValues="ALL_NEW"
+        )["Attributes"]
+        # A blob already in S3 only needs the reference; it keeps its key either way
+        if blob.get("stored"):
+            return blob["object_key"], False
+
+        # A new row, or one whose first upload is still (or never finished) writing: the content
+        # is the same, so writing it under the blob's key again is harmless
+        try:
+            put_stream(s3, self.bucket_name, blob["object_key"], content, content_type)
+            self.db_client.table.update_item(
+                Key={"content_hash": digest},
+                UpdateExpression="SET #stored = :stored",
+                ExpressionAttributeNames={"#stored": "stored"},
+                ExpressionAttributeValues={":stored": True}
+            )
+        except Exception:
+            self.release(s3, digest)
+            raise
+        return blob["object_key"], True
+
+    def release(self, s3, digest):
+        """
+        Drops one reference; the last one removes the blob row and then its S3 object.
+        :return: True if the blob was removed
+        """
+        try:
+            attributes = self.db_client.table.update_item(
+                Key={"content_hash": digest},
+                UpdateExpression="ADD ref_count :minus_one",
+                ConditionExpression="attribute_exists(content_hash)",
+                ExpressionAttributeValues={":minus_one": -1},
+                ReturnValues="ALL_NEW"
+            )["Attributes"]
+            if attributes["ref_count"] > 0:
+                return False
+            # Only remove the row if no upload took a new reference in the meantime
+            self.db_client.table.delete_item(
+                Key={"content_hash": digest},
+                ConditionExpression="ref_count <= :zero",
+                ExpressionAttributeValues={":zero": 0}
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+        s3.delete_object(Bucket=self.bucket_name, Key=attributes["object_key"])
+        return True
@@ -0,0 +1,61 @@
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Shared by every request in the container; matches the client connection pool
+# in aws_clients.CLIENT_CONFIG so pooled calls never queue for a connection.
+MAX_WORKERS = 32
+
+_executor = None
+_lock = threading.Lock()
+# Marks the pool's threads: a call running there must not wait on the pool itself
+_local = threading.local()
+
+
+def executor():
+    """
+    The bounded thread pool shared by every handler, created on first use.
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="aws-call")
+        return _executor
+
+
+def run_concurrently(*calls):
+    """
+    Runs independent zero-argument callables at the same time and waits for all of them.
+    The first call runs on the current thread, so only the others use the pool; each
+    call sees the caller's context variables (e.g. the request's metrics).
+    Called from a pool thread, every call runs inline: with all workers waiting on tasks
+    queued behind them, the pool would deadlock.
+    :return: one completed Future per call, in order; check .exception() before .result()
+    """
+    if not calls or getattr(_local, 'pooled', False):
+        return [_completed(call) for call in calls]
+    futures = [executor().submit(contextvars.copy_context().run, _pooled, call) for call in calls[1:]]
+    first = _completed(calls[0])
+    for future in futures:
+        future.exception()  # waits without raising
+    return [first] + futures
+
+
+def _pooled(call):
+    _local.pooled = True
+    try:
+        return call()
+    finally:
+        _local.pooled = False
+
+
+def _completed(call):
+    """
+    Runs a call on the current thread, into a completed Future.
+    """
+    future = Future()
+    try:
+        future.set_result(call())
+    except Exception as e:
+        future.set_exception(e)
+    return future
@@ -0,0 +1,115 @@
+import base64
+import gzip
+import hashlib
+from assement.src.file_manager.metrics import stage
+
+# Smaller bodies are sent as-is: gzip saves little on them and base64 adds a third back
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+
+def make_etag(*parts):
+    """
+    Weak ETag over a response's validators (S3 ETags and modification times, metadata versions).
+    Weak, so the gzip and identity encodings of a response share it.
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return f'W/"{digest.hexdigest()}"'
+
+
+def request_headers(event):
+    """
+    The request's headers, with lowercase names.
+    """
+    return {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+
+
+def is_current(headers, etag):
+    """
+    True if the request's If-None-Match says the client already has this ETag.
+    :param headers: request headers with lowercase names
+    """
+    return bool(etag) and _matches(headers.get('if-none-match'), etag)
+
+
+def parse_range(range_header, max_length):
+    """
+    Turns a single-range Range header into the Range of an S3 GET, shortened to at most
+    max_length bytes. The 206 response's Content-Range tells the client what it got, so it
+    can ask for the rest.
+    :return: the S3 Range, or None when the header is not one byte range, which is then ignored
+    """
+    unit, _, spec = (range_header or '').partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if not first:
+            return f"bytes=-{min(int(last), max_length)}" if int(last) > 0 else None
+        start = int(first)
+        end = start + max_length - 1 if not last else min(int(last), start + max_length - 1)
+    except ValueError:
+        return None
+    return f"bytes={start}-{end}" if 0 <= start <= end else None
+
+
+def finalize(event, response):
+    """
+    Applies the request's If-None-Match and Accept-Encoding headers to a GET response:
+    a 304 when the client's copy is current, otherwise the body gzipped when it is large.
+    Binary bodies are already base64 and are left as they are.
+    """
+    if response.get('statusCode') != 200:
+        return response
+    headers_in = request_headers(event)
+    headers = dict(response.get('headers') or {})
+    etag = headers.get('ETag')
+    if is_current(headers_in, etag):
+        return {"statusCode": 304, "headers": {"ETag": etag}, "body": ""}
+
+    headers['Vary'] = 'Accept-Encoding'
+    body = response.get('body') or ''
+    if response.get('isBase64Encoded'):
+        return {**response, "headers": headers}
+    if len(body) >= GZIP_MIN_BYTES and _accepts_gzip(headers_in.get('accept-encoding')):
+        with stage("gzip"):
+            compressed = gzip.compress(body.encode('utf-8'), compresslevel=GZIP_LEVEL, mtime=0)
+        headers['Content-Encoding'] = 'gzip'
+        return {**response, "headers": headers, "body": base64.b64encode(compressed).decode('ascii'),
+                "isBase64Encoded": True}
+    return {**response, "headers": headers}
+
+
+def _matches(if_none_match, etag):
+    """
+    Weak comparison of the ETag against an If-None-Match list (or *).
+    """
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix('W/')
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == opaque:
+            return True
+    return False
+
+
+def _accepts_gzip(accept_encoding):
+    """
+    True if gzip (or *) is listed in Accept-Encoding without q=0.
+    """
+    for coding in (accept_encoding or '').split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() not in ('gzip', '*'):
+            continue
+        quality = params.strip().lower()
+        if quality.startswith('q='):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
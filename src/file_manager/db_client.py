@@ -1,53 +1,585 @@
-import boto3
 from botocore.exceptions import ClientError
 import json
+import random
+import threading
+import time
+from collections import deque
+import zlib
+from datetime import timezone
+from decimal import Decimal
+from assement.src.file_manager import aws_clients, rate_limit
+
+try:
+    import orjson
+except ImportError:  # optional: the standard library encoder is used without it
+    orjson = None
+
+# Search GSIs. Both are partitioned on search_shard so a range query is spread
+# over SEARCH_SHARDS partitions instead of one hot index partition.
+SIZE_INDEX = "size-index"
+UPLOADED_AT_INDEX = "uploaded-at-index"
+SEARCH_SHARDS = 8
+
+# BatchGetItem / BatchWriteItem request limits, and how often unprocessed
+# keys are retried (with exponential backoff) before giving up on them.
+BATCH_GET_LIMIT = 100
+BATCH_WRITE_LIMIT = 25
+BATCH_RETRIES = 5
+BATCH_BACKOFF = 0.05
+# Seconds a batch_write_items call waits for the coalesced batches carrying its requests
+WRITE_TIMEOUT = 60
+
+
+def search_shard(image_id):
+    """
+    Stable search_shard value for an image.
+    """
+    return str(zlib.crc32(image_id.encode('utf-8')) % SEARCH_SHARDS)
+
+
+def format_timestamp(dt):
+    """
+    Formats a datetime as a fixed-width UTC ISO string, so stored timestamps sort lexically.
+    Naive datetimes are taken to be UTC.
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat(timespec='microseconds')
+
+
+def _backoff(attempt):
+    """
+    Seconds to wait before retrying unprocessed batch requests: exponential, with full jitter
+    so that callers throttled together do not all retry together.
+    """
+    return random.uniform(0, BATCH_BACKOFF * 2 ** attempt)
+
+
+def _projection(attributes):
+    """
+    ProjectionExpression parameters for a read of just these attributes (none for all of them).
+    Names go through placeholders, since some, such as "size", are reserved words.
+    """
+    if not attributes:
+        return {}
+    names = {f"#a{i}": name for i, name in enumerate(attributes)}
+    return {"ProjectionExpression": ", ".join(names), "ExpressionAttributeNames": names}
+
+
+def json_default(value):
+    """
+    json.dumps hook for the Decimal numbers and sets boto3 returns for DynamoDB attributes.
+    """
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+_ENCODER = json.JSONEncoder(default=json_default, separators=(',', ':'))
+
+
+def encode_json(value):
+    """
+    Compact JSON text for a response body, handling the Decimal numbers and sets boto3 returns.
+    Uses orjson when it is installed, otherwise the standard library encoder.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=json_default).decode('utf-8')
+    return _ENCODER.encode(value)
+
+
+def table_definition(table_name):
+    """
+    create_table arguments for the metadata table: keyed on image_id, with the size and
+    upload-date search GSIs. Shared by provisioning and the benchmarks so they match the code.
+    """
+    return {
+        "TableName": table_name,
+        "KeySchema": [{'AttributeName': 'image_id', 'KeyType': 'HASH'}],
+        "AttributeDefinitions": [
+            {'AttributeName': 'image_id', 'AttributeType': 'S'},
+            {'AttributeName': 'search_shard', 'AttributeType': 'S'},
+            {'AttributeName': 'size', 'AttributeType': 'N'},
+            {'AttributeName': 'uploaded_at', 'AttributeType': 'S'},
+        ],
+        "GlobalSecondaryIndexes": [
+            {
+                'IndexName': index_name,
+                'KeySchema': [
+                    {'AttributeName': 'search_shard', 'KeyType': 'HASH'},
+                    {'AttributeName': sort_key, 'KeyType': 'RANGE'},
+                ],
+                'Projection': {'ProjectionType': 'INCLUDE',
+                               'NonKeyAttributes': ['size', 'content_type', 'uploaded_at']},
+            }
+            for index_name, sort_key in [(SIZE_INDEX, 'size'), (UPLOADED_AT_INDEX, 'uploaded_at')]
+        ],
+        "BillingMode": 'PAY_PER_REQUEST',
+    }
+
 
 class DynamoDBClient:
-    def __init__(self, table_name, region_name='us-east-1', aws_access_key_id="test", aws_secret_access_key="test"):
+    def __init__(self, table_name, region_name='us-east-1', aws_access_key_id="test", aws_secret_access_key="test",
+                 endpoint_url="http://localhost:4566"):
         self.table_name = table_name
-        self.dynamodb = boto3.resource(
-            'dynamodb',
-            region_name=region_name,
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            endpoint_url="http://localhost:4566"
+        # The resource and table are built on first use, from the shared client registry
+        self._aws_config = {
+            "region_name": region_name,
+            "aws_access_key_id": aws_access_key_id,
+            "aws_secret_access_key": aws_secret_access_key,
+            "endpoint_url": endpoint_url
+        }
+        self._dynamodb = None
+        self._table = None
+
+    @property
+    def dynamodb(self):
+        if self._dynamodb is None:
+            self._dynamodb = aws_clients.resource('dynamodb', **self._aws_config)
+        return self._dynamodb
+
+    @dynamodb.setter
+    def dynamodb(self, value):
+        self._dynamodb = value
+        self._table = None
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = self.dynamodb.Table(self.table_name)
+        return self._table
+
+    @table.setter
+    def table(self, value):
+        self._table = value
+
+    @property
+    def limiter(self):
+        """
+        The container's rate limiter for this table, shared by every client of it.
+        """
+        return rate_limit.limiter(self.table_name)
+
+    def replace_item(self, item):
+        """
+        Puts an item and returns the one it replaced.
+        :return: the old item, or None; ClientError is left to the caller
+        """
+        return self.table.put_item(Item=item, ReturnValues='ALL_OLD').get('Attributes')
+
+    def restore_item(self, key, previous, uploaded_at):
+        """
+        Undoes the put of an item: puts back the item it replaced, or deletes it if it replaced none,
+        provided it is still the item written at uploaded_at.
+        :param previous: the replaced item, as returned by replace_item
+        :return: False if the item changed since; ClientError other than the failed condition is left to the caller
+        """
+        condition = {"ConditionExpression": "uploaded_at = :uploaded_at",
+                     "ExpressionAttributeValues": {":uploaded_at": uploaded_at}}
+        try:
+            if previous:
+                self.table.put_item(Item=previous, **condition)
+            else:
+                self.table.delete_item(Key=key, **condition)
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return False
+
+    def remove_item(self, key):
+        """
+        Deletes an item and returns it.
+        :return: the deleted item, or None if there was none; ClientError is left to the caller
+        """
+        return self.table.delete_item(Key=key, ReturnValues='ALL_OLD').get('Attributes')
+
+    def insert_item(self, item, key_name):
+        """
+        Puts an item, provided there is none under its key.
+        :return: False if there was one; ClientError other than the failed condition is left to the caller
+        """
+        try:
+            self.table.put_item(Item=item, ConditionExpression="attribute_not_exists(#key)",
+                                ExpressionAttributeNames={"#key": key_name})
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return False
+
+    def add_to_set(self, key, attribute, values):
+        """
+        Adds strings to a string-set attribute of an existing item; does nothing if the item is gone.
+        ClientError other than the missing item is left to the caller.
+        """
+        try:
+            self.table.update_item(
+                Key=key,
+                UpdateExpression="ADD #attribute :values",
+                ConditionExpression="attribute_exists(#key)",
+                ExpressionAttributeNames={"#attribute": attribute, "#key": next(iter(key))},
+                ExpressionAttributeValues={":values": set(values)}
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+    def add(self, key, attribute, value):
+        """
+        Adds to a number attribute, or adds values to a set attribute, creating the item if there is none.
+        :param value: a number, or a set of strings
+        ClientError is left to the caller.
+        """
+        self.table.update_item(
+            Key=key,
+            UpdateExpression="ADD #attribute :value",
+            ExpressionAttributeNames={"#attribute": attribute},
+            ExpressionAttributeValues={":value": value}
         )
-        self.table = self.dynamodb.Table(table_name)
 
-    def write_item(self, item):
+    def tombstone(self, key, deleted_at):
         """
-        :param item: Dictionary containing the item
-        :return: response
+        Marks an existing item deleted, keeping the first deletion time, and drops it from the
+        search GSIs by removing its search_shard. Does nothing if the item is gone.
+        :param deleted_at: format_timestamp string
+        :return: the item as it was before, or None if there was none; ClientError is left to the caller
         """
         try:
-            response = self.table.put_item(Item=item)
-            return {"statusCode": 200, "body": json.dumps({"message": "Item successfully written to DynamoDB", "response": response})}
+            return self.table.update_item(
+                Key=key,
+                UpdateExpression="SET deleted_at = if_not_exists(deleted_at, :now) REMOVE search_shard",
+                ConditionExpression="attribute_exists(#key)",
+                ExpressionAttributeNames={"#key": next(iter(key))},
+                ExpressionAttributeValues={":now": deleted_at},
+                ReturnValues='ALL_OLD'
+            ).get('Attributes')
         except ClientError as e:
-            return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return None
 
-    def read_item(self, key):
+    def remove_tombstone(self, key, deleted_at):
         """
-        Reads an item from the DynamoDB table using the primary key.
-        :param key: Dictionary containing the key to look up the item.
-        :return: response
+        Deletes an item marked deleted at deleted_at, provided it has not been written again since.
+        :return: the deleted item, or None if it changed or was gone; ClientError other than the
+                 failed condition is left to the caller
         """
         try:
-            response = self.table.get_item(Key=key)
-            if 'Item' in response:
-                return {"statusCode": 200, "body": json.dumps({"message": "Item found", "data": response['Item']})}
-            else:
-                return {"statusCode": 404, "body": json.dumps({"error": "Item not found"})}
+            return self.table.delete_item(
+                Key=key,
+                ConditionExpression="deleted_at = :seen",
+                ExpressionAttributeValues={":seen": deleted_at},
+                ReturnValues='ALL_OLD'
+            ).get('Attributes')
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return None
+
+    def move_object(self, key, object_key, moved_from, uploaded_at, moved_at):
+        """
+        Points an item at the copy of its object under object_key, remembering the key it was
+        copied from, provided the item is still the upload that was copied: same uploaded_at,
+        not deleted, not deduplicated and not in the middle of another move.
+        :param moved_at: format_timestamp string
+        :return: True if the item was updated; ClientError other than the failed condition is left to the caller
+        """
+        try:
+            self.table.update_item(
+                Key=key,
+                UpdateExpression="SET object_key = :key, moved_from = :from, moved_at = :now",
+                ConditionExpression="uploaded_at = :uploaded_at AND attribute_not_exists(deleted_at) "
+                                    "AND attribute_not_exists(content_hash) AND attribute_not_exists(moved_from)",
+                ExpressionAttributeValues={":key": object_key, ":from": moved_from, ":now": moved_at,
+                                           ":uploaded_at": uploaded_at}
+            )
+            return True
         except ClientError as e:
-            return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return False
 
-    def delete_item(self, key):
+    def clear_moved(self, key, moved_from):
         """
-        Deletes an item from the DynamoDB table.
-        :param key: Dictionary containing the key to delete the item.
-        :return: response from DynamoDB
+        Forgets the key an item's object was moved from, before that object is deleted.
+        :return: False if the item no longer records that key; ClientError other than the failed
+                 condition is left to the caller
         """
         try:
-            response = self.table.delete_item(Key=key)
-            return {"statusCode": 200, "body": json.dumps({"message": "Item successfully deleted", "response": response})}
+            self.table.update_item(
+                Key=key,
+                UpdateExpression="REMOVE moved_from, moved_at",
+                ConditionExpression="moved_from = :from",
+                ExpressionAttributeValues={":from": moved_from}
+            )
+            return True
         except ClientError as e:
-            return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return False
+
+    def get_item(self, key, attributes=None, consistent_read=False):
+        """
+        Reads one item as native Python values (numbers as Decimal).
+        :param key: Dictionary containing the key to look up the item.
+        :param attributes: names of the attributes to fetch, or None for the whole item
+        :param consistent_read: True for a strongly consistent read, at twice the read cost
+        :return: the item, or None if there is none; ClientError is left to the caller
+        """
+        return self.table.get_item(Key=key, ConsistentRead=consistent_read, **_projection(attributes)).get('Item')
+
+    def query_index(self, index_name, key_condition, limit, exclusive_start_key=None):
+        """
+        Runs one Query page against a secondary index.
+        :param index_name: GSI name, e.g. SIZE_INDEX
+        :param key_condition: boto3 Key condition expression
+        :param limit: maximum number of items to return
+        :param exclusive_start_key: LastEvaluatedKey of the previous page
+        :return: raw Query response; ClientError is left to the caller
+        """
+        params = {"IndexName": index_name, "KeyConditionExpression": key_condition, "Limit": limit}
+        if exclusive_start_key:
+            params["ExclusiveStartKey"] = exclusive_start_key
+        return self.table.query(**params)
+
+    def query_items(self, key_condition, limit, exclusive_start_key=None, consistent_read=False):
+        """
+        Runs one Query page against the table itself.
+        :param key_condition: boto3 Key condition expression on the table's keys
+        :param limit: maximum number of items to return
+        :param exclusive_start_key: LastEvaluatedKey of the previous page
+        :return: raw Query response; ClientError is left to the caller
+        """
+        params = {"KeyConditionExpression": key_condition, "Limit": limit}
+        if consistent_read:
+            params["ConsistentRead"] = True
+        if exclusive_start_key:
+            params["ExclusiveStartKey"] = exclusive_start_key
+        return self.table.query(**params)
+
+    def scan_items(self, segment, total_segments, exclusive_start_key=None, attributes=None):
+        """
+        Runs one page of one segment of a parallel Scan.
+        :param segment: this worker's segment, 0 to total_segments - 1
+        :param total_segments: how many segments the table is split into
+        :param exclusive_start_key: LastEvaluatedKey of the segment's previous page
+        :param attributes: names of the attributes to fetch, or None for whole items
+        :return: raw Scan response; ClientError is left to the caller
+        """
+        params = {"Segment": segment, "TotalSegments": total_segments, **_projection(attributes)}
+        if exclusive_start_key:
+            params["ExclusiveStartKey"] = exclusive_start_key
+        return self.table.scan(**params)
+
+    def batch_read_items(self, keys, attributes=None, consistent_read=False):
+        """
+        Reads many items with BatchGetItem, retrying UnprocessedKeys.
+        :param keys: list of key dictionaries
+        :param attributes: names of the attributes to fetch, or None for whole items
+        :param consistent_read: True for strongly consistent reads, at twice the read cost
+        :return: (items found, keys still unprocessed after the retries); ClientError is left to the caller
+        """
+        items, unprocessed = [], []
+        for start in range(0, len(keys), BATCH_GET_LIMIT):
+            request = {self.table_name: {"Keys": keys[start:start + BATCH_GET_LIMIT], "ConsistentRead": consistent_read,
+                                         **_projection(attributes)}}
+            for attempt in range(BATCH_RETRIES + 1):
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                items.extend(response.get('Responses', {}).get(self.table_name, []))
+                request = response.get('UnprocessedKeys') or {}
+                if not request:
+                    break
+                if attempt < BATCH_RETRIES:
+                    time.sleep(_backoff(attempt))
+            if request:
+                unprocessed.extend(request[self.table_name]["Keys"])
+        return items, unprocessed
+
+    def batch_write_items(self, items=(), delete_keys=()):
+        """
+        Puts and deletes many items with BatchWriteItem, retrying UnprocessedItems. The requests
+        share batches with those of concurrent calls on the same connection, whatever their table.
+        :param items: items to put
+        :param delete_keys: key dictionaries of items to delete
+        :return: write requests still unprocessed after the retries; ClientError is left to the caller
+        """
+        requests = [{"PutRequest": {"Item": item}} for item in items]
+        requests += [{"DeleteRequest": {"Key": key}} for key in delete_keys]
+        if not requests:
+            return []
+        # The key schema is read once per table resource; it lets writes of one key be told apart
+        key_names = [element["AttributeName"] for element in self.table.key_schema]
+        return _coalescer(self.dynamodb).write([(self.table_name, request, _request_key(request, key_names))
+                                                for request in requests])
+
+
+def _request_key(request, key_names):
+    """
+    The primary key a write request writes, as a hashable tuple; None when the key schema is unknown.
+    """
+    if not key_names:
+        return None
+    attributes = request["PutRequest"]["Item"] if "PutRequest" in request else request["DeleteRequest"]["Key"]
+    return tuple(attributes.get(name) for name in key_names)
+
+
+class _Ticket:
+    """
+    One batch_write_items call's share of the coalesced batches.
+    """
+
+    def __init__(self, pending):
+        self.pending = pending
+        self.unprocessed = []
+        self.error = None
+        self.done = threading.Event()
+
+    def resolve(self, unprocessed=None):
+        if unprocessed is not None:
+            self.unprocessed.append(unprocessed)
+        self.pending -= 1
+        if not self.pending:
+            self.done.set()
+
+
+class _WriteCoalescer:
+    """
+    Group commit for BatchWriteItem. Concurrent batch_write_items calls on one resource, such as
+    the trigram and attribute index updates of an upload, share 25-request batches across tables
+    instead of each sending partial ones. A caller that finds no batch in flight sends everything
+    queued: its own requests and those of callers arriving meanwhile, who wait for it. Unprocessed
+    requests go back to the front of the queue, after a backoff.
+
+    DynamoDB rejects a batch that writes one key twice, so when two queued requests write the same
+    key only the later one is sent, as if they had run one after the other. A batch that fails as a
+    whole is sent again one caller at a time, so one caller's bad request does not fail the others.
+    """
+
+    def __init__(self, dynamodb):
+        self.dynamodb = dynamodb
+        self._queue = deque()
+        self._sending = False
+        self._batch = []  # the batch being sent
+        self._lock = threading.Lock()
+
+    def write(self, requests):
+        """
+        :param requests: (table name, write request, key from _request_key) triples
+        :return: the requests still unprocessed after the retries
+        """
+        ticket = _Ticket(len(requests))
+        # Per request: table name, request, ticket, retry round, key, sent without other tickets
+        with self._lock:
+            self._queue.extend([table_name, request, ticket, 0, key, False] for table_name, request, key in requests)
+            lead = not self._sending
+            self._sending = True
+        if lead:
+            self._drain()
+        if not ticket.done.wait(WRITE_TIMEOUT):
+            raise TimeoutError(f"Batch write not sent within {WRITE_TIMEOUT} seconds")
+        if ticket.error is not None:
+            raise ticket.error
+        return ticket.unprocessed
+
+    def _next_batch(self):
+        """
+        Takes up to BATCH_WRITE_LIMIT requests off the queue, with one request per key: a later
+        request for a key already in the batch replaces the earlier one, whose ticket is done.
+        A request queued to be sent alone only shares its batch with its own ticket's requests.
+        """
+        batch = {}
+        first = self._queue[0]
+        while self._queue and len(batch) < BATCH_WRITE_LIMIT:
+            entry = self._queue[0]
+            if (first[5] or entry[5]) and entry[2] is not first[2]:
+                break
+            self._queue.popleft()
+            key = (entry[0], entry[4]) if entry[4] is not None else id(entry)
+            superseded = batch.pop(key, None)
+            if superseded is not None:
+                superseded[2].resolve()
+            batch[key] = entry
+        return list(batch.values())
+
+    def _drain(self):
+        """
+        Sends batches until the queue is empty. Only one caller at a time runs this, so the
+        tickets are only ever updated from one thread. Should sending break off with an
+        unexpected error, every caller still waiting, this one included, gets that error, and
+        the next caller to arrive sends again.
+        """
+        self._batch = []
+        try:
+            self._send_batches()
+        except BaseException as e:
+            with self._lock:
+                stranded = self._batch + list(self._queue)
+                self._queue.clear()
+                self._sending = False
+            for ticket in {id(entry[2]): entry[2] for entry in stranded}.values():
+                ticket.error = e
+                ticket.done.set()
+            if not isinstance(e, Exception):
+                raise
+
+    def _send_batches(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._sending = False
+                    return
+                self._batch = batch = self._next_batch()
+            retry_round = max(entry[3] for entry in batch)
+            if retry_round:
+                time.sleep(_backoff(retry_round - 1))
+            request_items = {}
+            for entry in batch:
+                request_items.setdefault(entry[0], []).append(entry[1])
+            try:
+                response = self.dynamodb.batch_write_item(RequestItems=request_items)
+            except Exception as e:
+                if len({id(entry[2]) for entry in batch}) > 1:
+                    # Someone's request failed the whole batch: find out whose
+                    for entry in batch:
+                        entry[5] = True
+                    with self._lock:
+                        self._queue.extendleft(reversed(sorted(batch, key=lambda entry: id(entry[2]))))
+                    continue
+                for entry in batch:
+                    entry[2].error = e
+                    entry[2].resolve()
+                continue
+
+            unprocessed = response.get('UnprocessedItems') or {}
+            retries = []
+            for entry in batch:
+                left = unprocessed.get(entry[0]) or []
+                if entry[1] not in left:
+                    entry[2].resolve()
+                    continue
+                left.remove(entry[1])
+                entry[3] += 1
+                if entry[3] > BATCH_RETRIES:
+                    entry[2].resolve(unprocessed=entry[1])
+                else:
+                    retries.append(entry)
+            with self._lock:
+                self._queue.extendleft(reversed(retries))
+
+
+_coalescers = {}
+_coalescers_lock = threading.Lock()
+
+
+def _coalescer(dynamodb):
+    """
+    The write coalescer of a DynamoDB resource; requests can only share a batch on the same connection.
+    """
+    with _coalescers_lock:
+        coalescer = _coalescers.get(id(dynamodb))
+        if coalescer is None or coalescer.dynamodb is not dynamodb:
+            coalescer = _coalescers[id(dynamodb)] = _WriteCoalescer(dynamodb)
+        return coalescer
@@ -0,0 +1,198 @@
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from assement.src.file_manager import aws_clients
+
+# Names per queue message (well under SQS's 256 KB), and messages per SQS batch call
+NAMES_PER_MESSAGE = 100
+SQS_BATCH = 10
+# Seconds a received message stays hidden from other consumers before it is delivered again
+VISIBILITY_TIMEOUT = 60
+# Names the drain gathers before purging them together: one S3 delete_objects call's worth
+DRAIN_BATCH = 1000
+# Seconds the drain waits for messages, and pauses after a failed purge
+DRAIN_WAIT = 1.0
+DRAIN_PAUSE = 5.0
+
+
+def _messages(image_names):
+    """
+    Splits names into queue message bodies.
+    """
+    image_names = list(image_names)
+    return [json.dumps({"names": image_names[start:start + NAMES_PER_MESSAGE]})
+            for start in range(0, len(image_names), NAMES_PER_MESSAGE)]
+
+
+class LocalQueue:
+    """
+    In-memory stand-in for the SQS delete queue, for local runs and tests. As with SQS, a message
+    that is received but not deleted is delivered again once its visibility timeout passes.
+    """
+
+    def __init__(self, visibility_timeout=VISIBILITY_TIMEOUT, clock=time.monotonic):
+        self.visibility_timeout = visibility_timeout
+        self.clock = clock
+        self._ready = deque()
+        self._in_flight = {}  # receipt -> (body, visible again at)
+        self._condition = threading.Condition()
+
+    def send(self, image_names):
+        with self._condition:
+            self._ready.extend(_messages(image_names))
+            self._condition.notify_all()
+
+    def receive(self, max_messages=SQS_BATCH, wait=0.0):
+        """
+        :param wait: seconds to wait for a message when there is none
+        :return: (receipt, names) of up to max_messages messages
+        """
+        with self._condition:
+            self._requeue_expired()
+            if not self._ready and wait:
+                self._condition.wait(wait)
+                self._requeue_expired()
+            received = []
+            while self._ready and len(received) < max_messages:
+                body = self._ready.popleft()
+                receipt = str(uuid.uuid4())
+                self._in_flight[receipt] = (body, self.clock() + self.visibility_timeout)
+                received.append((receipt, json.loads(body)["names"]))
+            return received
+
+    def delete(self, receipts):
+        with self._condition:
+            for receipt in receipts:
+                self._in_flight.pop(receipt, None)
+
+    def pending(self):
+        """
+        :return: messages waiting or received but not deleted yet
+        """
+        with self._condition:
+            return len(self._ready) + len(self._in_flight)
+
+    def _requeue_expired(self):
+        now = self.clock()
+        for receipt, (body, visible_at) in list(self._in_flight.items()):
+            if visible_at <= now:
+                del self._in_flight[receipt]
+                self._ready.append(body)
+
+
+class SQSQueue:
+    """
+    The delete queue in SQS. In AWS the function drains it as its SQS event source.
+    """
+
+    def __init__(self, queue_url, endpoint_url=None, aws_access_key_id="test", aws_secret_access_key="test",
+                 region_name='us-east-1'):
+        self.queue_url = queue_url
+        # The SQS client is built on first use, from the shared client registry
+        self._aws_config = {
+            "endpoint_url": endpoint_url,
+            "aws_access_key_id": aws_access_key_id,
+            "aws_secret_access_key": aws_secret_access_key,
+            "region_name": region_name
+        }
+        self._sqs = None
+
+    @property
+    def sqs(self):
+        if self._sqs is None:
+            self._sqs = aws_clients.client('sqs', **self._aws_config)
+        return self._sqs
+
+    def send(self, image_names):
+        """
+        :raises RuntimeError: when SQS refused some of the messages; ClientError is left to the caller
+        """
+        bodies = _messages(image_names)
+        for start in range(0, len(bodies), SQS_BATCH):
+            response = self.sqs.send_message_batch(QueueUrl=self.queue_url, Entries=[
+                {"Id": str(i), "MessageBody": body} for i, body in enumerate(bodies[start:start + SQS_BATCH])
+            ])
+            if response.get("Failed"):
+                raise RuntimeError(f"Delete queue refused {len(response['Failed'])} messages")
+
+    def receive(self, max_messages=SQS_BATCH, wait=0.0):
+        response = self.sqs.receive_message(QueueUrl=self.queue_url, MaxNumberOfMessages=min(max_messages, SQS_BATCH),
+                                            WaitTimeSeconds=int(wait))
+        return [(message["ReceiptHandle"], json.loads(message["Body"])["names"])
+                for message in response.get("Messages", [])]
+
+    def delete(self, receipts):
+        receipts = list(receipts)
+        for start in range(0, len(receipts), SQS_BATCH):
+            self.sqs.delete_message_batch(QueueUrl=self.queue_url, Entries=[
+                {"Id": str(i), "ReceiptHandle": receipt} for i, receipt in enumerate(receipts[start:start + SQS_BATCH])
+            ])
+
+
+class DeleteDrain:
+    """
+    Background stage that finishes tombstoned deletes. It gathers queued names into batches of up
+    to DRAIN_BATCH and purges them with FileHandler.purge. A message is deleted once all its names
+    are purged. Otherwise it is left to be delivered again, so failures are retried. Purging is
+    idempotent, so a message delivered twice does no harm.
+    """
+
+    def __init__(self, handler, queue, batch=DRAIN_BATCH, wait=DRAIN_WAIT):
+        self.handler = handler
+        self.queue = queue
+        self.batch = batch
+        self.wait = wait
+        self.purged = 0
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def drain_once(self):
+        """
+        Purges one batch of queued names.
+        :return: the number of messages received
+        """
+        messages = self.queue.receive(wait=self.wait)
+        if not messages:
+            return 0
+        while sum(len(names) for _, names in messages) < self.batch:
+            more = self.queue.receive()
+            if not more:
+                break
+            messages += more
+        retry = set(self.purge_messages(messages))
+        self.queue.delete(receipt for receipt, names in messages if retry.isdisjoint(names))
+        return len(messages)
+
+    def purge_messages(self, messages):
+        """
+        :param messages: (id, names) pairs
+        :return: names to retry
+        """
+        image_names = list(dict.fromkeys(name for _, names in messages for name in names))
+        retry = self.handler.purge(image_names)
+        self.purged += len(image_names) - len(retry)
+        return retry
+
+    def start(self):
+        """
+        Drains the queue on a daemon thread until stop() is called; used with the LocalQueue stand-in.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="delete-drain", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.drain_once()
+            except Exception as e:
+                print(f"Delete drain error: {e}")
+                self._stopped.wait(DRAIN_PAUSE)
@@ -1,21 +1,110 @@
-import boto3
 import json
 import base64
-from assement.src.file_manager.db_client import DynamoDBClient
+import mimetypes
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+from assement.src.file_manager import aws_clients
+from assement.src.file_manager.db_client import DynamoDBClient, search_shard, format_timestamp, encode_json
+from assement.src.file_manager.blob_store import BlobStore
+from assement.src.file_manager.cache import LRUCache
+from assement.src.file_manager.concurrency import run_concurrently
+from assement.src.file_manager.conditional import is_current, make_etag, parse_range
+from assement.src.file_manager.metrics import stage
+from assement.src.file_manager.ngram_index import NGramIndex
+from assement.src.file_manager.attribute_index import AttributeIndex, parse_metadata
+from assement.src.file_manager.key_layout import logical_name, shard_key, validate_name, validate_shards
+from assement.src.file_manager.streaming import Base64Reader, put_stream
+from assement.src.file_manager.variants import parse_variant, render_variant, resolve_format, variant_key
+
+# S3 multipart limits: every part but the last must be at least 5 MB, and an
+# upload can have at most 10,000 parts.
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+MAX_PARTS = 10000
+PRESIGNED_URL_EXPIRY = 3600
+# Largest file upload_init accepts
+MAX_UPLOAD_SIZE = 5 * 1024 ** 3
+# Part URLs presigned per response by default, and at most; clients fetch the rest a page at a
+# time with upload_parts, so a large upload does not sign thousands of URLs in one request.
+PART_URLS_PAGE = 100
+MAX_PART_URLS_PAGE = 1000
+
+# Download responses (body and ETag) are cached per warm container.
+# A cached URL is handed out until URL_REFRESH_MARGIN seconds before it expires,
+# so clients always get at least that long to use it.
+URL_REFRESH_MARGIN = 300
+download_cache = LRUCache(max_entries=1024, max_bytes=4 * 1024 * 1024)
+
+# The only metadata row attributes a download needs; the rest of the row is not read.
+# A row with deleted_at is a tombstone, waiting for the delete drain, and is not found.
+DOWNLOAD_ATTRIBUTES = ("metadata", "object_key", "content_hash", "uploaded_at", "deleted_at")
+VARIANT_ATTRIBUTES = DOWNLOAD_ATTRIBUTES + ("content_type", "variants", "size")
+INLINE_ATTRIBUTES = DOWNLOAD_ATTRIBUTES + ("content_type", "size")
+
+# Inline downloads return objects up to this size in the response itself, base64-encoded, instead
+# of a presigned URL; a ranged download returns at most this many bytes. A Lambda response carries
+# at most 6 MB and base64 adds a third, so it must stay under 4 MB.
+INLINE_MAX_BYTES = 256 * 1024
+# Inline responses can be cached by the client briefly, then revalidated with their ETag
+INLINE_CACHE_CONTROL = "private, max-age=60"
+# Seconds a container keeps an inline body, since, unlike a presigned URL, it goes stale on re-upload
+INLINE_CACHE_TTL = 60
+
+# Largest original a variant is rendered from: rendering reads the whole object into memory, and
+# decodes it, so larger images are refused rather than risk the function's memory.
+MAX_VARIANT_SOURCE_BYTES = 25 * 1024 * 1024
+
+# Most images a single batch action accepts; S3 delete_objects takes 1,000 keys per call.
+MAX_BATCH_ITEMS = 1000
+S3_DELETE_LIMIT = 1000
 
 
 class FileHandler:
     def __init__(self, bucket_name, endpoint_url=None, table_name=None, aws_access_key_id="test",
-                 aws_secret_access_key="test", region_name='us-east-1'):
+                 aws_secret_access_key="test", region_name='us-east-1', blob_table_name=None, search_table_name=None,
+                 attribute_table_name=None, indexed_attributes=(), listing=None, list_cache=None, delete_queue=None,
+                 inline_max_bytes=INLINE_MAX_BYTES, key_shards=0):
         self.bucket_name = bucket_name
-        self.s3 = boto3.client(
-            's3',
-            endpoint_url=endpoint_url,
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region_name
-        )
-        self.db_client = DynamoDBClient(table_name=table_name)
+        # The S3 client is built on first use, from the shared client registry
+        self._aws_config = {
+            "endpoint_url": endpoint_url,
+            "aws_access_key_id": aws_access_key_id,
+            "aws_secret_access_key": aws_secret_access_key,
+            "region_name": region_name
+        }
+        self._s3 = None
+        self.db_client = DynamoDBClient(table_name=table_name, endpoint_url=endpoint_url)
+        # With a blob table, uploads are content-addressed and identical content is stored once
+        self.blobs = BlobStore(DynamoDBClient(table_name=blob_table_name, endpoint_url=endpoint_url),
+                               bucket_name) if blob_table_name else None
+        # With a search table, every write and delete keeps the trigram name index up to date
+        self.ngrams = NGramIndex(DynamoDBClient(table_name=search_table_name, endpoint_url=endpoint_url)) \
+            if search_table_name else None
+        # With an attribute table, the indexed metadata attributes are kept queryable the same way
+        self.attributes = AttributeIndex(DynamoDBClient(table_name=attribute_table_name, endpoint_url=endpoint_url),
+                                         indexed_attributes) if attribute_table_name else None
+        # The in-memory listing index shared with FileSearch sees this container's writes straight away
+        self.listing = listing
+        # Cached listing pages covering the names this handler writes or deletes are invalidated
+        self.list_cache = list_cache
+        # With a delete queue (delete_queue.LocalQueue or SQSQueue), deletes only tombstone the metadata
+        # row and queue the name; DeleteDrain removes the objects and rows later, in batches, with purge()
+        self.delete_queue = delete_queue
+        # Largest object an inline download returns in the response rather than as a presigned URL
+        self.inline_max_bytes = inline_max_bytes
+        # With key shards, objects are stored under key_layout.shard_key rather than their name, and
+        # each row's object_key says where. Deduplicated content keeps its blobs/ keys.
+        self.key_shards = validate_shards(key_shards)
+
+    @property
+    def s3(self):
+        if self._s3 is None:
+            self._s3 = aws_clients.client('s3', **self._aws_config)
+        return self._s3
+
+    @s3.setter
+    def s3(self, value):
+        self._s3 = value
 
     def upload(self, event):
         """
@@ -27,13 +116,284 @@ class FileHandler:
         if not image_name:
             return {"statusCode": 400, "body": json.dumps({"error": "Imagename is requir."})}
 
-        # Decode the base64-encoded file content
-        file_content = base64.b64decode(event['body'])
+        # The base64 body is decoded chunk by chunk while S3 reads it, so the decoded
+        # content is never held in memory as a whole
+        try:
+            validate_name(image_name)
+            metadata = parse_metadata(metadata)
+            file_content = Base64Reader(event['body'])
+        except ValueError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
+        content_type = query_params.get('contentType') or _guess_content_type(image_name)
+        if self.blobs:
+            return self._upload_deduplicated(image_name, metadata, file_content, content_type)
+        object_key = self._object_key(image_name)
+        item = _metadata_item(image_name, metadata, len(file_content), content_type, object_key)
+
+        # The S3 write and the metadata write are independent, so they run concurrently
+        stored, recorded = run_concurrently(
+            lambda: put_stream(self.s3, self.bucket_name, object_key, file_content, content_type),
+            lambda: self.db_client.replace_item(item)
+        )
+        self._invalidate(image_name)
+        if stored.exception() is None and recorded.exception() is None:
+            # Variants of the previous content are stale now
+            self._compensate(lambda: self._delete_replaced(recorded.result(), object_key))
+            self._update_indexes(added=[item], replaced=[recorded.result()])
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"message": f"File '{image_name}' uploaded successfully.",
+                                    "sha256": file_content.sha256()})
+            }
+
+        # Compensate so the two stores never disagree, without losing an image uploaded before:
+        # a failed S3 put leaves the previous object, so the previous row is put back, and a failed
+        # row write leaves the previous row, so the object is only deleted if that row is not its
+        if stored.exception() is None:
+            self._compensate(lambda: self._discard_object(image_name, object_key))
+        elif recorded.exception() is None:
+            self._compensate(lambda: self.db_client.restore_item({'image_id': image_name}, recorded.result(),
+                                                                 item['uploaded_at']))
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(stored.exception() or recorded.exception())})
+        }
+
+    def _upload_deduplicated(self, image_name, metadata, file_content, content_type):
+        """
+        Stores the content once per distinct sha256 and points the image's metadata row at it.
+        Re-uploading known content only writes the metadata row.
+        """
+        with stage("hash"):
+            digest = file_content.sha256()
+        try:
+            object_key, stored = self.blobs.acquire(self.s3, file_content, digest, content_type)
+        except Exception as e:
+            return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+
+        item = {**_metadata_item(image_name, metadata, len(file_content), content_type),
+                "content_hash": digest, "object_key": object_key}
+        try:
+            replaced = self.db_client.replace_item(item)
+        except Exception as e:
+            self._compensate(lambda: self.blobs.release(self.s3, digest))
+            return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+        self._invalidate(image_name)
+        self._update_indexes(added=[item], replaced=[replaced])
+        # The name no longer references what it pointed at before
+        if replaced:
+            self._compensate(lambda: self._release_object(replaced))
+
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"message": f"File '{image_name}' uploaded successfully.", "deduplicated": not stored})
+        }
+
+    def _discard_object(self, image_name, object_key):
+        """
+        Deletes an object whose metadata write failed, unless the image's existing row refers to it:
+        then the object is that image's, overwritten with the new content.
+        """
+        row = self.db_client.get_item({'image_id': image_name}, attributes=("object_key", "content_hash"),
+                                      consistent_read=True)
+        if row is None or row.get('content_hash') or row.get('object_key', image_name) != object_key:
+            self.s3.delete_object(Bucket=self.bucket_name, Key=object_key)
+
+    def _release_object(self, item):
+        """
+        Frees the storage behind a removed metadata row: a blob reference, or the object stored under the name.
+        """
+        self._delete_objects(_stored_keys(item) + sorted(item.get('variants') or ()))
+        if item.get('content_hash'):
+            self.blobs.release(self.s3, item['content_hash'])
+
+    def _delete_replaced(self, replaced, object_key):
+        """
+        Frees what an overwritten metadata row stored that the new row does not reuse: its variants,
+        and its objects under other keys, as when the key layout changed since.
+        """
+        if replaced:
+            self._delete_objects([key for key in _stored_keys(replaced) if key != object_key] +
+                                 sorted(replaced.get('variants') or ()))
+
+    def _object_key(self, image_name):
+        """
+        The S3 key a new upload of the image is stored under.
+        """
+        return shard_key(image_name, self.key_shards)
+
+    def _delete_objects(self, keys):
+        """
+        Deletes objects with S3 delete_objects, S3_DELETE_LIMIT keys per call.
+        :return: error message by key, for the keys S3 failed to delete; ClientError is left to the caller
+        """
+        keys = list(keys)
+        errors = {}
+        for start in range(0, len(keys), S3_DELETE_LIMIT):
+            response = self.s3.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={"Objects": [{"Key": key} for key in keys[start:start + S3_DELETE_LIMIT]], "Quiet": True}
+            )
+            for error in response.get('Errors', []):
+                errors[error['Key']] = error.get('Message', error.get('Code'))
+        return errors
+
+    def _invalidate(self, image_name):
+        """
+        Drops the cached download responses of an image, its variants included.
+        """
+        download_cache.invalidate_where(lambda key: key[:2] == (self.bucket_name, image_name))
+
+    def _delete_deduplicated(self, image_name):
+        """
+        Removes the metadata row first, since it says which blob (or plain object) to release.
+        """
+        removed = self.db_client.remove_item({'image_id': image_name})
+        self._invalidate(image_name)
+        self._update_indexes(removed=[removed or {'image_id': image_name}])
+        self._release_object(removed or {'image_id': image_name})
+
+    def _update_indexes(self, added=(), replaced=(), removed=()):
+        """
+        Brings the trigram and attribute indexes in line with metadata rows that were written
+        (`added`, overwriting the `replaced` rows) or deleted (`removed`), and invalidates the cached
+        listing pages that may contain them. The indexes are derived data that the next write of
+        the name repairs, so a failure here is only logged.
+        Deduplicated content lives under blobs/, so the listing index learns of it from S3 events only.
+        """
+        if self.listing and self.listing.loaded and not self.blobs:
+            for item in removed:
+                self.listing.remove(item['image_id'])
+            for item in added:
+                self.listing.put(item['image_id'], item['size'], datetime.now(timezone.utc).timestamp())
+        updates = []
+        if self.ngrams:
+            if added:
+                updates.append(lambda: self.ngrams.add(added))
+            if removed:
+                updates.append(lambda: self.ngrams.remove([item['image_id'] for item in removed]))
+        if self.attributes and (added or removed):
+            updates.append(lambda: self.attributes.update(old_items=[*replaced, *removed], new_items=added))
+        if self.list_cache and (added or removed):
+            updates.append(lambda: self.list_cache.invalidate(
+                (item['image_id'], item.get('size')) for item in [*added, *replaced, *removed] if item))
+        if not updates:
+            return
+        for update in run_concurrently(*updates):
+            if update.exception() is not None:
+                print(f"Index update failed: {update.exception()}")
+            elif update.result():
+                print(f"Search index update left {len(update.result())} postings unwritten")
+
+    def _compensate(self, undo):
+        """
+        Runs a compensating call after a half-failed write; a failure here is only logged.
+        """
+        try:
+            undo()
+        except Exception as e:
+            print(f"Compensation failed: {e}")
+
+    def upload_init(self, query_params):
+        """
+        Starts an S3 multipart upload and returns presigned URLs for every part,
+        so the client can PUT the parts in parallel straight to S3.
+        :param query_params: fileName, fileSize (bytes), optional partSize, contentType and maxParts
+        :return: response with uploadId, partCount and the URLs of the first maxParts parts; when
+                 there are more, nextPartNumberMarker is the partNumberMarker for upload_parts
+        """
+        image_name = query_params.get('fileName', '')
+        if not image_name:
+            return {"statusCode": 400, "body": json.dumps({"error": "fileName is required."})}
+        try:
+            validate_name(image_name)
+        except ValueError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
+        try:
+            file_size = int(query_params.get('fileSize', '0'))
+            part_size = int(query_params.get('partSize', DEFAULT_PART_SIZE))
+            max_parts = _max_parts(query_params)
+        except ValueError:
+            return {"statusCode": 400, "body": json.dumps({"error": "fileSize, partSize and maxParts must be integers."})}
+        if file_size <= 0 or file_size > MAX_UPLOAD_SIZE:
+            return {"statusCode": 400,
+                    "body": json.dumps({"error": f"fileSize must be between 1 and {MAX_UPLOAD_SIZE} bytes."})}
+
+        part_size = max(part_size, MIN_PART_SIZE)
+        part_count = -(-file_size // part_size)
+        if part_count > MAX_PARTS:
+            # Grow the parts rather than rejecting the upload
+            part_size = -(-file_size // MAX_PARTS)
+            part_count = -(-file_size // part_size)
 
-        # Upload to S3
         try:
-            self.s3.put_object(Bucket=self.bucket_name, Key=image_name, Body=file_content)
-            self.db_client.write_item(item={"image_id": image_name, "metadata": metadata})
+            params = {"Bucket": self.bucket_name, "Key": self._object_key(image_name)}
+            content_type = query_params.get('contentType')
+            if content_type:
+                params["ContentType"] = content_type
+            upload_id = self.s3.create_multipart_upload(**params)['UploadId']
+
+            last = min(max_parts, part_count)
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"fileName": image_name, "uploadId": upload_id, "partSize": part_size,
+                                    "partCount": part_count, "parts": self._part_urls(params["Key"], upload_id, 1, last),
+                                    "nextPartNumberMarker": last if last < part_count else None})
+            }
+        except Exception as e:
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": str(e)})
+            }
+
+    def upload_complete(self, event):
+        """
+        Completes a multipart upload started by upload_init and only then writes
+        the metadata row, so DynamoDB never points at a half-uploaded object.
+        The body is JSON: {"parts": [{"partNumber": 1, "etag": "..."}], "metadata": ...}
+        """
+        query_params = event.get('queryStringParameters', {}) or {}
+        image_name = query_params.get('fileName', '')
+        upload_id = query_params.get('uploadId', '')
+        if not image_name or not upload_id:
+            return {"statusCode": 400, "body": json.dumps({"error": "fileName and uploadId are required."})}
+        try:
+            validate_name(image_name)
+        except ValueError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
+        try:
+            body = _json_body(event)
+            parts = sorted(
+                ({"PartNumber": int(part['partNumber']), "ETag": part['etag']} for part in body.get('parts', [])),
+                key=lambda part: part['PartNumber']
+            )
+        except (ValueError, KeyError, TypeError):
+            return {"statusCode": 400, "body": json.dumps({"error": "Body must be JSON with a list of parts."})}
+        if not parts:
+            return {"statusCode": 400, "body": json.dumps({"error": "At least one part is required."})}
+        try:
+            metadata = parse_metadata(body.get('metadata', query_params.get('metadata', {})))
+        except ValueError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
+        try:
+            object_key = self._object_key(image_name)
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=object_key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+            head = self.s3.head_object(Bucket=self.bucket_name, Key=object_key)
+            content_type = head.get('ContentType') or _guess_content_type(image_name)
+            item = _metadata_item(image_name, metadata, head['ContentLength'], content_type, object_key)
+            replaced = self.db_client.replace_item(item)
+            self._invalidate(image_name)
+            self._compensate(lambda: self._delete_replaced(replaced, object_key))
+            self._update_indexes(added=[item], replaced=[replaced])
             return {
                 "statusCode": 200,
                 "body": json.dumps({"message": f"File '{image_name}' uploaded successfully."})
@@ -44,37 +404,292 @@ class FileHandler:
                 "body": json.dumps({"error": str(e)})
             }
 
-    def download(self, query_params):
+    def upload_parts(self, query_params):
+        """
+        Presigns the next page of part URLs of a multipart upload started by upload_init.
+        :param query_params: fileName, uploadId, partCount (as returned by upload_init), partNumberMarker
+                             (the parts after it are signed) and optional maxParts
+        :return: response with partCount, the part URLs and the nextPartNumberMarker
+        """
+        image_name = query_params.get('fileName', '')
+        upload_id = query_params.get('uploadId', '')
+        if not image_name or not upload_id or not query_params.get('partCount'):
+            return {"statusCode": 400, "body": json.dumps({"error": "fileName, uploadId and partCount are required."})}
+        try:
+            part_count = int(query_params['partCount'])
+            marker = int(query_params.get('partNumberMarker', '0'))
+            max_parts = _max_parts(query_params)
+        except ValueError:
+            return {"statusCode": 400,
+                    "body": json.dumps({"error": "partCount, partNumberMarker and maxParts must be integers."})}
+        if not 1 <= part_count <= MAX_PARTS:
+            return {"statusCode": 400, "body": json.dumps({"error": f"partCount must be between 1 and {MAX_PARTS}."})}
+        if not 0 <= marker < part_count:
+            return {"statusCode": 400, "body": json.dumps({"error": "partNumberMarker must be below partCount."})}
+
+        last = min(marker + max_parts, part_count)
+        try:
+            parts = self._part_urls(self._object_key(image_name), upload_id, marker + 1, last)
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"fileName": image_name, "uploadId": upload_id, "partCount": part_count,
+                                    "parts": parts, "nextPartNumberMarker": last if last < part_count else None})
+            }
+        except Exception as e:
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": str(e)})
+            }
+
+    def _part_urls(self, object_key, upload_id, first, last):
+        """
+        Presigned upload_part URLs of parts first to last, inclusive.
+        """
+        return [
+            {
+                "partNumber": part_number,
+                "url": self.s3.generate_presigned_url(
+                    'upload_part',
+                    Params={'Bucket': self.bucket_name, 'Key': object_key,
+                            'UploadId': upload_id, 'PartNumber': part_number},
+                    ExpiresIn=PRESIGNED_URL_EXPIRY
+                )
+            }
+            for part_number in range(first, last + 1)
+        ]
+
+    def upload_abort(self, query_params):
+        """
+        Aborts a multipart upload so S3 frees the parts uploaded so far.
+        """
+        image_name = query_params.get('fileName', '')
+        upload_id = query_params.get('uploadId', '')
+        if not image_name or not upload_id:
+            return {"statusCode": 400, "body": json.dumps({"error": "fileName and uploadId are required."})}
+
+        try:
+            self.s3.abort_multipart_upload(Bucket=self.bucket_name, Key=self._object_key(image_name), UploadId=upload_id)
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"message": f"Upload of '{image_name}' aborted."})
+            }
+        except Exception as e:
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": str(e)})
+            }
+
+    def download(self, query_params, headers=None):
         """
-        Handles file download via API Gateway.
+        Handles file download via API Gateway. With inline=true, or a Range header, small objects
+        and byte ranges come back in the response itself rather than as a presigned URL.
+        :param headers: request headers with lowercase names
         """
         image_name = query_params.get('imageName', '')
         if not image_name:
             return {"statusCode": 400, "body": json.dumps({"error": "imageName is required."})}
 
         try:
-            # Generate pre-signed URL for downloading the file
+            variant = parse_variant(query_params)
+        except ValueError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+        headers = headers or {}
+        inline = query_params.get('inline', '').lower() in ('1', 'true') or 'range' in headers
+        if variant:
+            return self._download_variant(image_name, variant, headers if inline else None)
+        if inline:
+            return self._download_inline(image_name, headers)
+
+        cached = download_cache.get((self.bucket_name, image_name))
+        if cached is not None:
+            return _download_response(*cached)
+
+        try:
+            # Sign the URL for the key the image is most likely stored under while the metadata read is in flight
+            signed_key = self._object_key(image_name)
+            item, pre_signed_url = (future.result() for future in run_concurrently(
+                lambda: self.db_client.get_item({'image_id': image_name}, attributes=DOWNLOAD_ATTRIBUTES),
+                lambda: self.s3.generate_presigned_url(
+                    'get_object',
+                    Params={'Bucket': self.bucket_name, 'Key': signed_key},
+                    ExpiresIn=PRESIGNED_URL_EXPIRY
+                )
+            ))
+            if item is None or item.get('deleted_at'):
+                return {
+                    "statusCode": 404,
+                    "body": json.dumps({"error": f"Image '{image_name}' not found in metadata storage."})
+                }
+            return self._url_response(image_name, item, (signed_key, pre_signed_url))
+        except Exception as e:
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error while image download": str(e)})
+            }
+
+    def _url_response(self, image_name, item, signed=None):
+        """
+        The presigned URL download response for a metadata row, cached for the container.
+        :param signed: (key, URL) already signed, if any
+        """
+        object_key = item.get('object_key', image_name)
+        signed_key, pre_signed_url = signed or (None, None)
+        if object_key != signed_key:
+            # Content-addressed or moved by a key layout change: the bytes live under another key
             pre_signed_url = self.s3.generate_presigned_url(
                 'get_object',
-                Params={'Bucket': self.bucket_name, 'Key': image_name},
-                ExpiresIn=3600  # URL valid for 1 hour
+                Params={'Bucket': self.bucket_name, 'Key': object_key},
+                ExpiresIn=PRESIGNED_URL_EXPIRY
             )
-            response = self.db_client.read_item(key={
-                'image_id': image_name
-            })
-            if response['statusCode'] == 404:
+
+        with stage("json_encode"):
+            body = encode_json({"downloadUrl": pre_signed_url, "metadata": item.get('metadata')})
+        etag = make_etag(object_key, _version(item), pre_signed_url)
+        download_cache.put((self.bucket_name, image_name), (body, etag), len(body), PRESIGNED_URL_EXPIRY - URL_REFRESH_MARGIN)
+        return _download_response(body, etag)
+
+    def _download_inline(self, image_name, headers):
+        """
+        Returns the image itself when it is at most inline_max_bytes, or the requested byte range of
+        it (206), saving the client the second round trip to S3. Larger images get a presigned URL.
+        """
+        s3_range = parse_range(headers.get('range'), self.inline_max_bytes)
+        cache_key = (self.bucket_name, image_name, "inline")
+        cached = None if s3_range else download_cache.get(cache_key)
+        if cached is not None:
+            return _not_modified(cached[2]) if is_current(headers, cached[2]) else _inline_response(*cached)
+
+        try:
+            # Read the object while the metadata read is in flight, unless the client is likely to
+            # have it already. It is stored under _object_key unless the upload was deduplicated.
+            read_key = self._object_key(image_name)
+            reads = [lambda: self.db_client.get_item({'image_id': image_name}, attributes=INLINE_ATTRIBUTES)]
+            if s3_range or 'if-none-match' not in headers:
+                reads.append(lambda: self._read_inline(read_key, s3_range))
+            item_read, *object_reads = run_concurrently(*reads)
+            item = item_read.result()
+            if item is None or item.get('deleted_at'):
                 return {
                     "statusCode": 404,
                     "body": json.dumps({"error": f"Image '{image_name}' not found in metadata storage."})
                 }
-
-            response_json = json.loads(response['body'])
-            metadata_str = response_json['data']['metadata']
-
+            object_key = item.get('object_key', image_name)
+            etag = make_etag(object_key, _version(item))
+            if not s3_range and is_current(headers, etag):
+                return _not_modified(etag)
+            if not s3_range and item.get('size', 0) > self.inline_max_bytes:
+                return self._url_response(image_name, item)
+            read = object_reads[0].result() if object_reads and object_key == read_key \
+                else self._read_inline(object_key, s3_range)
+            response = self._inline_result(read, item.get('content_type'), etag, s3_range, item.get('size'), cache_key)
+            return response or self._url_response(image_name, item)
+        except Exception as e:
             return {
-                "statusCode": 200,
-                "body": json.dumps({"downloadUrl": pre_signed_url, "metadata": metadata_str})
+                "statusCode": 500,
+                "body": json.dumps({"error while image download": str(e)})
             }
+
+    def _read_inline(self, key, s3_range):
+        """
+        GETs the requested byte range of an object, or else its first inline_max_bytes + 1 bytes,
+        which is all of it when it fits and shows that it does not otherwise.
+        :param s3_range: Range from parse_range, or None for the whole object
+        :return: (bytes, ContentType, ContentRange), or None when the requested range is not satisfiable
+        """
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket_name, Key=key,
+                                     Range=s3_range or f"bytes=0-{self.inline_max_bytes}")
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "InvalidRange":
+                raise
+            if s3_range:
+                return None
+            # Only an empty object has no first byte
+            obj = self.s3.get_object(Bucket=self.bucket_name, Key=key)
+        return obj['Body'].read(), obj.get('ContentType'), obj.get('ContentRange')
+
+    def _inline_result(self, read, content_type, etag, s3_range, size, cache_key):
+        """
+        Turns a _read_inline result into an inline download response; whole objects are cached.
+        :param size: the object's size, for the Content-Range of a 416, or None if unknown
+        :return: the response, or None when the object is too large to return inline
+        """
+        if read is None:
+            headers = {"Content-Range": f"bytes */{size}"} if size is not None else {}
+            return {"statusCode": 416, "headers": headers, "body": json.dumps({"error": "Range not satisfiable."})}
+        content, stored_type, content_range = read
+        content_type = content_type or stored_type or 'application/octet-stream'
+        if s3_range:
+            return _inline_response(content, content_type, etag, content_range)
+        if len(content) > self.inline_max_bytes:
+            return None
+        download_cache.put(cache_key, (content, content_type, etag), len(content), INLINE_CACHE_TTL)
+        return _inline_response(content, content_type, etag)
+
+    def _download_variant(self, image_name, variant, inline_headers=None):
+        """
+        Returns a presigned URL for a resized/re-encoded copy of the image. The first request
+        renders it and stores it under a deterministic key recorded on the metadata row.
+        :param inline_headers: request headers of an inline download, which returns small variants
+                               and byte ranges in the response itself; None for a presigned URL
+        """
+        cache_key = (self.bucket_name, image_name, json.dumps(variant, sort_keys=True))
+        s3_range = parse_range(inline_headers.get('range'), self.inline_max_bytes) if inline_headers else None
+        if inline_headers is not None:
+            cached = None if s3_range else download_cache.get(cache_key + ("inline",))
+            if cached is not None:
+                return _not_modified(cached[2]) if is_current(inline_headers, cached[2]) else _inline_response(*cached)
+        else:
+            cached = download_cache.get(cache_key)
+            if cached is not None:
+                return _download_response(*cached)
+
+        try:
+            item = self.db_client.get_item({'image_id': image_name}, attributes=VARIANT_ATTRIBUTES)
+            if item is None or item.get('deleted_at'):
+                return {
+                    "statusCode": 404,
+                    "body": json.dumps({"error": f"Image '{image_name}' not found in metadata storage."})
+                }
+            object_key = item.get('object_key', image_name)
+            image_format = resolve_format(variant, item.get('content_type'))
+            key = variant_key(object_key, _version(item), variant, image_format)
+
+            if key not in (item.get('variants') or []):
+                if item.get('size', 0) > MAX_VARIANT_SOURCE_BYTES:
+                    return {"statusCode": 413, "body": json.dumps(
+                        {"error": f"'{image_name}' is too large to resize (over {MAX_VARIANT_SOURCE_BYTES} bytes)."})}
+                original = self.s3.get_object(Bucket=self.bucket_name, Key=object_key)['Body'].read()
+                try:
+                    with stage("resize"):
+                        content, content_type = render_variant(original, variant, image_format)
+                except ImportError:
+                    return {"statusCode": 501, "body": json.dumps({"error": "Resizing is not available (Pillow is not installed)."})}
+                except OSError:
+                    return {"statusCode": 415, "body": json.dumps({"error": f"'{image_name}' is not an image that can be resized."})}
+                self.s3.put_object(Bucket=self.bucket_name, Key=key, Body=content, ContentType=content_type)
+                self.db_client.add_to_set({'image_id': image_name}, 'variants', [key])
+
+            if inline_headers is not None:
+                # The key changes with the content, so it versions the variant
+                etag = make_etag(key)
+                if not s3_range and is_current(inline_headers, etag):
+                    return _not_modified(etag)
+                response = self._inline_result(self._read_inline(key, s3_range), None, etag, s3_range, None,
+                                               cache_key + ("inline",))
+                if response is not None:
+                    return response
+
+            pre_signed_url = self.s3.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': self.bucket_name, 'Key': key},
+                ExpiresIn=PRESIGNED_URL_EXPIRY
+            )
+            with stage("json_encode"):
+                body = encode_json({"downloadUrl": pre_signed_url, "metadata": item.get('metadata')})
+            etag = make_etag(key, pre_signed_url)
+            download_cache.put(cache_key, (body, etag), len(body), PRESIGNED_URL_EXPIRY - URL_REFRESH_MARGIN)
+            return _download_response(body, etag)
         except Exception as e:
             return {
                 "statusCode": 500,
@@ -89,19 +704,496 @@ class FileHandler:
         if not image_name:
             return {"statusCode": 400, "body": json.dumps({"error": "imageName is required."})}
 
-        try:
-            # Delete file from S3
-            self.s3.delete_object(Bucket=self.bucket_name, Key=image_name)
-
-            # Delete metadata from DynamoDB
-            self.db_client.delete_item(key={'image_id': image_name})
+        if self.delete_queue:
+            try:
+                failed = self._tombstone([image_name])
+            except Exception as e:
+                failed = {image_name: str(e)}
+            if failed:
+                return {
+                    "statusCode": 500,
+                    "body": json.dumps({"error": f"Failed to delete file '{image_name}': {failed[image_name]}"})
+                }
+            return {
+                "statusCode": 202,
+                "body": json.dumps({"message": f"File '{image_name}' deleted; its storage is freed shortly."})
+            }
 
+        if self.blobs:
+            try:
+                self._delete_deduplicated(image_name)
+            except Exception as e:
+                return {
+                    "statusCode": 500,
+                    "body": json.dumps({"error": f"Failed to delete file '{image_name}': {str(e)}"})
+                }
             return {
                 "statusCode": 200,
                 "body": json.dumps({"message": f"File '{image_name}' deleted successfully."})
             }
+
+        # The two deletes are independent and idempotent, so they run concurrently;
+        # a failure on either side is reported and the delete can simply be retried
+        object_key = self._object_key(image_name)
+        deleted, unrecorded = run_concurrently(
+            lambda: self.s3.delete_object(Bucket=self.bucket_name, Key=object_key),
+            lambda: self.db_client.remove_item({'image_id': image_name})
+        )
+        self._invalidate(image_name)
+        error = deleted.exception() or unrecorded.exception()
+        if error is None:
+            self._update_indexes(removed=[unrecorded.result() or {'image_id': image_name}])
+            try:
+                # The row may point at an object stored under an earlier key layout
+                self._delete_replaced(unrecorded.result(), object_key)
+            except Exception as e:
+                error = e
+        if error is not None:
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": f"Failed to delete file '{image_name}': {str(error)}"})
+            }
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"message": f"File '{image_name}' deleted successfully."})
+        }
+
+    def batch_upload(self, event):
+        """
+        Uploads several small files in one invocation and writes all their metadata with BatchWriteItem.
+        The body is JSON: {"files": [{"fileName": ..., "content": <base64>, "metadata": ..., "contentType": ...}]}
+        :return: one result per file
+        """
+        try:
+            files = _json_body(event).get('files', [])
+            if not isinstance(files, list) or not all(
+                    isinstance(file, dict) and isinstance(file.get('fileName'), str) and file['fileName'] for file in files):
+                raise ValueError
+        except (ValueError, AttributeError):
+            return {"statusCode": 400, "body": json.dumps({"error": "Body must be JSON with a list of files, each with a fileName."})}
+        if not files or len(files) > MAX_BATCH_ITEMS:
+            return {"statusCode": 400, "body": json.dumps({"error": f"Provide between 1 and {MAX_BATCH_ITEMS} files."})}
+        # BatchWriteItem rejects a batch that writes one key twice: the last file of a name wins,
+        # as if they had been uploaded one after another
+        files = list({file['fileName']: file for file in files}.values())
+
+        results = {}
+        items = []
+        for file in files:
+            image_name = file['fileName']
+            try:
+                validate_name(image_name)
+                metadata = parse_metadata(file.get('metadata', {}))
+                file_content = Base64Reader(file.get('content', ''))
+            except ValueError as e:
+                results[image_name] = {"fileName": image_name, "statusCode": 400, "error": str(e)}
+                continue
+            try:
+                content_type = file.get('contentType') or _guess_content_type(image_name)
+                if self.blobs:
+                    # Each name row has to replace its predecessor's reference, so no batched write here
+                    response = self._upload_deduplicated(image_name, metadata, file_content, content_type)
+                    results[image_name] = {"fileName": image_name, "statusCode": response['statusCode'],
+                                           **json.loads(response['body'])}
+                    continue
+                object_key = self._object_key(image_name)
+                put_stream(self.s3, self.bucket_name, object_key, file_content, content_type)
+                items.append(_metadata_item(image_name, metadata, len(file_content), content_type, object_key))
+                results[image_name] = {"fileName": image_name, "statusCode": 200}
+            except Exception as e:
+                results[image_name] = {"fileName": image_name, "statusCode": 500, "error": str(e)}
+
+        try:
+            # The attribute index has to drop the postings of the rows being overwritten, and with
+            # key shards, objects stored under an earlier layout go
+            replaced = self.db_client.batch_read_items([{"image_id": item["image_id"]} for item in items],
+                                                       attributes=("image_id", "metadata", "object_key", "moved_from",
+                                                                   "content_hash"))[0] \
+                if (self.attributes or self.key_shards) and items else []
+            unprocessed = self.db_client.batch_write_items(items=items)
+        except Exception as e:
+            replaced = []
+            unprocessed = [{"PutRequest": {"Item": item}} for item in items]
+            print(f"Batch metadata write error: {e}")
+        for request in unprocessed:
+            image_name = request["PutRequest"]["Item"]["image_id"]
+            results[image_name] = {"fileName": image_name, "statusCode": 503, "error": "Metadata write failed; retry the upload."}
+        for item in items:
+            self._invalidate(item["image_id"])
+        written = {item["image_id"] for item in items if results[item["image_id"]]["statusCode"] == 200}
+        self._update_indexes(added=[item for item in items if item["image_id"] in written],
+                             replaced=[row for row in replaced if row["image_id"] in written])
+        stale = [key for row in replaced if row["image_id"] in written
+                 for key in _stored_keys(row) if key != self._object_key(row["image_id"])]
+        if stale:
+            self._compensate(lambda: self._delete_objects(stale))
+
+        return {"statusCode": 200, "body": json.dumps({"results": list(results.values())})}
+
+    def batch_download(self, event):
+        """
+        Returns presigned URLs and metadata for several images, reading the metadata with BatchGetItem.
+        The body is JSON: {"imageNames": [...]}
+        :return: one result per image
+        """
+        try:
+            image_names = _batch_names(event)
+        except ValueError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
+        results = {}
+        for image_name in image_names:
+            cached = download_cache.get((self.bucket_name, image_name))
+            if cached is not None:
+                results[image_name] = {"imageName": image_name, "statusCode": 200, **json.loads(cached[0])}
+
+        try:
+            items, unprocessed = self.db_client.batch_read_items(
+                [{"image_id": image_name} for image_name in image_names if image_name not in results],
+                attributes=("image_id",) + DOWNLOAD_ATTRIBUTES)
+            for item in items:
+                image_name = item['image_id']
+                if item.get('deleted_at'):
+                    continue
+                pre_signed_url = self.s3.generate_presigned_url(
+                    'get_object',
+                    Params={'Bucket': self.bucket_name, 'Key': item.get('object_key', image_name)},
+                    ExpiresIn=PRESIGNED_URL_EXPIRY
+                )
+                body = encode_json({"downloadUrl": pre_signed_url, "metadata": item.get('metadata')})
+                etag = make_etag(item.get('object_key', image_name), _version(item), pre_signed_url)
+                download_cache.put((self.bucket_name, image_name), (body, etag), len(body), PRESIGNED_URL_EXPIRY - URL_REFRESH_MARGIN)
+                results[image_name] = {"imageName": image_name, "statusCode": 200, **json.loads(body)}
+        except Exception as e:
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error while image download": str(e)})
+            }
+        for key in unprocessed:
+            results[key['image_id']] = {"imageName": key['image_id'], "statusCode": 503,
+                                        "error": "Metadata read was throttled; retry."}
+
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"results": [
+                results.get(image_name) or {"imageName": image_name, "statusCode": 404,
+                                            "error": f"Image '{image_name}' not found in metadata storage."}
+                for image_name in image_names
+            ]})
+        }
+
+    def batch_delete(self, event):
+        """
+        Deletes several images with S3 delete_objects (1,000 keys per call) and their metadata with BatchWriteItem.
+        Metadata is only removed for objects S3 confirmed deleted.
+        The body is JSON: {"imageNames": [...]}
+        :return: one result per image
+        """
+        try:
+            image_names = _batch_names(event)
+        except ValueError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
+        if self.delete_queue:
+            return self._batch_delete_deferred(image_names)
+        if self.blobs:
+            return self._batch_delete_deduplicated(image_names)
+
+        try:
+            object_keys = {self._object_key(image_name): image_name for image_name in image_names}
+            errors = {object_keys[key]: message for key, message in self._delete_objects(object_keys).items()}
+
+            deleted = [image_name for image_name in image_names if image_name not in errors]
+            # Read the rows before removing them, for the variants (and objects of an earlier key layout) to clean up
+            rows, _ = self.db_client.batch_read_items([{"image_id": image_name} for image_name in deleted],
+                                                      attributes=("image_id", "metadata", "variants", "object_key",
+                                                                  "moved_from"))
+            unprocessed = self.db_client.batch_write_items(delete_keys=[{"image_id": image_name} for image_name in deleted])
+            self._delete_objects([key for row in rows for key in row.get('variants') or ()] +
+                                 [key for row in rows for key in _stored_keys(row) if key not in object_keys])
         except Exception as e:
             return {
                 "statusCode": 500,
-                "body": json.dumps({"error": f"Failed to delete file '{image_name}': {str(e)}"})
+                "body": json.dumps({"error": f"Failed to delete files: {str(e)}"})
             }
+        for request in unprocessed:
+            errors[request["DeleteRequest"]["Key"]["image_id"]] = "Metadata delete was throttled; retry."
+        for image_name in image_names:
+            self._invalidate(image_name)
+        rows = {row['image_id']: row for row in rows}
+        self._update_indexes(removed=[rows.get(image_name, {'image_id': image_name})
+                                      for image_name in image_names if image_name not in errors])
+
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"results": [
+                {"imageName": image_name, "statusCode": 500, "error": errors[image_name]} if image_name in errors
+                else {"imageName": image_name, "statusCode": 200}
+                for image_name in image_names
+            ]})
+        }
+
+    def _batch_delete_deduplicated(self, image_names):
+        """
+        Content-addressed deletes must read each removed row to release its blob, so they go
+        one image at a time, spread over the shared thread pool.
+        """
+        outcomes = run_concurrently(*(
+            (lambda image_name=image_name: self._delete_deduplicated(image_name)) for image_name in image_names))
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"results": [
+                {"imageName": image_name, "statusCode": 500, "error": str(outcome.exception())}
+                if outcome.exception() is not None else {"imageName": image_name, "statusCode": 200}
+                for image_name, outcome in zip(image_names, outcomes)
+            ]})
+        }
+
+    def _batch_delete_deferred(self, image_names):
+        """
+        Tombstones the images and queues them for the delete drain.
+        """
+        try:
+            failed = self._tombstone(image_names)
+        except Exception as e:
+            failed = dict.fromkeys(image_names, str(e))
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"results": [
+                {"imageName": image_name, "statusCode": 500, "error": failed[image_name]} if image_name in failed
+                else {"imageName": image_name, "statusCode": 202}
+                for image_name in image_names
+            ]})
+        }
+
+    def _tombstone(self, image_names):
+        """
+        Marks the images' metadata rows deleted, then queues the tombstoned names for the delete
+        drain. Queueing waits for the tombstones, since purge() skips a row that is not one yet: a
+        drain quick enough to see the name first would drop it for good. A name whose row could not
+        be marked is not queued, and a failed delete can simply be retried. Tombstoned images are
+        hidden at once: downloads treat them as missing, they leave the search GSIs, and the name
+        and attribute indexes, this container's listing index and the covering list cache pages
+        drop them now.
+        :return: error message by name, for the names that could not be deleted
+        :raises: the queue's error when the names could not be queued
+        """
+        deleted_at = format_timestamp(datetime.now(timezone.utc))
+        marked = run_concurrently(
+            *((lambda image_name=image_name: self.db_client.tombstone({'image_id': image_name}, deleted_at))
+              for image_name in image_names)
+        )
+        failed = {image_name: str(outcome.exception()) for image_name, outcome in zip(image_names, marked)
+                  if outcome.exception() is not None}
+        # Rows tombstoned before were hidden then; a missing row has nothing to hide
+        removed = [outcome.result() for outcome in marked
+                   if outcome.exception() is None and outcome.result() and not outcome.result().get('deleted_at')]
+        for image_name in image_names:
+            self._invalidate(image_name)
+        self._update_indexes(removed=removed)
+        tombstoned = [image_name for image_name in image_names if image_name not in failed]
+        if tombstoned:
+            self.delete_queue.send(tombstoned)
+        return failed
+
+    def purge(self, image_names):
+        """
+        Finishes the deletes of tombstoned images. Each row is removed on the condition that it is
+        still the tombstone read, so an image uploaded again in the meantime is left alone; only
+        then do its objects and variants go, with S3 delete_objects (1,000 keys per call), and its
+        blob reference. Names whose row is not a tombstone (gone already, or uploaded again since)
+        are skipped, so purging a name twice does no harm. A row whose objects could not all be
+        deleted is put back, leaving the tombstone for the retry.
+        :param image_names: names taken from the delete queue
+        :return: names to retry; ClientError is left to the caller
+        """
+        rows, unread = self.db_client.batch_read_items(
+            [{"image_id": image_name} for image_name in image_names],
+            attributes=("image_id", "deleted_at"), consistent_read=True)
+        retry = {key["image_id"] for key in unread}
+        rows = [row for row in rows if row.get("deleted_at")]
+        removals = run_concurrently(
+            *((lambda row=row: self.db_client.remove_tombstone({"image_id": row["image_id"]}, row["deleted_at"]))
+              for row in rows)
+        )
+        retry.update(row["image_id"] for row, removal in zip(rows, removals) if removal.exception() is not None)
+        deleted = [removal.result() for removal in removals if removal.exception() is None and removal.result()]
+
+        # Deduplicated content is released through its blob reference once the row is gone
+        objects = {row["image_id"]: _stored_keys(row) + sorted(row.get("variants") or ()) for row in deleted}
+        errors = self._delete_objects(key for row_keys in objects.values() for key in row_keys)
+        for row in deleted:
+            if errors.keys() & set(objects[row["image_id"]]):
+                # Put back unless the name was uploaded again since
+                self.db_client.insert_item(row, "image_id")
+                retry.add(row["image_id"])
+                continue
+            self._invalidate(row["image_id"])
+            if row.get("content_hash") and self.blobs:
+                self._compensate(lambda row=row: self.blobs.release(self.s3, row["content_hash"]))
+        return sorted(retry)
+
+    def backfill(self, objects):
+        """
+        Writes metadata rows, with empty metadata, for objects that have none: ones uploaded before
+        the table existed, or whose metadata write was lost. Names that have a row by now are skipped.
+        :param objects: (key, size, last modified as epoch seconds) of each object
+        :return: (number of rows written, names to retry); ClientError is left to the caller
+        """
+        # Objects in the sharded key layout belong to the name after their shard prefix
+        objects = [(logical_name(key) or key, key, size, modified) for key, size, modified in objects]
+        rows, unread = self.db_client.batch_read_items([{"image_id": image_name} for image_name, _, _, _ in objects],
+                                                       attributes=("image_id",))
+        retry = {key["image_id"] for key in unread}
+        present = {row["image_id"] for row in rows} | retry
+        items = [
+            {**_metadata_item(image_name, {}, size, _guess_content_type(image_name), key),
+             "uploaded_at": format_timestamp(datetime.fromtimestamp(modified, timezone.utc))}
+            for image_name, key, size, modified in objects if image_name not in present
+        ]
+        retry.update(request["PutRequest"]["Item"]["image_id"] for request in self.db_client.batch_write_items(items=items))
+        written = [item for item in items if item["image_id"] not in retry]
+        self._update_indexes(added=written)
+        return len(written), sorted(retry)
+
+    def prune(self, image_ids, uploaded_before):
+        """
+        Deletes the metadata rows of images whose objects no longer exist. Each object is looked up
+        again first, and rows written at or after uploaded_before are kept, since their object may
+        still be on its way to S3.
+        :param image_ids: names whose objects were missing from a listing
+        :param uploaded_before: format_timestamp string
+        :return: (number of rows deleted, names to retry); ClientError is left to the caller
+        """
+        rows, unread = self.db_client.batch_read_items(
+            [{"image_id": image_id} for image_id in image_ids],
+            attributes=("image_id", "object_key", "moved_from", "content_hash", "uploaded_at", "metadata", "variants"))
+        retry = {key["image_id"] for key in unread}
+        rows = [row for row in rows if row.get("uploaded_at", "") < uploaded_before]
+        if not rows:
+            return 0, sorted(retry)
+        lookups = run_concurrently(*(
+            (lambda row=row: self._object_exists(row.get("object_key") or row["image_id"])) for row in rows))
+        orphans = [row for row, lookup in zip(rows, lookups) if not lookup.result()]
+        retry.update(request["DeleteRequest"]["Key"]["image_id"] for request in
+                     self.db_client.batch_write_items(delete_keys=[{"image_id": row["image_id"]} for row in orphans]))
+        removed = [row for row in orphans if row["image_id"] not in retry]
+        for row in removed:
+            self._invalidate(row["image_id"])
+        self._update_indexes(removed=removed)
+        self._compensate(lambda: self._delete_objects(
+            [key for row in removed for key in sorted(row.get("variants") or ()) +
+             ([row["moved_from"]] if row.get("moved_from") else [])]))
+        # A missing blob still holds the references of its pruned names
+        for row in removed:
+            if row.get("content_hash") and self.blobs:
+                self._compensate(lambda row=row: self.blobs.release(self.s3, row["content_hash"]))
+        return len(removed), sorted(retry)
+
+    def _object_exists(self, key):
+        try:
+            self.s3.head_object(Bucket=self.bucket_name, Key=key)
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+
+def _json_body(event):
+    """
+    Parses the JSON request body, decoding it first if API Gateway base64-encoded it.
+    """
+    body = event.get('body') or '{}'
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body)
+    return json.loads(body)
+
+
+def _download_response(body, etag):
+    """
+    A download response. The ETag covers the presigned URL, so a client is only told
+    its copy is current (304) while the URL in it is still the one we hand out.
+    """
+    return {"statusCode": 200, "body": body, "headers": {"ETag": etag}}
+
+
+def _inline_response(content, content_type, etag, content_range=None):
+    """
+    An inline download response: the object's bytes, base64-encoded for API Gateway, or the
+    byte range of them given by content_range (206).
+    """
+    headers = {"Content-Type": content_type, "ETag": etag, "Cache-Control": INLINE_CACHE_CONTROL,
+               "Accept-Ranges": "bytes"}
+    if content_range:
+        headers["Content-Range"] = content_range
+    return {"statusCode": 206 if content_range else 200, "headers": headers,
+            "body": base64.b64encode(content).decode('ascii'), "isBase64Encoded": True}
+
+
+def _not_modified(etag):
+    return {"statusCode": 304, "headers": {"ETag": etag}, "body": ""}
+
+
+def _version(item):
+    """
+    Changes whenever the image's content is replaced: the content hash of deduplicated
+    uploads, else the upload time.
+    """
+    return item.get('content_hash') or item.get('uploaded_at')
+
+
+def _guess_content_type(image_name):
+    return mimetypes.guess_type(image_name)[0] or 'application/octet-stream'
+
+
+def _stored_keys(row):
+    """
+    The S3 keys holding a metadata row's own content: its object, unless it references a
+    deduplicated blob, and the object it was moved from by migrate_keys, until that is deleted.
+    """
+    keys = [] if row.get('content_hash') else [row.get('object_key', row['image_id'])]
+    return keys + ([row['moved_from']] if row.get('moved_from') else [])
+
+
+def _metadata_item(image_name, metadata, size, content_type, object_key=None):
+    """
+    Builds the metadata row, including the attributes the size and date GSIs are keyed on.
+    :param metadata: the upload's metadata, as parse_metadata returned it
+    :param object_key: the S3 key of the image's object, recorded when it is not the name
+    """
+    item = {
+        "image_id": image_name,
+        "metadata": metadata,
+        "size": size,
+        "content_type": content_type,
+        "uploaded_at": format_timestamp(datetime.now(timezone.utc)),
+        "search_shard": search_shard(image_name)
+    }
+    if object_key and object_key != image_name:
+        item["object_key"] = object_key
+    return item
+
+
+def _max_parts(query_params):
+    """
+    The maxParts of a part URL page, within 1 and MAX_PART_URLS_PAGE.
+    :raises ValueError: when it is not an integer
+    """
+    return min(max(int(query_params.get('maxParts', PART_URLS_PAGE)), 1), MAX_PART_URLS_PAGE)
+
+
+def _batch_names(event):
+    """
+    Reads the de-duplicated imageNames list of a batch request body.
+    :raises ValueError: when the body is malformed or the batch is empty or too large
+    """
+    try:
+        image_names = _json_body(event).get('imageNames', [])
+    except (ValueError, AttributeError):
+        raise ValueError("Body must be JSON with a list of imageNames.")
+    if not isinstance(image_names, list) or not all(isinstance(name, str) and name for name in image_names):
+        raise ValueError("Body must be JSON with a list of imageNames.")
+    if not image_names or len(image_names) > MAX_BATCH_ITEMS:
+        raise ValueError(f"Provide between 1 and {MAX_BATCH_ITEMS} imageNames.")
+    return list(dict.fromkeys(image_names))
@@ -1,43 +1,395 @@
+import base64
+import binascii
+import heapq
+from itertools import repeat
 import json
-import boto3
+from datetime import datetime
+from decimal import Decimal
+from boto3.dynamodb.conditions import Key
+from assement.src.file_manager import aws_clients
+from assement.src.file_manager.conditional import make_etag
+from assement.src.file_manager.metrics import stage
+from assement.src.file_manager.db_client import (DynamoDBClient, SIZE_INDEX, UPLOADED_AT_INDEX, SEARCH_SHARDS,
+                                                 format_timestamp, encode_json)
+from assement.src.file_manager.attribute_index import AttributeIndex, matches, parse_predicates
+from assement.src.file_manager.concurrency import run_concurrently
+from assement.src.file_manager.ngram_index import NGramIndex, NGRAM_SIZE
+from assement.src.file_manager.key_layout import INTERNAL_PREFIXES, SHARD_PREFIX, shard_prefixes, validate_shards
+from assement.src.file_manager.list_cache import prefix_scope, size_scope
+
+# list_objects_v2 never returns more than 1,000 keys per call
+MAX_PAGE_SIZE = 1000
+# list_objects_v2 calls one prefix listing may make while most keys are filtered out; past
+# that the page is returned short, with a token to continue from
+MAX_LIST_CALLS = 10
+# Marks continuation tokens issued from the listing index, which resume after a key
+LISTING_TOKEN = "k:"
+
+
+def encode_token(token):
+    """
+    Wraps an S3 continuation token into the opaque nextToken handed to clients.
+    """
+    return base64.urlsafe_b64encode(token.encode('utf-8')).decode('ascii')
+
+
+def decode_token(next_token):
+    """
+    Reverses encode_token; raises ValueError for tokens we did not issue.
+    """
+    try:
+        token = base64.b64decode(next_token.encode('ascii'), altchars=b'-_', validate=True).decode('utf-8')
+    except (binascii.Error, UnicodeError) as e:
+        raise ValueError("Invalid nextToken") from e
+    if not token:
+        raise ValueError("Invalid nextToken")
+    return token
+
 
 class FileSearch:
-    def __init__(self, bucket_name, endpoint_url=None, aws_access_key_id=None, aws_secret_access_key=None, region_name='us-east-1'):
+    def __init__(self, bucket_name, endpoint_url=None, table_name=None, aws_access_key_id=None, aws_secret_access_key=None,
+                 region_name='us-east-1', search_table_name=None, attribute_table_name=None, indexed_attributes=(),
+                 listing=None, list_cache=None, tombstones=False, key_shards=0):
         self.bucket_name = bucket_name
-        self.s3 = boto3.client(
-            's3',
-            endpoint_url=endpoint_url,
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region_name,
+        # The S3 client is built on first use, from the shared client registry
+        self._aws_config = {
+            "endpoint_url": endpoint_url,
+            "aws_access_key_id": aws_access_key_id,
+            "aws_secret_access_key": aws_secret_access_key,
+            "region_name": region_name
+        }
+        self._s3 = None
+        # The size and date searches need the metadata table; prefix search does not
+        self.db_client = DynamoDBClient(table_name=table_name, endpoint_url=endpoint_url) if table_name else None
+        # Substring search needs the trigram table kept up to date by FileHandler
+        self.ngrams = NGramIndex(DynamoDBClient(table_name=search_table_name, endpoint_url=endpoint_url)) \
+            if search_table_name else None
+        # Metadata queries need the attribute index kept up to date by FileHandler, and the metadata table
+        self.attributes = AttributeIndex(DynamoDBClient(table_name=attribute_table_name, endpoint_url=endpoint_url),
+                                         indexed_attributes) if attribute_table_name else None
+        # With a ListingIndex, prefix searches are answered from memory once its snapshot is loaded
+        self.listing = listing
+        # With a ListCache, prefix listings read from S3 and size searches are cached
+        self.list_cache = list_cache
+        # When deletes are deferred (FileHandler with a delete queue), objects listed from S3 are
+        # checked against the metadata table and those whose row is a tombstone are left out
+        self.tombstones = tombstones and self.db_client is not None
+        # With FileHandler's sharded key layout, S3 listings fan out over every shard's prefix
+        self.key_shards = validate_shards(key_shards)
 
-        )
+    @property
+    def s3(self):
+        if self._s3 is None:
+            self._s3 = aws_clients.client('s3', **self._aws_config)
+        return self._s3
 
-    def prefix_search(self, prefix,limit = 30):
+    @s3.setter
+    def s3(self, value):
+        self._s3 = value
+
+    def prefix_search(self, prefix, limit=30, next_token=None, min_size=0, max_size=0):
         """
 
         :param prefix:  image prefix
         :param limit:  limit the search results
-        :return:
+        :param next_token: opaque cursor returned by a previous call, to fetch the next page
+        :param min_size: minimum file size in bytes
+        :param max_size: maximum file size in bytes (0 means no max size)
+        :return: the page of files and a nextToken (None on the last page)
+        """
+        try:
+            continuation_token = decode_token(next_token) if next_token else None
+        except ValueError:
+            return {"statusCode": 400, "body": json.dumps({"error": "Invalid nextToken."})}
+        if max_size and max_size < min_size:
+            return {"statusCode": 400, "body": json.dumps({"error": "maxSize must not be less than minSize."})}
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        if self.list_cache is None or self._listing_ready(continuation_token):
+            return self._prefix_page(prefix, limit, continuation_token, min_size, max_size)
+        # Only pages listed from S3 are cached: the listing index is current and needs no LIST calls
+        return self.list_cache.fetch(
+            prefix_scope(prefix), f"{min_size}:{max_size}:{limit}:{next_token or ''}",
+            lambda: self._prefix_page(prefix, limit, continuation_token, min_size, max_size))
+
+    def _listing_ready(self, continuation_token):
+        """
+        True if the page can be served from the listing index. Index pages end with
+        "k:<last key>"; an S3 continuation token has to be followed in S3.
         """
+        return bool(self.listing) and (continuation_token is None or continuation_token.startswith(LISTING_TOKEN)) \
+            and self.listing.ensure_loaded(self.s3)
 
+    def _prefix_page(self, prefix, limit, continuation_token, min_size, max_size):
+        """
+        One page of a prefix listing, from the listing index when it is loaded, otherwise from S3.
+        """
         try:
-            # List objects in the bucket
-            response = self.s3.list_objects_v2(Bucket=self.bucket_name, Prefix=prefix)
-            files = response.get('Contents', [])
+            if self._listing_ready(continuation_token):
+                start_after = continuation_token[len(LISTING_TOKEN):] if continuation_token else None
+                found, more = self.listing.scan(prefix, start_after, limit, min_size, max_size)
+                continuation_token = LISTING_TOKEN + found[-1][0] if more else None
+                if self.tombstones and found:
+                    live = {file['Key'] for file in self._live([{'Key': key} for key, _, _ in found])}
+                    found = [entry for entry in found if entry[0] in live]
+                filtered_files = [{"key": key, "size": size, "last_modified": modified} for key, size, modified in found]
+                validators = [(key, size, modified) for key, size, modified in found]
+            else:
+                filtered_files = []
+                validators = []
+                if self.key_shards and (continuation_token is None or continuation_token.startswith(LISTING_TOKEN)):
+                    pages = self._list_shards(prefix, limit, continuation_token, min_size, max_size)
+                else:
+                    pages = self._list_pages(prefix, limit, continuation_token, min_size, max_size)
+                for files, continuation_token in pages:
+                    validators.extend((file['Key'], file.get('ETag'), file['LastModified'].isoformat()) for file in files)
+                    filtered_files.extend(
+                        {
+                            "key": file['Key'],
+                            "size": file['Size'],
+                            "last_modified": file['LastModified'].isoformat()
+                        }
+                        for file in files
+                    )
+
+            next_token = encode_token(continuation_token) if continuation_token else None
+            with stage("json_encode"):
+                body = encode_json({
+                    "files": filtered_files,
+                    "nextToken": next_token
+                })
+            return {
+                "statusCode": 200,
+                "body": body,
+                "headers": {"ETag": make_etag(*validators, next_token)}
+            }
+        except Exception as e:
+            print(str(e)) # log
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": str(e)})
+            }
 
-            filtered_files = [
+    def _list_pages(self, prefix, limit, continuation_token=None, min_size=0, max_size=0):
+        """
+        Lazily follows list_objects_v2 continuation tokens, asking S3 only for
+        the keys still missing from the page, and stops once the page is full.
+        Objects outside the size range are dropped and do not count towards the page.
+        After MAX_LIST_CALLS calls the page is returned as it is, with a token.
+        :return: generator of (objects, continuation token for the next call)
+        """
+        remaining = limit
+        for _ in range(MAX_LIST_CALLS):
+            params = {"Bucket": self.bucket_name, "Prefix": prefix}
+            if continuation_token and continuation_token.startswith(LISTING_TOKEN):
+                # A page served by the listing index, continued while the index is unavailable
+                params["StartAfter"] = continuation_token[len(LISTING_TOKEN):]
+            elif continuation_token:
+                params["ContinuationToken"] = continuation_token
+            response, files = self._list_objects(params, remaining, min_size, max_size)
+            continuation_token = response.get('NextContinuationToken') if response.get('IsTruncated') else None
+            if len(files) > remaining:
+                # More matched than the page holds: the next page starts after its last name
+                files = files[:remaining]
+                continuation_token = LISTING_TOKEN + files[-1]['Key']
+            yield files, continuation_token
+
+            remaining -= len(files)
+            if not continuation_token or remaining <= 0:
+                return
+
+    def _list_objects(self, params, wanted, min_size, max_size, base='', hidden=INTERNAL_PREFIXES):
+        """
+        One list_objects_v2 call of a prefix listing, and the objects of it that are listed. When
+        some may be dropped (by size, as tombstones, or as the service's own objects) it asks for
+        a full page, so that a listing where few keys match takes few calls; otherwise only for
+        the wanted number of keys.
+        :param params: list_objects_v2 parameters besides MaxKeys
+        :param base: key prefix stripped from the listed keys, that of a shard
+        :param hidden: key prefixes whose objects are dropped
+        :return: (response, objects in key order, keyed by image name)
+        """
+        prefix = params["Prefix"]
+        filtering = bool(min_size or max_size or self.tombstones) or \
+            prefix.startswith(hidden) or any(hidden_prefix.startswith(prefix) for hidden_prefix in hidden)
+        response = self.s3.list_objects_v2(MaxKeys=MAX_PAGE_SIZE if filtering else wanted, **params)
+        files = [{**file, 'Key': file['Key'][len(base):]} for file in response.get('Contents', [])
+                 if not file['Key'].startswith(hidden)
+                 and file['Size'] >= min_size and (not max_size or file['Size'] <= max_size)]
+        if self.tombstones and files:
+            files = self._live(files)
+        return response, files
+
+    def _list_shards(self, prefix, limit, continuation_token=None, min_size=0, max_size=0):
+        """
+        One page of a prefix listing in the sharded key layout: list_objects_v2 runs concurrently
+        on the prefix in every shard, and on the prefix itself for objects not yet moved to the
+        sharded layout, and the sources are merged in name order. Only sources whose keys were
+        all used up are listed again, while fewer than MAX_LIST_CALLS calls were made (the first
+        round always runs). The page continues after its last name ("k:<name>"), or, when it is
+        cut short, after the last name every source has listed past.
+        :return: generator of a single (objects keyed by image name, continuation token)
+        """
+        start_after = continuation_token[len(LISTING_TOKEN):] if continuation_token else ''
+        # Per source: key prefix to strip, listing prefix, StartAfter, objects left, more to list
+        sources = [[shard_prefix[:-len(prefix)] if prefix else shard_prefix, shard_prefix, None, [], True]
+                   for shard_prefix in shard_prefixes(prefix, self.key_shards)] + [['', prefix, None, [], True]]
+        for source in sources:
+            source[2] = source[0] + start_after if start_after and start_after >= prefix else None
+
+        def fetch(source):
+            base, source_prefix, after, _, _ = source
+            params = {"Bucket": self.bucket_name, "Prefix": source_prefix}
+            if after:
+                params["StartAfter"] = after
+            # Sharded keys are listed through their shards, not as objects of the plain prefix
+            response, files = self._list_objects(params, limit, min_size, max_size, base,
+                                                 () if base else INTERNAL_PREFIXES + (SHARD_PREFIX,))
+            contents = response.get('Contents', [])
+            if contents:
+                source[2] = contents[-1]['Key']
+                if not base and source[2].startswith(SHARD_PREFIX):
+                    # Skip the rest of the sharded keys: they are listed through their shards
+                    source[2] = max(source[2], SHARD_PREFIX + '\U0010ffff')
+            source[3] = files[::-1]
+            source[4] = bool(response.get('IsTruncated'))
+
+        page = []
+        calls = 0
+        # Once out of calls: the name up to which every source has been listed
+        covered = None
+        while len(page) < limit:
+            empty = [source for source in sources if not source[3] and source[4]]
+            if empty and covered is None:
+                if calls < MAX_LIST_CALLS:
+                    calls += len(empty)
+                    for future in run_concurrently(*(lambda source=source: fetch(source) for source in empty)):
+                        future.result()
+                    continue
+                covered = min(source[2][len(source[0]):] for source in empty)
+            heads = [source for source in sources if source[3]]
+            if not heads:
+                break
+            # Every source has an object buffered, is used up, or is listed past covered, so the smallest name is next
+            head = min(heads, key=lambda source: source[3][-1]['Key'])
+            if covered is not None and head[3][-1]['Key'] > covered:
+                break
+            file = head[3].pop()
+            # A name still stored under both layouts, mid-migration, is listed once
+            if not page or page[-1]['Key'] != file['Key']:
+                page.append(file)
+        if covered is not None and len(page) < limit:
+            yield page, LISTING_TOKEN + covered
+            return
+        more = len(page) == limit and any(source[3] or source[4] for source in sources)
+        yield page, LISTING_TOKEN + page[-1]['Key'] if more else None
+
+    def _live(self, files):
+        """
+        Drops listed objects whose metadata row is a tombstone, waiting for the delete drain.
+        Rows the batch read leaves unprocessed are taken to be live.
+        """
+        rows, _ = self.db_client.batch_read_items([{"image_id": file['Key']} for file in files],
+                                                  attributes=("image_id", "deleted_at"))
+        deleted = {row['image_id'] for row in rows if row.get('deleted_at')}
+        return [file for file in files if file['Key'] not in deleted]
+
+    def size_search(self, min_size, max_size, limit=30, next_token=None):
+        """
+        Lists images within a size range by querying the size GSI.
+        :param min_size: minimum file size in bytes
+        :param max_size: maximum file size in bytes (0 means no max size)
+        :param limit: limit the search results
+        :param next_token: opaque cursor returned by a previous call
+        :return: the page of files ordered by size, and a nextToken
+        """
+        if max_size and max_size < min_size:
+            return {"statusCode": 400, "body": json.dumps({"error": "maxSize must not be less than minSize."})}
+        size = Key('size')
+        condition = size.between(min_size, max_size) if max_size else size.gte(min_size)
+        if self.list_cache is None:
+            return self._index_search(SIZE_INDEX, 'size', condition, limit, next_token)
+        return self.list_cache.fetch(size_scope(min_size, max_size), f"{limit}:{next_token or ''}",
+                                     lambda: self._index_search(SIZE_INDEX, 'size', condition, limit, next_token))
+
+    def date_search(self, uploaded_after=None, uploaded_before=None, limit=30, next_token=None):
+        """
+        Lists images uploaded within a time range by querying the upload-date GSI.
+        :param uploaded_after: inclusive lower bound, ISO 8601 string
+        :param uploaded_before: inclusive upper bound, ISO 8601 string
+        :param limit: limit the search results
+        :param next_token: opaque cursor returned by a previous call
+        :return: the page of files ordered by upload time, and a nextToken
+        """
+        try:
+            start = format_timestamp(datetime.fromisoformat(uploaded_after)) if uploaded_after else None
+            end = format_timestamp(datetime.fromisoformat(uploaded_before)) if uploaded_before else None
+        except ValueError:
+            return {"statusCode": 400, "body": json.dumps({"error": "uploadedAfter and uploadedBefore must be ISO 8601 dates."})}
+
+        uploaded_at = Key('uploaded_at')
+        if start and end:
+            condition = uploaded_at.between(start, end)
+        elif start:
+            condition = uploaded_at.gte(start)
+        else:
+            condition = uploaded_at.lte(end)
+        return self._index_search(UPLOADED_AT_INDEX, 'uploaded_at', condition, limit, next_token)
+
+    def text_search(self, query, limit=30, next_token=None, min_size=0, max_size=0, uploaded_after=None,
+                    uploaded_before=None):
+        """
+        Finds images whose names contain the query, or most of it, using the trigram index.
+        :param query: name fragment, at least NGRAM_SIZE characters
+        :param limit: limit the search results
+        :param next_token: opaque cursor returned by a previous call
+        :param min_size: minimum file size in bytes
+        :param max_size: maximum file size in bytes (0 means no max size)
+        :param uploaded_after: inclusive lower bound on the upload time, ISO 8601 string
+        :param uploaded_before: inclusive upper bound on the upload time, ISO 8601 string
+        :return: the page of files, best match first, each with its score, and a nextToken
+        """
+        if self.ngrams is None:
+            return {"statusCode": 501, "body": json.dumps({"error": "Name search is not configured."})}
+        if len(query) < NGRAM_SIZE:
+            return {"statusCode": 400, "body": json.dumps({"error": f"q must be at least {NGRAM_SIZE} characters."})}
+        try:
+            offset = int(decode_token(next_token)) if next_token else 0
+            if offset < 0:
+                raise ValueError
+            start = format_timestamp(datetime.fromisoformat(uploaded_after)) if uploaded_after else None
+            end = format_timestamp(datetime.fromisoformat(uploaded_before)) if uploaded_before else None
+        except ValueError:
+            return {"statusCode": 400, "body": json.dumps({"error": "Invalid nextToken or date."})}
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        try:
+            # Postings carry size and upload time, so filtering needs no metadata reads
+            matches = [
+                (posting, score) for posting, score in self.ngrams.search(query)
+                if posting['size'] >= min_size and (not max_size or posting['size'] <= max_size)
+                and (start is None or posting['uploaded_at'] >= start) and (end is None or posting['uploaded_at'] <= end)
+            ]
+            page = matches[offset:offset + limit]
+            next_token = encode_token(str(offset + limit)) if offset + limit < len(matches) else None
+            files = [
                 {
-                    "key": file['Key'],
-                    "size": file['Size'],
-                    "last_modified": file['LastModified'].isoformat()
+                    "key": posting['image_id'],
+                    "size": _plain(posting['size']),
+                    "uploaded_at": posting['uploaded_at'],
+                    "score": round(score, 3)
                 }
-                for file in files
+                for posting, score in page
             ]
-
+            with stage("json_encode"):
+                body = encode_json({
+                    "files": files,
+                    "nextToken": next_token
+                })
+            validators = ((file['key'], file['uploaded_at'], file['score']) for file in files)
             return {
                 "statusCode": 200,
-                "body": json.dumps({"files": filtered_files[:limit]})
+                "body": body,
+                "headers": {"ETag": make_etag(*validators, next_token)}
             }
         except Exception as e:
             print(str(e)) # log
@@ -45,36 +397,168 @@ class FileSearch:
                 "statusCode": 500,
                 "body": json.dumps({"error": str(e)})
             }
-    def size_search(self,min_size,max_size,prefix,limit = 30):
-            """
-            Lists all images in the S3 bucket with filters for prefix and size range.
-            """
-            min_size = int(query_params.get('minSize', '0'))  # Minimum file size in bytes
-            max_size = int(query_params.get('maxSize', '0'))  # Maximum file size in bytes (0 means no max size)
-
-            try:
-                # List objects in the bucket
-                response = self.s3.list_objects_v2(Bucket=self.bucket_name)
-                files = response.get('Contents', [])
-
-                # Apply size filters
-                filtered_files = [
-                    {
-                        "key": file['Key'],
-                        "size": file['Size'],
-                        "last_modified": file['LastModified'].isoformat()
-                    }
-                    for file in files
-                    if file['Size'] >= min_size and (max_size == 0 or file['Size'] <= max_size)
-                ]
-
-                return {
-                    "statusCode": 200,
-                    "body": json.dumps({"files": filtered_files[:30]})
+
+    def metadata_query(self, where, limit=30, next_token=None):
+        """
+        Finds images whose metadata satisfies every predicate, by intersecting the attribute index postings.
+        :param where: predicates separated by ';', e.g. "format=JPEG;dimensions.width>=1920"
+        :param limit: limit the search results
+        :param next_token: opaque cursor returned by a previous call
+        :return: the page of files with their metadata, in name order, and a nextToken
+        """
+        if self.attributes is None or self.db_client is None:
+            return {"statusCode": 501, "body": json.dumps({"error": "Metadata queries are not configured."})}
+        try:
+            predicates = parse_predicates(where)
+            after = decode_token(next_token) if next_token else ''
+        except ValueError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        try:
+            lookups = run_concurrently(*((lambda predicate=predicate: self.attributes.lookup(predicate))
+                                         for predicate in predicates))
+            errors = [lookup.exception() for lookup in lookups if isinstance(lookup.exception(), ValueError)]
+            if errors:
+                return {"statusCode": 400, "body": json.dumps({"error": str(errors[0])})}
+            complete = [image_ids for image_ids, is_complete in (lookup.result() for lookup in lookups) if is_complete]
+            if not complete:
+                return {"statusCode": 400, "body": json.dumps({"error": "Every predicate matches too many images; add a narrower one."})}
+            # Predicates with too many postings to intersect are checked on the rows instead
+            unchecked = [predicate for predicate, lookup in zip(predicates, lookups) if not lookup.result()[1]]
+            candidates = sorted(image_id for image_id in set.intersection(*complete) if image_id > after)
+
+            page = []
+            position = 0
+            while position < len(candidates) and len(page) < limit:
+                chunk = candidates[position:position + limit - len(page)]
+                position += len(chunk)
+                rows, unprocessed = self.db_client.batch_read_items(
+                    [{"image_id": image_id} for image_id in chunk],
+                    attributes=("image_id", "size", "content_type", "uploaded_at", "metadata", "deleted_at"))
+                if unprocessed:
+                    raise RuntimeError("Metadata reads were throttled; retry.")
+                found = {row['image_id']: row for row in rows}
+                # A name without a row, or with a tombstone, was deleted after its postings were read
+                page.extend(found[image_id] for image_id in chunk if image_id in found
+                            and not found[image_id].get('deleted_at')
+                            and all(matches(found[image_id].get('metadata'), predicate) for predicate in unchecked))
+
+            next_token = encode_token(page[-1]['image_id']) if page and position < len(candidates) else None
+            files = [
+                {
+                    "key": row['image_id'],
+                    "size": row.get('size'),
+                    "content_type": row.get('content_type'),
+                    "uploaded_at": row.get('uploaded_at'),
+                    "metadata": row.get('metadata')
                 }
-            except Exception as e:
-                return {
-                    "statusCode": 500,
-                    "body": json.dumps({"error": str(e)})
+                for row in page
+            ]
+            with stage("json_encode"):
+                body = encode_json({
+                    "files": files,
+                    "nextToken": next_token
+                })
+            validators = ((file['key'], file['uploaded_at']) for file in files)
+            return {
+                "statusCode": 200,
+                "body": body,
+                "headers": {"ETag": make_etag(*validators, next_token)}
+            }
+        except Exception as e:
+            print(str(e)) # log
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": str(e)})
+            }
+
+    def _index_search(self, index_name, sort_key, condition, limit, next_token):
+        """
+        Queries every search shard of a GSI concurrently and merges the shards in sort-key order.
+        The nextToken carries one ExclusiveStartKey per shard that still has items.
+        """
+        shards = [str(shard) for shard in range(SEARCH_SHARDS)]
+        try:
+            cursors = json.loads(decode_token(next_token)) if next_token else dict.fromkeys(shards)
+            if not isinstance(cursors, dict) or not cursors or not set(cursors) <= set(shards):
+                raise ValueError
+        except ValueError:
+            return {"statusCode": 400, "body": json.dumps({"error": "Invalid nextToken."})}
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        try:
+            pages = {}
+            boundary = None
+            # The shards are independent partitions, so they are queried at the same time
+            queries = run_concurrently(*(
+                (lambda shard=shard, start_key=start_key: self.db_client.query_index(
+                    index_name, Key('search_shard').eq(shard) & condition, limit, start_key))
+                for shard, start_key in cursors.items()))
+            for (shard, start_key), query in zip(cursors.items(), queries):
+                response = query.result()
+                items = response.get('Items', [])
+                truncated = 'LastEvaluatedKey' in response
+                pages[shard] = (items, truncated, start_key)
+                # Unseen items of a truncated shard sort after its last item, so
+                # nothing beyond that point can be returned from this page.
+                if truncated and items and (boundary is None or items[-1][sort_key] < boundary):
+                    boundary = items[-1][sort_key]
+
+            merged = heapq.merge(
+                *(zip(items, repeat(shard)) for shard, (items, _, _) in pages.items()),
+                key=lambda entry: entry[0][sort_key]
+            )
+            page = []
+            last_taken = {}
+            for item, shard in merged:
+                if len(page) == limit or (boundary is not None and item[sort_key] > boundary):
+                    break
+                page.append(item)
+                last_taken[shard] = item
+
+            next_cursors = {}
+            for shard, (items, truncated, start_key) in pages.items():
+                if shard in last_taken:
+                    item = last_taken[shard]
+                    if truncated or item is not items[-1]:
+                        next_cursors[shard] = {"image_id": item["image_id"], "search_shard": shard,
+                                               sort_key: _plain(item[sort_key])}
+                elif items or truncated:
+                    next_cursors[shard] = start_key
+
+            files = [
+                {
+                    "key": item['image_id'],
+                    "size": _plain(item.get('size')),
+                    "content_type": item.get('content_type'),
+                    "uploaded_at": item.get('uploaded_at')
                 }
+                for item in page
+            ]
+            next_token = encode_token(json.dumps(next_cursors)) if next_cursors else None
+            with stage("json_encode"):
+                body = encode_json({
+                    "files": files,
+                    "nextToken": next_token
+                })
+            # uploaded_at is rewritten by every upload, so it versions the row
+            validators = ((file['key'], file['uploaded_at'], file['size']) for file in files)
+            return {
+                "statusCode": 200,
+                "body": body,
+                "headers": {"ETag": make_etag(*validators, next_token)}
+            }
+        except Exception as e:
+            print(str(e)) # log
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": str(e)})
+            }
+
 
+def _plain(value):
+    """
+    Converts the Decimal numbers boto3 returns for DynamoDB into ints.
+    """
+    return int(value) if isinstance(value, Decimal) else value
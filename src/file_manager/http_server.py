@@ -0,0 +1,371 @@
+"""
+Serves lambda_handler over HTTP, outside of Lambda.
+
+Each HTTP/1.1 request is translated into an API Gateway (REST API) proxy event. The handler
+runs on a bounded worker pool, and its proxy response is written back. Connections are
+kept alive between requests. Request lines, headers and bodies are size-limited. Bodies
+are read as they arrive. Binary media types are base64-encoded chunk by chunk, as API
+Gateway does, so an image upload can be sent as raw bytes.
+
+    python -m assement.src.file_manager.http_server --port 8080 --workers 32
+    curl -X POST --data-binary @cat.jpg -H "Content-Type: image/jpeg" \\
+        "http://127.0.0.1:8080/?action=upload&fileName=cat.jpg"
+"""
+import argparse
+import asyncio
+import base64
+import fnmatch
+import json
+import signal
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from http import HTTPStatus
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+HOST = "127.0.0.1"
+PORT = 8080
+# Handler invocations running at once; further requests wait for a free worker
+WORKERS = 32
+# API Gateway's payload limit, and the longest request line or header line
+MAX_BODY_BYTES = 10 * 1024 * 1024
+MAX_LINE_BYTES = 8 * 1024
+MAX_HEADERS = 100
+# Seconds an idle keep-alive connection stays open, and allowed for reading one request
+KEEP_ALIVE_TIMEOUT = 5
+READ_TIMEOUT = 60
+# Seconds a handler may run before the client gets a 504, as with API Gateway's integration timeout
+HANDLER_TIMEOUT = 29
+CHUNK_BYTES = 64 * 1024
+# Content types whose bodies are passed base64-encoded, like API Gateway's binary media types
+BINARY_MEDIA_TYPES = ("image/*", "application/octet-stream")
+
+
+class _RequestError(Exception):
+    """
+    A request that cannot be handled; it is answered with the status and the connection closed.
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class LocalContext:
+    """
+    The parts of the Lambda context object a handler may use.
+    """
+    function_name = "local"
+    function_version = "$LATEST"
+    memory_limit_in_mb = 0
+
+    def __init__(self, request_id, timeout=HANDLER_TIMEOUT):
+        self.aws_request_id = request_id
+        self._deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+class _Body:
+    """
+    Collects a request body as it arrives. Binary bodies are base64-encoded chunk by chunk,
+    carrying over the bytes that do not fill a 3-byte group.
+    """
+
+    def __init__(self, binary):
+        self.binary = binary
+        self.size = 0
+        self._parts = []
+        self._pending = b""
+
+    def feed(self, chunk):
+        self.size += len(chunk)
+        if not self.binary:
+            self._parts.append(chunk)
+            return
+        data = self._pending + chunk
+        cut = len(data) - len(data) % 3
+        self._parts.append(base64.b64encode(data[:cut]).decode('ascii'))
+        self._pending = data[cut:]
+
+    def finish(self):
+        """
+        :return: the event body (None when empty) and whether it is base64-encoded
+        """
+        if not self.size:
+            return None, False
+        if self.binary:
+            return "".join(self._parts) + base64.b64encode(self._pending).decode('ascii'), True
+        data = b"".join(self._parts)
+        try:
+            return data.decode('utf-8'), False
+        except UnicodeDecodeError:
+            return base64.b64encode(data).decode('ascii'), True
+
+
+class LocalServer:
+    """
+    asyncio HTTP/1.1 front end for a Lambda proxy handler.
+    """
+
+    def __init__(self, handler, host=HOST, port=PORT, workers=WORKERS, max_body_bytes=MAX_BODY_BYTES,
+                 binary_media_types=BINARY_MEDIA_TYPES, handler_timeout=HANDLER_TIMEOUT):
+        """
+        :param handler: called as handler(event, context), e.g. lambda_function.lambda_handler
+        :param port: port to listen on; 0 picks a free one, available as .port once started
+        :param workers: handler invocations running at once
+        :param max_body_bytes: larger request bodies are answered with 413
+        :param binary_media_types: content type patterns whose bodies are passed base64-encoded
+        """
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.max_body_bytes = max_body_bytes
+        self.binary_media_types = binary_media_types
+        self.handler_timeout = handler_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="handler")
+        self.requests = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve_connection, self.host, self.port, limit=CHUNK_BYTES)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        """
+        Stops accepting connections and waits for the running handlers.
+        """
+        self._server.close()
+        await self._server.wait_closed()
+        await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+
+    async def _serve_connection(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                except ValueError:
+                    line = b"-" * (MAX_LINE_BYTES + 1)
+                if not line:
+                    break
+                if not line.strip():
+                    continue  # stray CRLF between requests
+                try:
+                    request = await asyncio.wait_for(self._read_request(line, reader, writer), READ_TIMEOUT)
+                except _RequestError as e:
+                    await _write_response(writer, {"statusCode": e.status, "body": json.dumps({"message": str(e)})},
+                                          keep_alive=False)
+                    break
+                keep_alive = request["keep_alive"]
+                response = await self._invoke(request, peer)
+                await _write_response(writer, response, keep_alive, head_only=request["method"] == "HEAD")
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+            with suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _read_request(self, line, reader, writer):
+        """
+        Reads the headers and body of the request whose request line was read.
+        :raises _RequestError: for malformed or oversized requests
+        """
+        if len(line) > MAX_LINE_BYTES:
+            raise _RequestError(414, "Request line too long.")
+        try:
+            method, target, version = line.decode('latin-1').split()
+        except ValueError:
+            raise _RequestError(400, "Malformed request line.")
+        if not version.startswith("HTTP/1."):
+            raise _RequestError(505, "Only HTTP/1.x is supported.")
+
+        headers = []
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                line = b"-" * (MAX_LINE_BYTES + 1)
+            if len(line) > MAX_LINE_BYTES:
+                raise _RequestError(431, "Header line too long.")
+            if not line:
+                raise asyncio.IncompleteReadError(b"", None)
+            if not line.strip():
+                break
+            if len(headers) == MAX_HEADERS:
+                raise _RequestError(431, "Too many headers.")
+            name, separator, value = line.decode('latin-1').partition(":")
+            if not separator or not name.strip():
+                raise _RequestError(400, "Malformed header.")
+            headers.append((name.strip(), value.strip()))
+
+        fields = {name.lower(): value for name, value in headers}
+        connection = fields.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        content_type = fields.get("content-type", "").split(";")[0].strip().lower()
+        body = _Body(any(fnmatch.fnmatch(content_type, pattern) for pattern in self.binary_media_types))
+
+        if "chunked" in fields.get("transfer-encoding", "").lower():
+            await self._continue(fields, writer)
+            await self._read_chunked(reader, body)
+        elif "content-length" in fields:
+            try:
+                length = int(fields["content-length"])
+            except ValueError:
+                raise _RequestError(400, "Invalid Content-Length.")
+            if length < 0:
+                raise _RequestError(400, "Invalid Content-Length.")
+            if length > self.max_body_bytes:
+                raise _RequestError(413, "Request body too large.")
+            await self._continue(fields, writer)
+            while body.size < length:
+                body.feed(await reader.readexactly(min(CHUNK_BYTES, length - body.size)))
+
+        text, is_base64 = body.finish()
+        return {"method": method.upper(), "target": target, "version": version, "headers": headers,
+                "body": text, "is_base64": is_base64, "keep_alive": keep_alive}
+
+    async def _read_chunked(self, reader, body):
+        while True:
+            try:
+                size = int((await reader.readline()).split(b";")[0], 16)
+            except ValueError:
+                raise _RequestError(400, "Malformed chunk.")
+            if size == 0:
+                while (await reader.readline()).strip():
+                    pass  # trailers
+                return
+            if body.size + size > self.max_body_bytes:
+                raise _RequestError(413, "Request body too large.")
+            while size:
+                chunk = await reader.readexactly(min(CHUNK_BYTES, size))
+                body.feed(chunk)
+                size -= len(chunk)
+            await reader.readexactly(2)
+
+    @staticmethod
+    async def _continue(fields, writer):
+        """
+        Tells a client waiting on Expect: 100-continue to send the body, once it is known to be acceptable.
+        """
+        if fields.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await writer.drain()
+
+    async def _invoke(self, request, peer):
+        """
+        Runs the handler on the worker pool with the request as a proxy event.
+        :return: the handler's proxy response, or the 502/504 API Gateway would answer with
+        """
+        request_id = str(uuid.uuid4())
+        event = proxy_event(request, request_id, peer[0] if peer else None)
+        self.requests += 1
+        invocation = asyncio.get_running_loop().run_in_executor(
+            self.executor, self.handler, event, LocalContext(request_id, self.handler_timeout))
+        try:
+            response = await asyncio.wait_for(invocation, self.handler_timeout)
+        except asyncio.TimeoutError:
+            return {"statusCode": 504, "body": json.dumps({"message": "Endpoint request timed out"})}
+        except Exception as e:
+            print(f"Handler error: {e}")
+            return {"statusCode": 502, "body": json.dumps({"message": "Internal server error"})}
+        if not isinstance(response, dict) or "statusCode" not in response:
+            return {"statusCode": 502, "body": json.dumps({"message": "Malformed Lambda proxy response"})}
+        return response
+
+
+def proxy_event(request, request_id, source_ip=None):
+    """
+    The API Gateway REST API proxy event for a request read by LocalServer.
+    """
+    url = urlsplit(request["target"])
+    headers, multi_headers = {}, {}
+    for name, value in request["headers"]:
+        headers[name] = value
+        multi_headers.setdefault(name, []).append(value)
+    multi_query = {}
+    for name, value in parse_qsl(url.query, keep_blank_values=True):
+        multi_query.setdefault(name, []).append(value)
+    path = unquote(url.path) or "/"
+    return {
+        "resource": "/{proxy+}",
+        "path": path,
+        "httpMethod": request["method"],
+        "headers": headers,
+        "multiValueHeaders": multi_headers,
+        "queryStringParameters": {name: values[-1] for name, values in multi_query.items()} or None,
+        "multiValueQueryStringParameters": multi_query or None,
+        "pathParameters": {"proxy": path.lstrip("/")} if path != "/" else None,
+        "stageVariables": None,
+        "requestContext": {
+            "requestId": request_id,
+            "stage": "local",
+            "httpMethod": request["method"],
+            "path": path,
+            "protocol": request["version"],
+            "requestTimeEpoch": int(time.time() * 1000),
+            "identity": {"sourceIp": source_ip, "userAgent": headers.get("User-Agent")}
+        },
+        "body": request["body"],
+        "isBase64Encoded": request["is_base64"]
+    }
+
+
+async def _write_response(writer, response, keep_alive, head_only=False):
+    status = int(response["statusCode"])
+    body = response.get("body") or ""
+    data = base64.b64decode(body) if response.get("isBase64Encoded") else body.encode('utf-8')
+    headers = [(name, str(value)) for name, value in (response.get("headers") or {}).items()]
+    headers += [(name, str(value)) for name, values in (response.get("multiValueHeaders") or {}).items()
+                for value in values]
+    # Framing is the server's; a handler's own Content-Length or Connection would contradict it
+    headers = [(name, value) for name, value in headers
+               if name.lower() not in ("content-length", "connection", "transfer-encoding")]
+    if not any(name.lower() == "content-type" for name, _ in headers):
+        headers.append(("Content-Type", "application/json"))
+    headers += [("Content-Length", str(len(data))), ("Connection", "keep-alive" if keep_alive else "close")]
+    try:
+        reason = HTTPStatus(status).phrase
+    except ValueError:
+        reason = ""
+    head = f"HTTP/1.1 {status} {reason}\r\n" + "".join(f"{name}: {value}\r\n" for name, value in headers) + "\r\n"
+    writer.write(head.encode('latin-1') + (b"" if head_only else data))
+    await writer.drain()
+
+
+async def serve(server):
+    """
+    Runs the server until SIGINT or SIGTERM, then lets the running handlers finish.
+    """
+    await server.start()
+    print(f"Serving on http://{server.host}:{server.port}", flush=True)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    await stop.wait()
+    await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--max-body-bytes", type=int, default=MAX_BODY_BYTES)
+    args = parser.parse_args()
+
+    from assement.src.file_manager import lambda_function
+    asyncio.run(serve(LocalServer(lambda_function.lambda_handler, host=args.host, port=args.port,
+                                  workers=args.workers, max_body_bytes=args.max_body_bytes)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import hashlib
+
+# With the sharded layout, an image's object is stored under SHARD_PREFIX, a two-hex-digit shard
+# derived from a hash of its name, and the name: "shards/3f/2024/05/photo.jpg". S3 scales request
+# rates per key prefix, so names clustered under a few prefixes are spread over every shard.
+SHARD_PREFIX = "shards/"
+KEY_SHARDS = 16
+MAX_KEY_SHARDS = 256
+# Objects the service stores for itself: the listing index's snapshot, deduplicated content and
+# rendered variants. They never get metadata rows and are never listed.
+INDEX_PREFIX = "_index/"
+BLOB_PREFIX = "blobs/"
+VARIANT_PREFIX = "variants/"
+INTERNAL_PREFIXES = (INDEX_PREFIX, BLOB_PREFIX, VARIANT_PREFIX)
+# Image names may not start with these, or their objects would be taken for the service's own
+RESERVED_PREFIXES = INTERNAL_PREFIXES + (SHARD_PREFIX,)
+
+
+def key_shard(image_name, shards):
+    """
+    The shard of a name, stable for a given shard count.
+    """
+    return int(hashlib.md5(image_name.encode('utf-8')).hexdigest()[:8], 16) % shards
+
+
+def shard_key(image_name, shards):
+    """
+    The S3 key an image's object is stored under: the name itself when shards is 0.
+    """
+    if not shards:
+        return image_name
+    return f"{SHARD_PREFIX}{key_shard(image_name, shards):02x}/{image_name}"
+
+
+def shard_prefixes(prefix, shards):
+    """
+    The S3 prefix, in every shard, of the names starting with prefix.
+    """
+    return [f"{SHARD_PREFIX}{shard:02x}/{prefix}" for shard in range(shards)]
+
+
+def logical_name(key):
+    """
+    The image name stored under a sharded key.
+    :return: the name, or None when the key is not in the sharded layout
+    """
+    if not key.startswith(SHARD_PREFIX):
+        return None
+    shard, separator, image_name = key[len(SHARD_PREFIX):].partition('/')
+    if not separator or len(shard) != 2 or not all(c in "0123456789abcdef" for c in shard) or not image_name:
+        return None
+    return image_name
+
+
+def validate_name(image_name):
+    """
+    :raises ValueError: when the name starts with a prefix the service keeps for itself
+    """
+    if image_name.startswith(RESERVED_PREFIXES):
+        raise ValueError(f"Image names may not start with {', '.join(RESERVED_PREFIXES)}.")
+    return image_name
+
+
+def validate_shards(shards):
+    """
+    :raises ValueError: when the shard count does not fit the two-hex-digit shard prefix
+    """
+    if not 0 <= shards <= MAX_KEY_SHARDS:
+        raise ValueError(f"Key shards must be between 0 and {MAX_KEY_SHARDS}.")
+    return shards
@@ -1,22 +1,91 @@
 import json
-from assement.src.file_manager.file_handler import FileHandler
+from assement.src.file_manager import metrics, rate_limit
+from assement.src.file_manager.conditional import finalize, request_headers
+from assement.src.file_manager.db_client import encode_json
+from assement.src.file_manager.delete_queue import DeleteDrain, SQSQueue
+from assement.src.file_manager.file_handler import FileHandler, download_cache
 from assement.src.file_manager.file_search import FileSearch
+from assement.src.file_manager.listing_index import ListingIndex
+from assement.src.file_manager.list_cache import ListCache
 
 BUCKET_NAME = "image-bucket"
 TABLE_NAME = "ImageMetadata"
 ENDPOINT_URL = "http://localhost:4566"
+# Set to a table created from blob_store.blob_table_definition to store identical uploads once.
+# Deduplicated content lives under blobs/, so prefix listing no longer finds those images by name.
+BLOB_TABLE_NAME = None
+# Trigram index behind the 'search' action, created from ngram_index.ngram_table_definition
+SEARCH_TABLE_NAME = "ImageSearchIndex"
+# Attribute value index behind the 'query' action, created from attribute_index.attribute_table_definition,
+# and the metadata attributes (dotted paths) it indexes
+ATTRIBUTE_TABLE_NAME = "ImageAttributeIndex"
+INDEXED_ATTRIBUTES = ("format", "dimensions.width", "dimensions.height", "tags")
+# Bucket listing kept in memory for prefix listings, loaded from a snapshot object and kept current
+# by the bucket's ObjectCreated/ObjectRemoved notifications; None lists straight from S3
+listing_index = ListingIndex(BUCKET_NAME)
+# Optional table created from list_cache_table_definition, sharing cached listing pages between
+# containers; without it each container caches its own for list_cache.MEMORY_TTL seconds
+LIST_CACHE_TABLE_NAME = None
+list_cache = ListCache(LIST_CACHE_TABLE_NAME, endpoint_url=ENDPOINT_URL)
+# Objects up to this size are returned in the response by an inline download (?inline=true);
+# larger ones get a presigned URL. Binary responses need */* among the API's binary media types.
+INLINE_MAX_BYTES = 256 * 1024
+# SQS queue that deferred deletes go through, with this function as its event source. Without it,
+# deletes run on the request path: a frozen or recycled container would lose names queued in memory.
+DELETE_QUEUE_URL = None
+# Hash shards put in front of the S3 keys of new uploads ("shards/3f/<name>"), spreading clustered
+# names over S3's per-prefix request rates; key_layout.KEY_SHARDS is a good start. 0 stores objects
+# under their names. Existing objects are moved with migrate_keys.
+KEY_SHARDS = 0
+delete_queue = SQSQueue(DELETE_QUEUE_URL, endpoint_url=ENDPOINT_URL) if DELETE_QUEUE_URL else None
 
-# Initialize the FileHandler and FileSearch globally for reuse
-image_handler = FileHandler(bucket_name=BUCKET_NAME, table_name=TABLE_NAME, endpoint_url=ENDPOINT_URL)
-file_search = FileSearch(bucket_name=BUCKET_NAME, endpoint_url=ENDPOINT_URL)
+# Initialize the FileHandler and FileSearch globally for reuse. Their AWS clients
+# are created lazily on first use, so a cold start only pays for the ones it needs.
+image_handler = FileHandler(bucket_name=BUCKET_NAME, table_name=TABLE_NAME, endpoint_url=ENDPOINT_URL,
+                            blob_table_name=BLOB_TABLE_NAME, search_table_name=SEARCH_TABLE_NAME,
+                            attribute_table_name=ATTRIBUTE_TABLE_NAME, indexed_attributes=INDEXED_ATTRIBUTES,
+                            listing=listing_index, list_cache=list_cache, delete_queue=delete_queue,
+                            inline_max_bytes=INLINE_MAX_BYTES, key_shards=KEY_SHARDS)
+file_search = FileSearch(bucket_name=BUCKET_NAME, table_name=TABLE_NAME, endpoint_url=ENDPOINT_URL,
+                         search_table_name=SEARCH_TABLE_NAME, attribute_table_name=ATTRIBUTE_TABLE_NAME,
+                         indexed_attributes=INDEXED_ATTRIBUTES, listing=listing_index, list_cache=list_cache,
+                         tombstones=True, key_shards=KEY_SHARDS)
+delete_drain = DeleteDrain(image_handler, delete_queue)
 
 def lambda_handler(event, context):
     """
     AWS Lambda function handler for managing image uploads, downloads, and searches.
+    Logs a redacted summary of the event and one EMF metrics line with the stage timings.
+    """
+    # Log the incoming event, without the (possibly multi-megabyte) body
+    print("Received event:", metrics.summarize_event(event))
+    if event.get('warmup'):
+        action = 'warmup'
+    elif _is_s3_event(event):
+        action = 's3_event'
+    elif _is_sqs_event(event):
+        action = 'sqs_event'
+    else:
+        action = ((event.get('queryStringParameters') or {}).get('action') or '').lower()
+    with metrics.request(action) as request_metrics:
+        response = route_request(event)
+        request_metrics.status_code = response.get('statusCode')
+    return response
+
+def route_request(event):
+    """
+    Routes the request to its handler based on HTTP method and action.
     """
     try:
-        # Log the incoming event
-        print("Received event:", json.dumps(event))
+        # Scheduled or provisioned-concurrency pings: build every client ahead of real traffic
+        if event.get('warmup'):
+            return handle_warmup()
+        # Bucket notifications: keep the listing index snapshot current
+        if _is_s3_event(event):
+            return handle_s3_event(event)
+        # Delete queue messages: finish the deferred deletes
+        if _is_sqs_event(event):
+            return handle_sqs_event(event)
 
         http_method = event.get('httpMethod', '').upper()
         query_params = event.get('queryStringParameters', {}) or {}
@@ -25,18 +94,113 @@ def lambda_handler(event, context):
         # Route the request based on HTTP method and action
         if http_method == "POST" and action == "upload":
             return handle_upload(event)
+        elif http_method == "POST" and action == "upload_init":
+            return handle_upload_init(query_params)
+        elif http_method == "POST" and action == "upload_parts":
+            return handle_upload_parts(query_params)
+        elif http_method == "POST" and action == "upload_complete":
+            return handle_upload_complete(event)
+        elif http_method == "POST" and action == "upload_abort":
+            return handle_upload_abort(query_params)
+        elif http_method == "POST" and action == "batch_upload":
+            return handle_batch(image_handler.batch_upload, event)
+        elif http_method == "POST" and action == "batch_download":
+            return handle_batch(image_handler.batch_download, event)
+        elif http_method == "POST" and action == "batch_delete":
+            return handle_batch(image_handler.batch_delete, event)
         elif http_method == "GET" and action == "download":
-            return handle_download(query_params)
+            return finalize(event, handle_download(query_params, request_headers(event)))
         elif http_method == "GET" and action == "list":
-            return handle_list_images(query_params)
+            return finalize(event, handle_list_images(query_params))
+        elif http_method == "GET" and action == "search":
+            return finalize(event, handle_search(query_params))
+        elif http_method == "GET" and action == "query":
+            return finalize(event, handle_query(query_params))
         elif http_method == "GET" and action == "delete":
             return handle_delete_file(query_params)
         else:
-            return create_response(400, {"error": "Invalid request. Use 'upload', 'download', or 'list'."})
+            return create_response(400, {"error": "Invalid request. Use 'upload', 'upload_init', 'upload_parts', 'upload_complete', "
+                                                 "'upload_abort', 'download', 'list', 'search', 'query', 'delete', 'batch_upload', "
+                                                 "'batch_download' or 'batch_delete'."})
     except Exception as e:
         print(f"Error occurred: {e}")
         return create_response(500, {"error": str(e)})
 
+def handle_warmup():
+    """
+    Pre-initializes every AWS client and DynamoDB table resource used by the handlers, and
+    reports the container's DynamoDB rate limiters, list cache hit ratio and download cache
+    occupancy; the download cache figures also go into the request's metrics.
+    """
+    clients = [image_handler.s3, image_handler.db_client.table, file_search.s3]
+    if list_cache.db_client:
+        clients.append(list_cache.db_client.table)
+    if file_search.db_client:
+        clients.append(file_search.db_client.table)
+    if isinstance(delete_queue, SQSQueue):
+        clients.append(delete_queue.sqs)
+    for index in (image_handler.ngrams, file_search.ngrams, image_handler.attributes, file_search.attributes):
+        if index:
+            clients.append(index.db_client.table)
+    download_stats = download_cache.stats()
+    lookups = download_stats["hits"] + download_stats["misses"]
+    metrics.gauge("download_cache.hit_ratio", download_stats["hits"] / lookups if lookups else 0.0, "None")
+    metrics.gauge("download_cache.entries", download_stats["entries"], "Count")
+    metrics.gauge("download_cache.bytes", download_stats["bytes"], "Bytes")
+    metrics.gauge("download_cache.evictions", download_stats["evictions"], "Count")
+    return create_response(200, {"message": "Warm.", "clients": sorted({_client_name(client) for client in clients}),
+                                 "rateLimits": rate_limit.snapshot(),
+                                 "listCache": list_cache.stats(), "downloadCache": download_stats})
+
+def _client_name(client):
+    """
+    Names a warmed client: "dynamodb:<table>" for a table resource, else the client's service.
+    """
+    if hasattr(client, 'table_name'):
+        return f"dynamodb:{client.table_name}"
+    return client.meta.service_model.service_name
+
+def handle_s3_event(event):
+    """
+    Applies a batch of S3 ObjectCreated/ObjectRemoved notifications to the listing index and saves its snapshot.
+    """
+    if listing_index is None:
+        return create_response(200, {"message": "Listing index disabled.", "applied": 0})
+    applied = listing_index.apply_notifications(file_search.s3, event['Records'])
+    return create_response(200, {"message": "Listing index updated.", "applied": applied})
+
+def _is_s3_event(event):
+    records = event.get('Records')
+    return bool(records) and isinstance(records, list) and records[0].get('eventSource') == 'aws:s3'
+
+def handle_sqs_event(event):
+    """
+    Purges the images named in a batch of delete queue messages. Messages with names left to retry
+    are reported as batch item failures, so SQS delivers only those again.
+    """
+    messages, malformed = [], []
+    for record in event['Records']:
+        # A message that does not parse fails alone; the rest of the batch is still purged
+        try:
+            names = json.loads(record['body'])['names']
+            if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+                raise ValueError("names must be a list of strings")
+            messages.append((record['messageId'], names))
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Malformed delete message {record.get('messageId')}: {e}")
+            malformed.append(record.get('messageId'))
+    try:
+        retry = set(delete_drain.purge_messages(messages)) if messages else set()
+    except Exception as e:
+        print(f"Delete drain error: {e}")
+        retry = {name for _, names in messages for name in names}
+    failed = malformed + [message_id for message_id, names in messages if not retry.isdisjoint(names)]
+    return {"statusCode": 200, "batchItemFailures": [{"itemIdentifier": message_id} for message_id in failed]}
+
+def _is_sqs_event(event):
+    records = event.get('Records')
+    return bool(records) and isinstance(records, list) and records[0].get('eventSource') == 'aws:sqs'
+
 def handle_upload(event):
     """
     Handles file upload via API Gateway.
@@ -47,12 +211,58 @@ def handle_upload(event):
         print(f"Upload error: {e}")
         return create_response(500, {"error": "Image upload failed.", "details": str(e)})
 
-def handle_download(query_params):
+def handle_upload_init(query_params):
+    """
+    Starts a multipart upload and returns presigned part URLs.
+    """
+    try:
+        return image_handler.upload_init(query_params)
+    except Exception as e:
+        print(f"Upload init error: {e}")
+        return create_response(500, {"error": "Upload initialisation failed.", "details": str(e)})
+
+def handle_upload_parts(query_params):
     """
-    Handles file download via API Gateway.
+    Presigns the next page of part URLs of a multipart upload.
     """
     try:
-        return image_handler.download(query_params)
+        return image_handler.upload_parts(query_params)
+    except Exception as e:
+        print(f"Upload parts error: {e}")
+        return create_response(500, {"error": "Part URL signing failed.", "details": str(e)})
+
+def handle_upload_complete(event):
+    """
+    Completes a multipart upload and records its metadata.
+    """
+    try:
+        return image_handler.upload_complete(event)
+    except Exception as e:
+        print(f"Upload complete error: {e}")
+        return create_response(500, {"error": "Upload completion failed.", "details": str(e)})
+
+def handle_upload_abort(query_params):
+    """
+    Aborts a multipart upload.
+    """
+    return image_handler.upload_abort(query_params)
+
+def handle_batch(action, event):
+    """
+    Runs one of the batch actions; per-item failures are reported in the body.
+    """
+    try:
+        return action(event)
+    except Exception as e:
+        print(f"Batch error: {e}")
+        return create_response(500, {"error": "Batch request failed.", "details": str(e)})
+
+def handle_download(query_params, headers):
+    """
+    Handles file download via API Gateway; a Range header asks for part of the image inline.
+    """
+    try:
+        return image_handler.download(query_params, headers)
     except Exception as e:
         print(f"Download error: {e}")
         return create_response(500, {"error": "Image download failed.", "details": str(e)})
@@ -65,37 +275,81 @@ def handle_delete_file(query_params):
 
 def handle_list_images(query_params):
     """
-    Lists all images in the S3 bucket with filters for prefix and size range.
+    Lists images by prefix, size range or upload date range.
     """
     try:
         prefix = query_params.get('prefix', '')  # Filter by prefix (e.g., folder or name pattern)
         min_size = query_params.get('minSize', '0')
         max_size = query_params.get('maxSize', '0')
+        uploaded_after = query_params.get('uploadedAfter')  # ISO 8601 date range on the upload time
+        uploaded_before = query_params.get('uploadedBefore')
+        next_token = query_params.get('nextToken')
 
         # Validate size parameters
         try:
             min_size = int(min_size)
             max_size = int(max_size)
+            limit = int(query_params.get('limit', '30'))
         except ValueError:
-            return create_response(400, {"error": "minSize and maxSize must be integers."})
+            return create_response(400, {"error": "minSize, maxSize and limit must be integers."})
 
         # Execute the appropriate search
         if prefix:
-            return file_search.prefix_search(prefix)
+            return file_search.prefix_search(prefix, limit=limit, next_token=next_token, min_size=min_size,
+                                             max_size=max_size)
         elif min_size > 0 or max_size > 0:
-            return file_search.size_search(min_size, max_size)
+            return file_search.size_search(min_size, max_size, limit=limit, next_token=next_token)
+        elif uploaded_after or uploaded_before:
+            return file_search.date_search(uploaded_after, uploaded_before, limit=limit, next_token=next_token)
         else:
-            return create_response(400, {"error": "Invalid search request. Provide a prefix or size range."})
+            return create_response(400, {"error": "Invalid search request. Provide a prefix, size range or date range."})
     except Exception as e:
         print(f"List images error: {e}")
         return create_response(500, {"error": "Image listing failed.", "details": str(e)})
 
+def handle_search(query_params):
+    """
+    Finds images by a fragment of their name, optionally filtered by size and upload date.
+    """
+    try:
+        try:
+            min_size = int(query_params.get('minSize', '0'))
+            max_size = int(query_params.get('maxSize', '0'))
+            limit = int(query_params.get('limit', '30'))
+        except ValueError:
+            return create_response(400, {"error": "minSize, maxSize and limit must be integers."})
+        return file_search.text_search(
+            query_params.get('q', ''), limit=limit, next_token=query_params.get('nextToken'),
+            min_size=min_size, max_size=max_size,
+            uploaded_after=query_params.get('uploadedAfter'), uploaded_before=query_params.get('uploadedBefore')
+        )
+    except Exception as e:
+        print(f"Search error: {e}")
+        return create_response(500, {"error": "Image search failed.", "details": str(e)})
+
+def handle_query(query_params):
+    """
+    Finds images whose metadata matches every predicate in 'where', e.g. format=JPEG;dimensions.width>=1920.
+    """
+    try:
+        try:
+            limit = int(query_params.get('limit', '30'))
+        except ValueError:
+            return create_response(400, {"error": "limit must be an integer."})
+        return file_search.metadata_query(query_params.get('where', ''), limit=limit,
+                                          next_token=query_params.get('nextToken'))
+    except Exception as e:
+        print(f"Query error: {e}")
+        return create_response(500, {"error": "Metadata query failed.", "details": str(e)})
+
 def create_response(status_code, body):
     """
     Utility function to create HTTP responses.
     """
+    with metrics.stage("json_encode"):
+        encoded = encode_json(body)
     return {
         "statusCode": status_code,
-        "body": json.dumps(body),
+        "body": encoded,
         "headers": {"Content-Type": "application/json"}
     }
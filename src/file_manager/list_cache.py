@@ -0,0 +1,241 @@
+import threading
+import time
+import zlib
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from assement.src.file_manager import metrics
+from assement.src.file_manager.cache import LRUCache
+from assement.src.file_manager.concurrency import run_concurrently
+from assement.src.file_manager.db_client import DynamoDBClient
+
+# Seconds a page stays valid in the shared table, and in a container's memory. A container's
+# copy is not invalidated by other containers' writes, so the memory TTL bounds how stale it gets.
+SHARED_TTL = 60
+MEMORY_TTL = 10
+MAX_ENTRIES = 256
+MAX_BYTES = 8 * 1024 * 1024
+# Sort key of each scope's generation counter
+GENERATION = "#generation"
+# Every scope cached in the shared table is registered in an item of its own, in one of
+# REGISTRY_SHARDS partitions ("#scopes:<n>"), so no single item grows with the scopes or takes
+# every registration. An entry expires REGISTRY_TTL seconds after it was last refreshed.
+REGISTRY = "#scopes:"
+REGISTRY_SHARDS = 8
+REGISTRY_TTL = 2 * SHARED_TTL
+REGISTRY_PAGE_SIZE = 1000
+
+
+def list_cache_table_definition(table_name):
+    """
+    create_table arguments for the shared page table used by ListCache: one partition per scope.
+    Enable TTL on its expires_at attribute to have expired pages removed.
+    """
+    return {
+        "TableName": table_name,
+        "KeySchema": [
+            {'AttributeName': 'scope', 'KeyType': 'HASH'},
+            {'AttributeName': 'entry', 'KeyType': 'RANGE'},
+        ],
+        "AttributeDefinitions": [
+            {'AttributeName': 'scope', 'AttributeType': 'S'},
+            {'AttributeName': 'entry', 'AttributeType': 'S'},
+        ],
+        "BillingMode": 'PAY_PER_REQUEST',
+    }
+
+
+def prefix_scope(prefix):
+    """
+    Scope of the pages of a prefix listing: the names starting with the prefix.
+    """
+    return "prefix:" + prefix
+
+
+def size_scope(min_size, max_size):
+    """
+    Scope of the pages of a size search: the images within the range (0 means no max size).
+    """
+    return f"size:{min_size}:{max_size}"
+
+
+def _covers(scope, changes):
+    """
+    True if a change to any of the (image_id, size) pairs may change the scope's pages.
+    """
+    kind, _, rest = scope.partition(":")
+    if kind == "prefix":
+        return any(image_id.startswith(rest) for image_id, _ in changes)
+    min_size, max_size = (int(bound) for bound in rest.split(":"))
+    return any(size is None or (min_size <= size and (not max_size or size <= max_size)) for _, size in changes)
+
+
+class ListCache:
+    """
+    Cache of listing responses, in the container's memory and optionally in a DynamoDB table
+    shared by every container. A response is cached under a scope, the names its pages can
+    contain (a prefix or a size range), and a query naming the page within it (filters, limit
+    and cursor). A write invalidates only the scopes that cover the names it touched.
+
+    In the shared table each scope has a generation counter that invalidation increments, and a
+    page is only served while it carries its scope's current generation. Writers find the scopes
+    to increment in the scope registry, which they query one shard at a time, concurrently. A
+    registry entry outlives every page stored under its scope: a container refreshes it before
+    caching a page that would expire after it.
+    """
+
+    def __init__(self, table_name=None, endpoint_url=None, ttl=SHARED_TTL, memory_ttl=MEMORY_TTL,
+                 max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, clock=time.time):
+        """
+        :param table_name: shared table created from list_cache_table_definition, or None for memory only
+        :param ttl: seconds a page stays valid in the shared table
+        :param memory_ttl: seconds a page stays valid in this container's memory
+        :param max_entries: bound on the pages kept in memory
+        :param max_bytes: bound on the response bodies kept in memory
+        """
+        self.db_client = DynamoDBClient(table_name=table_name, endpoint_url=endpoint_url) if table_name else None
+        self.ttl = ttl
+        self.memory_ttl = memory_ttl
+        self.clock = clock
+        self.memory = LRUCache(max_entries=max_entries, max_bytes=max_bytes)
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self._registered = {}
+        self._invalidations = 0
+        self._lock = threading.Lock()
+
+    def fetch(self, scope, query, compute):
+        """
+        :param scope: prefix_scope or size_scope of the page
+        :param query: string naming the page within its scope
+        :param compute: builds the response when it is not cached; only 200 responses are cached
+        :return: the response
+        """
+        key = (scope, query)
+        response = self.memory.get(key)
+        if response is not None:
+            metrics.count("list_cache.memory_hit")
+            return response
+
+        invalidations = self._invalidations
+        generation = None
+        if self.db_client:
+            response, generation = self._shared_get(scope, query)
+            if response is not None:
+                metrics.count("list_cache.shared_hit")
+                self.memory.put(key, response, len(response["body"]), self.memory_ttl)
+                return response
+
+        metrics.count("list_cache.miss")
+        response = compute()
+        if response.get("statusCode") != 200:
+            return response
+        # A write invalidating while the page was computed may have missed it
+        if invalidations == self._invalidations:
+            self.memory.put(key, response, len(response["body"]), self.memory_ttl)
+        if generation is not None:
+            self._shared_put(scope, query, response, generation)
+        return response
+
+    def invalidate(self, changes):
+        """
+        Drops the cached pages whose scope covers any of the changed names.
+        :param changes: (image_id, size) pairs of the rows written or deleted, with both the old and the
+                        new size of a rewritten row; size None when unknown
+        :raises ClientError: when the shared table could not be updated
+        """
+        changes = list(changes)
+        if not changes:
+            return
+        with self._lock:
+            self._invalidations += 1
+        self.memory.invalidate_where(lambda key: _covers(key[0], changes))
+        if self.db_client is None:
+            return
+        now = self.clock()
+        for shard in run_concurrently(*(lambda shard=shard: self._registry(shard)
+                                        for shard in range(REGISTRY_SHARDS))):
+            for entry in shard.result():
+                # An expired entry TTL has yet to remove has no page left to invalidate
+                if entry["expires_at"] > now and _covers(entry["entry"], changes):
+                    self.db_client.add({"scope": entry["entry"], "entry": GENERATION}, "generation", 1)
+
+    def stats(self):
+        """
+        :return: the memory cache's counters, the shared table's hits and misses, and the overall hit ratio
+        """
+        memory = self.memory.stats()
+        lookups = memory["hits"] + memory["misses"]
+        hits = memory["hits"] + self.shared_hits
+        return {"memory": memory, "shared_hits": self.shared_hits, "shared_misses": self.shared_misses,
+                "hit_ratio": round(hits / lookups, 3) if lookups else 0.0}
+
+    def _shared_get(self, scope, query):
+        """
+        Reads the page and its scope's generation. The scope is registered first, so a write
+        made after the generation is read always increments it.
+        :return: the cached response or None, and the generation to store a computed page under
+                 (None when it cannot be stored)
+        """
+        try:
+            self._register(scope)
+            entry, counter = (lookup.result() for lookup in run_concurrently(
+                lambda: self.db_client.get_item({"scope": scope, "entry": query}, consistent_read=True),
+                lambda: self.db_client.get_item({"scope": scope, "entry": GENERATION}, consistent_read=True)
+            ))
+        except ClientError as e:
+            print(f"List cache read failed: {e}")
+            return None, None
+        generation = int(counter["generation"]) if counter else 0
+        hit = entry is not None and int(entry["generation"]) == generation and entry["expires_at"] > self.clock()
+        with self._lock:
+            if hit:
+                self.shared_hits += 1
+            else:
+                self.shared_misses += 1
+        if hit:
+            return {"statusCode": 200, "body": entry["body"], "headers": entry["headers"]}, generation
+        return None, generation
+
+    def _shared_put(self, scope, query, response, generation):
+        try:
+            self.db_client.replace_item({
+                "scope": scope,
+                "entry": query,
+                "generation": generation,
+                "body": response["body"],
+                "headers": response.get("headers") or {},
+                "expires_at": int(self.clock() + self.ttl)
+            })
+        except ClientError as e:
+            print(f"List cache write failed: {e}")
+
+    def _register(self, scope):
+        """
+        Makes sure the scope's registry entry lasts longer than a page stored now.
+        """
+        now = self.clock()
+        if self._registered.get(scope, 0) > now + self.ttl:
+            return
+        expires_at = int(now + max(REGISTRY_TTL, 2 * self.ttl))
+        self.db_client.replace_item({"scope": _registry_shard(scope), "entry": scope, "expires_at": expires_at})
+        self._registered[scope] = expires_at
+
+    def _registry(self, shard):
+        """
+        :return: every entry of one registry shard
+        """
+        entries, start_key = [], None
+        while True:
+            response = self.db_client.query_items(Key("scope").eq(f"{REGISTRY}{shard}"), REGISTRY_PAGE_SIZE,
+                                                  exclusive_start_key=start_key, consistent_read=True)
+            entries += response.get("Items", [])
+            start_key = response.get("LastEvaluatedKey")
+            if not start_key:
+                return entries
+
+
+def _registry_shard(scope):
+    """
+    Partition key of the scope's registry entry.
+    """
+    return f"{REGISTRY}{zlib.crc32(scope.encode('utf-8')) % REGISTRY_SHARDS}"
@@ -0,0 +1,234 @@
+import bisect
+import gzip
+import json
+import struct
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+from urllib.parse import unquote_plus
+from botocore.exceptions import ClientError
+from assement.src.file_manager.key_layout import INDEX_PREFIX, INTERNAL_PREFIXES, logical_name
+
+SNAPSHOT_KEY = INDEX_PREFIX + "listing.snapshot"
+# How often a warm container checks the snapshot for changes made by other containers
+REFRESH_INTERVAL = 30
+# Attempts at saving the snapshot when another invocation saved it first
+SAVE_RETRIES = 3
+_MAGIC = b"LIX1"
+
+
+class ListingIndex:
+    """
+    In-memory listing of a bucket: a sorted list of keys with parallel array-backed size and
+    mtime (epoch seconds) columns, so prefix listings are bisect range scans and size filters
+    scan a packed array slice.
+
+    It is loaded from a snapshot object at first use and re-read when the snapshot changes.
+    S3 ObjectCreated/ObjectRemoved notifications are applied by apply_notifications, which also
+    saves the snapshot; writes made by this container are applied locally as they happen.
+    Objects in the sharded key layout are indexed under their image name, not their key.
+    """
+
+    def __init__(self, bucket_name, snapshot_key=SNAPSHOT_KEY, clock=time.monotonic):
+        self.bucket_name = bucket_name
+        self.snapshot_key = snapshot_key
+        self.clock = clock
+        self.keys = []
+        self.sizes = array('q')
+        self.mtimes = array('d')
+        self.loaded = False
+        self.etag = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def ensure_loaded(self, s3):
+        """
+        Loads the snapshot on first use and re-reads it when it changed, checking at most every REFRESH_INTERVAL.
+        :return: True if the index can answer listings
+        """
+        now = self.clock()
+        if self._checked_at is None or now - self._checked_at >= REFRESH_INTERVAL:
+            self._checked_at = now
+            try:
+                if not self.load(s3) and self.etag:
+                    # The snapshot is there but unreadable: replace it from a full listing
+                    self.rebuild(s3)
+                    self.save(s3)
+            except ClientError as e:
+                print(f"Listing snapshot not loaded: {e}")
+        return self.loaded
+
+    def load(self, s3):
+        """
+        Reads the snapshot, unless it has not changed since the last load.
+        :return: False if there is no snapshot, or it cannot be decoded; then etag is that of the
+                 unreadable snapshot, so that a save replaces it
+        """
+        params = {"Bucket": self.bucket_name, "Key": self.snapshot_key}
+        if self.etag:
+            params["IfNoneMatch"] = self.etag
+        try:
+            response = s3.get_object(**params)
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code in ("304", "NotModified"):
+                return True
+            if code in ("NoSuchKey", "404"):
+                self.etag = None
+                return False
+            raise
+        try:
+            keys, sizes, mtimes = _decode(response["Body"].read())
+        except (OSError, EOFError, ValueError, struct.error) as e:
+            print(f"Listing snapshot unreadable: {e}")
+            self.etag = response["ETag"]
+            return False
+        with self._lock:
+            self.keys, self.sizes, self.mtimes = keys, sizes, mtimes
+            self.etag = response["ETag"]
+            self.loaded = True
+        return True
+
+    def rebuild(self, s3):
+        """
+        Replaces the index with a full listing of the bucket.
+        """
+        objects = {}
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=self.bucket_name):
+            for obj in page.get('Contents', []):
+                if not obj['Key'].startswith(INTERNAL_PREFIXES):
+                    # Sharded keys list in shard order, so names are sorted once mapped
+                    objects[logical_name(obj['Key']) or obj['Key']] = (obj['Size'], obj['LastModified'].timestamp())
+        keys = sorted(objects)
+        sizes = array('q', (objects[key][0] for key in keys))
+        mtimes = array('d', (objects[key][1] for key in keys))
+        with self._lock:
+            self.keys, self.sizes, self.mtimes = keys, sizes, mtimes
+            self.loaded = True
+
+    def save(self, s3):
+        """
+        Writes the snapshot, only if nobody else wrote it since we read it.
+        :raises ClientError: PreconditionFailed when the snapshot changed in the meantime
+        """
+        with self._lock:
+            body = _encode(self.keys, self.sizes, self.mtimes)
+        condition = {"IfMatch": self.etag} if self.etag else {"IfNoneMatch": "*"}
+        response = s3.put_object(Bucket=self.bucket_name, Key=self.snapshot_key, Body=body,
+                                 ContentType="application/octet-stream", **condition)
+        self.etag = response["ETag"]
+
+    def put(self, key, size, mtime):
+        """
+        Adds or updates one key.
+        """
+        if key.startswith(INTERNAL_PREFIXES):
+            return
+        with self._lock:
+            i = bisect.bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                self.sizes[i] = size
+                self.mtimes[i] = mtime
+            else:
+                self.keys.insert(i, key)
+                self.sizes.insert(i, size)
+                self.mtimes.insert(i, mtime)
+
+    def remove(self, key):
+        with self._lock:
+            i = bisect.bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                del self.keys[i]
+                del self.sizes[i]
+                del self.mtimes[i]
+
+    def apply_notifications(self, s3, records):
+        """
+        Applies S3 event notification records to the current snapshot and saves it, retrying
+        from a fresh copy when another invocation saved first. Builds the snapshot from a
+        full listing if there is none yet.
+        :return: number of records applied
+        """
+        # The snapshot's own writes notify too, and saving again for them would never settle;
+        # blobs and variants are not images either
+        records = [record for record in records if record.get('eventSource') == 'aws:s3'
+                   and not unquote_plus(record['s3']['object']['key']).startswith(INTERNAL_PREFIXES)]
+        if not records:
+            return 0
+        # S3 sequencers order the events of one key; compare them at equal length
+        records.sort(key=lambda record: record['s3']['object'].get('sequencer', '').rjust(32, '0'))
+        for attempt in range(SAVE_RETRIES):
+            if not self.load(s3):
+                self.rebuild(s3)
+            for record in records:
+                obj = record['s3']['object']
+                key = unquote_plus(obj['key'])
+                key = logical_name(key) or key
+                if record['eventName'].startswith('ObjectCreated'):
+                    event_time = datetime.fromisoformat(record['eventTime'].replace('Z', '+00:00'))
+                    self.put(key, obj.get('size', 0), event_time.timestamp())
+                elif record['eventName'].startswith('ObjectRemoved'):
+                    self.remove(key)
+            try:
+                self.save(s3)
+                self._checked_at = self.clock()
+                return len(records)
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ("PreconditionFailed", "ConditionalRequestConflict") \
+                        or attempt == SAVE_RETRIES - 1:
+                    raise
+                # Start over from the other invocation's snapshot
+                self.etag = None
+
+    def scan(self, prefix, start_after=None, limit=30, min_size=0, max_size=0):
+        """
+        Lists keys with the prefix in key order, optionally within a size range.
+        :return: (list of (key, size, last modified ISO string), True if more keys follow)
+        """
+        with self._lock:
+            lo = bisect.bisect_left(self.keys, prefix)
+            if start_after is not None and start_after >= prefix:
+                lo = bisect.bisect_right(self.keys, start_after, lo)
+            hi = bisect.bisect_left(self.keys, prefix + '\U0010ffff', lo)
+            positions = range(lo, hi)
+            if min_size or max_size:
+                # Indexed rather than sliced: a slice would copy every size under the prefix
+                sizes = self.sizes
+                positions = (i for i in positions if min_size <= sizes[i] and (not max_size or sizes[i] <= max_size))
+            found = []
+            for i in positions:
+                if len(found) == limit:
+                    return found, True
+                found.append((self.keys[i], self.sizes[i],
+                              datetime.fromtimestamp(self.mtimes[i], tz=timezone.utc).isoformat()))
+            return found, False
+
+
+def _encode(keys, sizes, mtimes):
+    """
+    Snapshot layout, gzipped: magic, keys JSON length, keys JSON, sizes, mtimes (little-endian).
+    """
+    keys_json = json.dumps(keys, separators=(',', ':')).encode('utf-8')
+    if sys.byteorder != 'little':
+        sizes, mtimes = array('q', sizes), array('d', mtimes)
+        sizes.byteswap()
+        mtimes.byteswap()
+    return gzip.compress(_MAGIC + struct.pack('<I', len(keys_json)) + keys_json + sizes.tobytes() + mtimes.tobytes(),
+                         compresslevel=6)
+
+
+def _decode(data):
+    data = gzip.decompress(data)
+    if data[:4] != _MAGIC:
+        raise ValueError("Not a listing snapshot")
+    (length,) = struct.unpack_from('<I', data, 4)
+    keys = json.loads(data[8:8 + length])
+    column = 8 * len(keys)
+    sizes = array('q', data[8 + length:8 + length + column])
+    mtimes = array('d', data[8 + length + column:8 + length + 2 * column])
+    if sys.byteorder != 'little':
+        sizes.byteswap()
+        mtimes.byteswap()
+    return keys, sizes, mtimes
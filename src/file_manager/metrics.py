@@ -0,0 +1,158 @@
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# CloudWatch namespace of the embedded-metric-format (EMF) lines
+NAMESPACE = "ImageService"
+# Longest query-string value and whole event summary written to the logs
+MAX_VALUE_LENGTH = 100
+MAX_SUMMARY_LENGTH = 1024
+REDACTED_HEADERS = {"authorization", "cookie", "x-amz-security-token", "x-api-key"}
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+_cold_start = True
+
+
+class RequestMetrics:
+    """
+    Stage timings of one request. Stages may be recorded from pool threads, and a
+    stage that runs more than once (e.g. several S3 calls) accumulates.
+    Counts accumulate the same way; gauges keep the last value recorded.
+    """
+
+    def __init__(self, action, cold_start):
+        self.action = action
+        self.cold_start = cold_start
+        self.status_code = None
+        self.stages = {}
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds * 1000
+
+    def add(self, name, value):
+        with self._lock:
+            self.values[name] = (self.values.get(name, (0, "Count"))[0] + value, "Count")
+
+    def set(self, name, value, unit):
+        with self._lock:
+            self.values[name] = (value, unit)
+
+    def to_emf(self):
+        """
+        :return: the metrics as one CloudWatch embedded-metric-format record
+        """
+        stages = {name: round(ms, 3) for name, ms in self.stages.items()}
+        values = {name: round(value, 3) for name, (value, _) in self.values.items()}
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [["Action"]],
+                    "Metrics": [{"Name": name, "Unit": "Milliseconds"} for name in stages] +
+                               [{"Name": name, "Unit": unit} for name, (_, unit) in self.values.items()]
+                }]
+            },
+            "Action": self.action,
+            "ColdStart": self.cold_start,
+            "StatusCode": self.status_code,
+            **stages,
+            **values
+        }
+
+
+@contextmanager
+def request(action):
+    """
+    Collects the stages of one request and prints them as an EMF line when it ends.
+    The first request of a container is flagged as the cold start.
+    """
+    global _cold_start
+    request_metrics = RequestMetrics(action, _cold_start)
+    _cold_start = False
+    token = _current.set(request_metrics)
+    start = time.perf_counter()
+    try:
+        yield request_metrics
+    finally:
+        request_metrics.record("total", time.perf_counter() - start)
+        _current.reset(token)
+        print(json.dumps(request_metrics.to_emf()))
+
+
+@contextmanager
+def stage(name):
+    """
+    Times a block as a stage of the current request; a no-op outside of one.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        request_metrics = _current.get()
+        if request_metrics is not None:
+            request_metrics.record(name, time.perf_counter() - start)
+
+
+def count(name, value=1):
+    """
+    Adds to a count of the current request; a no-op outside of one.
+    """
+    request_metrics = _current.get()
+    if request_metrics is not None:
+        request_metrics.add(name, value)
+
+
+def gauge(name, value, unit):
+    """
+    Records a value of the current request, e.g. a rate, keeping the last one; a no-op outside of one.
+    """
+    request_metrics = _current.get()
+    if request_metrics is not None:
+        request_metrics.set(name, value, unit)
+
+
+def instrument(events):
+    """
+    Times every API call of a botocore client as the stage '<service>.<Operation>'.
+    :param events: the client's meta.events
+    """
+    events.register("before-call.*.*", _before_call)
+    events.register("after-call.*.*", _after_call)
+    events.register("after-call-error.*.*", _after_call)
+
+
+def _before_call(context, model, **kwargs):
+    context["metrics_stage"] = f"{model.service_model.service_name}.{model.name}"
+    context["metrics_start"] = time.perf_counter()
+
+
+def _after_call(context, **kwargs):
+    start = context.pop("metrics_start", None)
+    request_metrics = _current.get()
+    if start is not None and request_metrics is not None:
+        request_metrics.record(context["metrics_stage"], time.perf_counter() - start)
+
+
+def summarize_event(event):
+    """
+    A log-safe summary of an API Gateway event: never the body, only its size, with
+    credentials redacted and long values truncated, capped at MAX_SUMMARY_LENGTH characters.
+    """
+    query_params = event.get('queryStringParameters') or {}
+    headers = event.get('headers') or {}
+    summary = json.dumps({
+        "httpMethod": event.get('httpMethod'),
+        "path": event.get('path'),
+        "queryStringParameters": {key: str(value)[:MAX_VALUE_LENGTH] for key, value in query_params.items()},
+        "headers": {key: "[redacted]" if key.lower() in REDACTED_HEADERS else str(value)[:MAX_VALUE_LENGTH]
+                    for key, value in headers.items()},
+        "bodyLength": len(event.get('body') or ''),
+        "isBase64Encoded": bool(event.get('isBase64Encoded'))
+    })
+    return summary if len(summary) <= MAX_SUMMARY_LENGTH else summary[:MAX_SUMMARY_LENGTH - 3] + "..."
@@ -0,0 +1,197 @@
+"""
+Moves existing objects to the sharded key layout of FileHandler's key_shards.
+
+Scans the metadata table with a parallel Scan, one task per segment, and for every row whose
+object is not under its sharded key, copies the object there, points the row at the copy and
+records the key it was moved from. Presigned URLs handed out for the old key keep working until
+the old object is deleted, which a run does for rows moved more than --grace seconds before; so
+a second run, an hour after the first, finishes the migration. Rows already moved are skipped,
+so a run can be stopped and started again at any time. Deduplicated uploads keep their blobs/
+keys, which are spread by content hash already. Run it once the handler's KEY_SHARDS is set to
+--shards, so that new uploads are stored under the keys the migration moves objects to.
+
+    python -m assement.src.file_manager.migrate_keys --shards 16 --dry-run
+    python -m assement.src.file_manager.migrate_keys --shards 16
+"""
+import argparse
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from botocore.exceptions import ClientError
+from assement.src.file_manager.db_client import format_timestamp
+from assement.src.file_manager.file_handler import PRESIGNED_URL_EXPIRY
+from assement.src.file_manager.key_layout import shard_key, validate_shards
+
+WORKERS = 32
+SCAN_SEGMENTS = 32
+# User metadata on each copy, holding the ETag of the object it was copied from, so a copy left by
+# an interrupted run is recognised and one written by an upload is never overwritten
+COPIED_FROM = "copied-from-etag"
+# Names of conflicting rows, whose copy an upload may have overwritten, listed in the report
+REPORTED_NAMES = 100
+
+
+class KeyMigration:
+    """
+    One migration run over a FileHandler's bucket and metadata table.
+    """
+
+    def __init__(self, handler, shards, workers=WORKERS, segments=SCAN_SEGMENTS, grace=PRESIGNED_URL_EXPIRY,
+                 dry_run=False, progress=print, clock=time.monotonic):
+        """
+        :param handler: FileHandler whose objects are moved
+        :param shards: key shards to move the objects to, as FileHandler's key_shards
+        :param workers: threads making AWS calls
+        :param segments: parallel Scan segments
+        :param grace: seconds an old object is kept after its move, for the presigned URLs of it
+        :param dry_run: only report what would be moved and deleted
+        :param progress: called with a report dict as segments finish
+        """
+        self.handler = handler
+        self.shards = validate_shards(shards)
+        self.workers = workers
+        self.segments = segments
+        self.grace = grace
+        self.dry_run = dry_run
+        self.progress = progress
+        self.clock = clock
+
+    def run(self):
+        """
+        :return: the report: rows scanned, rows moved (or to move), old objects deleted (or to delete),
+                 rows still in their grace period, and the names of rows that changed under the move
+        """
+        started = self.clock()
+        now = datetime.now(timezone.utc)
+        self.moved_at = format_timestamp(now)
+        self.delete_before = format_timestamp(now - timedelta(seconds=self.grace))
+        counts = Counter()
+        conflicts = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="migrate-keys") as pool:
+            futures = [pool.submit(self._segment, segment) for segment in range(self.segments)]
+            for done, future in enumerate(as_completed(futures), 1):
+                segment_counts, segment_conflicts = future.result()
+                counts.update(segment_counts)
+                conflicts.extend(segment_conflicts)
+                self.progress({**counts, "segments_done": done, "elapsed_s": round(self.clock() - started, 1)})
+        if not self.dry_run and (counts["moved"] or counts["deleted"]):
+            self._refresh_listing()
+        return {**counts, "conflicts": sorted(conflicts)[:REPORTED_NAMES],
+                "elapsed_s": round(self.clock() - started, 1)}
+
+    def _segment(self, segment):
+        """
+        Migrates the rows of one Scan segment; runs on a worker thread.
+        :return: (count of rows per outcome, names of rows whose copy an upload may have overwritten)
+        """
+        counts, conflicts = Counter(), []
+        start_key = None
+        while True:
+            page = self.handler.db_client.scan_items(
+                segment, self.segments, start_key,
+                attributes=("image_id", "object_key", "moved_from", "moved_at", "content_hash", "uploaded_at",
+                            "deleted_at"))
+            for row in page.get("Items", []):
+                outcome = self._migrate(row)
+                counts["rows"] += 1
+                counts[outcome] += 1
+                if outcome == "conflict":
+                    conflicts.append(row["image_id"])
+            start_key = page.get("LastEvaluatedKey")
+            if not start_key:
+                return counts, conflicts
+
+    def _migrate(self, row):
+        """
+        Moves one row's object, or deletes the object it was moved from once the grace period is over.
+        :return: the outcome, counted in the report
+        """
+        if row.get("content_hash") or row.get("deleted_at"):
+            return "skipped"
+        key = {"image_id": row["image_id"]}
+        if row.get("moved_from"):
+            if row.get("moved_at", "") >= self.delete_before:
+                return "waiting"
+            if self.dry_run:
+                return "to_delete"
+            # Forgotten first: an upload of the name since the scan replaced the row, and may have used the key
+            if not self.handler.db_client.clear_moved(key, row["moved_from"]):
+                return "changed"
+            self.handler.s3.delete_object(Bucket=self.handler.bucket_name, Key=row["moved_from"])
+            return "deleted"
+
+        source = row.get("object_key", row["image_id"])
+        destination = shard_key(row["image_id"], self.shards)
+        if source == destination:
+            return "in_place"
+        if self.dry_run:
+            return "to_move"
+        head = self._head(source)
+        if head is None:
+            # Reconcile prunes rows whose object is gone
+            return "missing"
+        existing = self._head(destination)
+        if existing is not None and existing["Metadata"].get(COPIED_FROM) != head["ETag"]:
+            # Uploaded under the new layout since the scan; the upload's row write repoints the name
+            return "changed"
+        if existing is None:
+            self.handler.s3.copy(
+                {"Bucket": self.handler.bucket_name, "Key": source}, self.handler.bucket_name, destination,
+                ExtraArgs={"MetadataDirective": "REPLACE", "ContentType": head.get("ContentType", ""),
+                           "Metadata": {**head.get("Metadata", {}), COPIED_FROM: head["ETag"]}})
+        if self.handler.db_client.move_object(key, destination, source, row.get("uploaded_at", ""), self.moved_at):
+            return "moved"
+        # The row changed since the scan. Unless it now points at the copy, which an upload may
+        # have written just before it, the copy is nobody's
+        current = self.handler.db_client.get_item(key, attributes=("object_key",), consistent_read=True)
+        if current is not None and current.get("object_key") == destination:
+            return "conflict"
+        self.handler.s3.delete_object(Bucket=self.handler.bucket_name, Key=destination)
+        return "changed"
+
+    def _head(self, key):
+        """
+        :return: the object's head_object response, or None if there is none
+        """
+        try:
+            return self.handler.s3.head_object(Bucket=self.handler.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                raise
+            return None
+
+    def _refresh_listing(self):
+        """
+        Rebuilds the listing snapshot, if there is one. Its notifications do not order a copy's
+        creation against the removal of the object it was moved from, which both map to one name.
+        """
+        listing = self.handler.listing
+        try:
+            if listing and listing.load(self.handler.s3):
+                listing.rebuild(self.handler.s3)
+                listing.save(self.handler.s3)
+        except ClientError as e:
+            print(f"Listing snapshot not rebuilt: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, required=True, help="key shards, as the handler's KEY_SHARDS")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--segments", type=int, default=SCAN_SEGMENTS)
+    parser.add_argument("--grace", type=int, default=PRESIGNED_URL_EXPIRY,
+                        help="seconds to keep moved objects under their old keys")
+    parser.add_argument("--dry-run", action="store_true", help="only report the objects that would be moved")
+    args = parser.parse_args()
+
+    from assement.src.file_manager import lambda_function
+    migration = KeyMigration(lambda_function.image_handler, args.shards, workers=args.workers,
+                             segments=args.segments, grace=args.grace, dry_run=args.dry_run,
+                             progress=lambda report: print(json.dumps(report), flush=True))
+    print(json.dumps(migration.run()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+from collections import Counter
+from boto3.dynamodb.conditions import Key
+from assement.src.file_manager.concurrency import run_concurrently
+
+NGRAM_SIZE = 3
+# Share of the query's trigrams a name must contain to match; below 1 so typos still match
+MIN_OVERLAP = 0.5
+# Posting lists longer than this (e.g. "jpg") are treated like stop words and left out of the scoring
+MAX_POSTINGS = 5000
+
+
+def ngrams(text):
+    """
+    The distinct lowercase trigrams of a name or query.
+    """
+    text = text.lower()
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+def ngram_table_definition(table_name):
+    """
+    create_table arguments for the trigram -> image table used by NGramIndex.
+    """
+    return {
+        "TableName": table_name,
+        "KeySchema": [
+            {'AttributeName': 'gram', 'KeyType': 'HASH'},
+            {'AttributeName': 'image_id', 'KeyType': 'RANGE'},
+        ],
+        "AttributeDefinitions": [
+            {'AttributeName': 'gram', 'AttributeType': 'S'},
+            {'AttributeName': 'image_id', 'AttributeType': 'S'},
+        ],
+        "BillingMode": 'PAY_PER_REQUEST',
+    }
+
+
+class NGramIndex:
+    """
+    Inverted index from filename trigrams to images, for substring and fuzzy search.
+    One posting per (trigram, image) carries the image's size and upload time, so
+    search results can be filtered and listed without reading the metadata table.
+    """
+
+    def __init__(self, db_client):
+        self.db_client = db_client
+
+    def add(self, items):
+        """
+        Writes the postings of metadata items, overwriting those of earlier uploads under the same names.
+        :return: write requests still unprocessed after the retries
+        """
+        postings = [
+            {"gram": gram, "image_id": item["image_id"], "size": item["size"], "uploaded_at": item["uploaded_at"]}
+            for item in items
+            for gram in ngrams(item["image_id"])
+        ]
+        return self.db_client.batch_write_items(items=postings)
+
+    def remove(self, image_ids):
+        """
+        Deletes every posting of the named images.
+        :return: write requests still unprocessed after the retries
+        """
+        keys = [{"gram": gram, "image_id": image_id} for image_id in image_ids for gram in ngrams(image_id)]
+        return self.db_client.batch_write_items(delete_keys=keys)
+
+    def search(self, query):
+        """
+        Finds the images whose names share at least MIN_OVERLAP of the query's trigrams.
+        :return: (posting, score) pairs, best first: more shared trigrams, then names
+                 containing the query verbatim, then shorter names
+        """
+        grams = sorted(ngrams(query))
+        lists = [future.result() for future in run_concurrently(*(lambda gram=gram: self._postings(gram) for gram in grams))]
+        # Drop the over-common trigrams; if every one is, match on the first MAX_POSTINGS of each
+        scored = [postings for postings, complete in lists if complete] or [postings for postings, _ in lists]
+
+        hits = Counter()
+        found = {}
+        for postings in scored:
+            for posting in postings:
+                hits[posting["image_id"]] += 1
+                found[posting["image_id"]] = posting
+
+        needle = query.lower()
+        matches = [image_id for image_id, count in hits.items() if count >= MIN_OVERLAP * len(scored)]
+        matches.sort(key=lambda image_id: (-hits[image_id], needle not in image_id.lower(), len(image_id), image_id))
+        return [(found[image_id], hits[image_id] / len(scored)) for image_id in matches]
+
+    def _postings(self, gram):
+        """
+        Reads a posting list, stopping after MAX_POSTINGS.
+        :return: (postings, True if that is the whole list)
+        """
+        postings = []
+        start_key = None
+        while len(postings) < MAX_POSTINGS:
+            response = self.db_client.query_items(Key('gram').eq(gram), MAX_POSTINGS - len(postings), start_key)
+            postings.extend(response.get('Items', []))
+            start_key = response.get('LastEvaluatedKey')
+            if not start_key:
+                return postings, True
+        return postings, False
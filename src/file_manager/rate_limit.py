@@ -0,0 +1,161 @@
+import threading
+import time
+from assement.src.file_manager import metrics
+
+# Error codes DynamoDB answers with when a table or the account is over its capacity
+THROTTLE_CODES = {"ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded"}
+# Items per second each table's limiter starts at and stays within. Additive increase: at full
+# speed the rate grows by INCREASE items/s every second nothing is throttled. Multiplicative
+# decrease: a throttle scales it by DECREASE, at most once per DECREASE_INTERVAL seconds, since
+# the requests in flight when a table starts throttling all come back throttled together.
+INITIAL_RATE = 200.0
+MIN_RATE = 1.0
+MAX_RATE = 4000.0
+INCREASE = 20.0
+DECREASE = 0.5
+DECREASE_INTERVAL = 1.0
+# Burst allowance, in seconds' worth of the current rate
+BURST_SECONDS = 1.0
+
+_limiters = {}
+_lock = threading.Lock()
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose refill rate is adjusted AIMD-style from DynamoDB's throttling responses.
+    A request takes one token per item it reads or writes. Tokens may be borrowed: the bucket
+    goes negative and the caller sleeps until the debt is paid, so a large batch is never starved.
+    """
+
+    def __init__(self, rate=INITIAL_RATE, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        self.throttles = 0
+        self.waited = 0.0
+        self._tokens = rate * BURST_SECONDS
+        self._updated_at = clock()
+        self._decreased_at = None
+        self._lock = threading.Lock()
+
+    def acquire(self, cost=1):
+        """
+        Takes `cost` tokens, sleeping until the bucket has them.
+        :return: seconds waited
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= cost
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.waited += wait
+        if wait:
+            self.sleep(wait)
+        return wait
+
+    def on_success(self, cost=1):
+        with self._lock:
+            self.rate = min(MAX_RATE, self.rate + INCREASE * cost / self.rate)
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttles += 1
+            now = self.clock()
+            if self._decreased_at is None or now - self._decreased_at >= DECREASE_INTERVAL:
+                self._decreased_at = now
+                self._refill()
+                self.rate = max(MIN_RATE, self.rate * DECREASE)
+                self._tokens = min(self._tokens, self.rate * BURST_SECONDS)
+
+    def snapshot(self):
+        with self._lock:
+            self._refill()
+            return {"rate": round(self.rate, 1), "tokens": round(self._tokens, 1), "throttles": self.throttles,
+                    "waited_s": round(self.waited, 3)}
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.rate * BURST_SECONDS, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+
+def limiter(table_name):
+    """
+    The container's limiter for a table, created on first use.
+    """
+    with _lock:
+        if table_name not in _limiters:
+            _limiters[table_name] = AdaptiveRateLimiter()
+        return _limiters[table_name]
+
+
+def snapshot():
+    """
+    State of every table's limiter, e.g. for the warmup response.
+    """
+    with _lock:
+        limiters = dict(_limiters)
+    return {table_name: table_limiter.snapshot() for table_name, table_limiter in limiters.items()}
+
+
+def reset():
+    """
+    Forgets every limiter, e.g. between tests or benchmark runs.
+    """
+    with _lock:
+        _limiters.clear()
+
+
+def install(events):
+    """
+    Puts every attempt of a DynamoDB client's calls through the limiters of the tables it touches,
+    and feeds the outcome back to them. Records the time spent waiting as the stage
+    'dynamodb.rate_limit_wait', throttled attempts as the count 'dynamodb.throttled' and the
+    limiter's rate as 'dynamodb.rate_limit'.
+    :param events: the client's meta.events
+    """
+    events.register("before-call.dynamodb.*", _before_call)
+    events.register("before-send.dynamodb.*", _before_send)
+    # Ahead of the retry handler, which stops the event once it decides to retry
+    events.register_first("needs-retry.dynamodb.*", _needs_retry)
+
+
+def _costs(params):
+    """
+    Items per table that a request reads or writes.
+    """
+    if "TableName" in params:
+        return {params["TableName"]: 1}
+    return {table_name: max(1, len(requests["Keys"]) if isinstance(requests, dict) else len(requests))
+            for table_name, requests in (params.get("RequestItems") or {}).items()}
+
+
+def _before_call(params, context, **kwargs):
+    context["rate_limit_costs"] = _costs(params)
+
+
+def _before_send(request, **kwargs):
+    for table_name, cost in (request.context or {}).get("rate_limit_costs", {}).items():
+        table_limiter = limiter(table_name)
+        with metrics.stage("dynamodb.rate_limit_wait"):
+            table_limiter.acquire(cost)
+        metrics.gauge("dynamodb.rate_limit", table_limiter.rate, "Count/Second")
+
+
+def _needs_retry(response, request_dict, **kwargs):
+    costs = request_dict["context"].get("rate_limit_costs", {})
+    if response is None:
+        return None  # a connection error says nothing about capacity
+    parsed = response[1]
+    if parsed.get("Error", {}).get("Code") in THROTTLE_CODES:
+        throttled = set(costs)
+    else:
+        # Unprocessed batch items are DynamoDB throttling part of a batch
+        throttled = set(parsed.get("UnprocessedItems") or ()) | set(parsed.get("UnprocessedKeys") or ())
+    for table_name, cost in costs.items():
+        if table_name in throttled:
+            limiter(table_name).on_throttle()
+            metrics.count("dynamodb.throttled")
+        elif "Error" not in parsed:
+            limiter(table_name).on_success(cost)
+    return None
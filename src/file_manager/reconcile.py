@@ -0,0 +1,276 @@
+"""
+Reconciles the metadata table with the bucket.
+
+Lists the bucket and scans the table at the same time, across a worker pool, then writes
+rows (with empty metadata) for objects that have none and deletes rows whose object is gone.
+Tombstoned rows, whose deferred delete never reached the delete drain, are purged.
+The bucket listing starts as one key range and splits a range whenever a page of it comes
+back full, so the workers spread over however the keys are distributed; the table is read
+with a parallel Scan, one task per segment. Progress is checkpointed to a file, and a run
+started with the same --checkpoint resumes where the last one stopped.
+
+    python -m assement.src.file_manager.reconcile --checkpoint reconcile.json
+    python -m assement.src.file_manager.reconcile --dry-run
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from os.path import commonprefix
+from assement.src.file_manager.db_client import format_timestamp
+from assement.src.file_manager.key_layout import INTERNAL_PREFIXES, logical_name
+
+WORKERS = 32
+SCAN_SEGMENTS = 32
+# list_objects_v2 page size; a range whose page comes back full may be split
+LIST_PAGE_SIZE = 1000
+# Split points for a full range whose page has no common prefix: each of these characters
+SPLIT_CHARACTERS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"[::4]
+# Rows and objects fixed per BatchGetItem/BatchWriteItem task
+FIX_CHUNK = 500
+# How often a task whose writes were throttled is retried, after a growing pause
+FIX_ATTEMPTS = 4
+THROTTLE_PAUSE = 1.0
+# Rows this much younger than the run may belong to an upload whose S3 write is in flight
+ORPHAN_GRACE = timedelta(minutes=5)
+CHECKPOINT_INTERVAL = 30
+PROGRESS_INTERVAL = 5
+
+
+class Reconciler:
+    """
+    One reconcile run over a FileHandler's bucket and metadata table. Workers only make the
+    AWS calls; their results are merged on the calling thread, so the run's state is always
+    consistent and can be checkpointed at any moment.
+    """
+
+    def __init__(self, handler, workers=WORKERS, segments=SCAN_SEGMENTS, checkpoint_path=None, dry_run=False,
+                 progress=print, clock=time.monotonic):
+        """
+        :param handler: FileHandler whose bucket and tables are reconciled; its indexes are kept up to date
+        :param workers: threads making AWS calls
+        :param segments: parallel Scan segments
+        :param checkpoint_path: JSON file to save progress to and resume from, or None
+        :param dry_run: only report what would be fixed
+        :param progress: called with a report dict every PROGRESS_INTERVAL seconds
+        """
+        self.handler = handler
+        self.workers = workers
+        self.segments = segments
+        self.checkpoint_path = checkpoint_path
+        self.dry_run = dry_run
+        self.progress = progress
+        self.clock = clock
+        self._saved_at = self._reported_at = clock()
+
+    def run(self):
+        """
+        :return: the final report: objects listed, rows scanned, rows missing and orphaned, rows fixed
+                 and names left to a later run because their writes kept being throttled
+        """
+        self.started = self.clock()
+        state = self._load() or {
+            "phase": "crawl",
+            "started_at": format_timestamp(datetime.now(timezone.utc)),
+            "tasks": [{"kind": "range", "after": None, "hi": None}] +
+                     [{"kind": "segment", "segment": segment, "start_key": None} for segment in range(self.segments)],
+            "objects": {},
+            "rows": {},
+            "tombstones": [],
+            "counts": dict.fromkeys(("objects", "rows", "missing", "orphans", "tombstones", "backfilled", "pruned",
+                                     "purged", "failed"), 0)
+        }
+        try:
+            if state["phase"] == "crawl":
+                self._drain(state)
+                self._plan_fixes(state)
+            if state["phase"] == "fix" and not self.dry_run:
+                self._drain(state)
+                state["phase"] = "done"
+        finally:
+            self._save(state)
+        return self._report(state)
+
+    def _drain(self, state):
+        """
+        Runs the state's tasks across the pool until none are left; each result can add follow-up tasks.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="reconcile") as pool:
+            pending = {pool.submit(self._fetch, task): task for task in state["tasks"]}
+            try:
+                while pending:
+                    done, _ = wait(pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        task = pending.pop(future)
+                        state["tasks"].remove(task)
+                        for follow_up in self._merge(state, task, future.result()):
+                            state["tasks"].append(follow_up)
+                            pending[pool.submit(self._fetch, follow_up)] = follow_up
+                    self._tick(state)
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+
+    def _fetch(self, task):
+        """
+        The AWS calls of one task; runs on a worker thread and touches no shared state.
+        """
+        if task["kind"] == "range":
+            params = {"Bucket": self.handler.bucket_name, "MaxKeys": LIST_PAGE_SIZE}
+            if task["after"] is not None:
+                params["StartAfter"] = task["after"]
+            return self.handler.s3.list_objects_v2(**params)
+        if task["kind"] == "segment":
+            return self.handler.db_client.scan_items(task["segment"], self.segments, task["start_key"],
+                                                     attributes=("image_id", "object_key", "moved_from", "uploaded_at",
+                                                                 "deleted_at"))
+        if task["attempt"]:
+            time.sleep(THROTTLE_PAUSE * 2 ** (task["attempt"] - 1))
+        if task["kind"] == "backfill":
+            return self.handler.backfill(task["items"])
+        if task["kind"] == "purge":
+            retry = self.handler.purge(task["items"])
+            return len(task["items"]) - len(retry), retry
+        return self.handler.prune(task["items"], task["uploaded_before"])
+
+    def _merge(self, state, task, result):
+        """
+        Records a task's result in the state.
+        :return: follow-up tasks
+        """
+        if task["kind"] == "range":
+            return self._merge_listing(state, task, result)
+        if task["kind"] == "segment":
+            for row in result.get("Items", []):
+                state["rows"][row["image_id"]] = [row.get("object_key"), row.get("uploaded_at", ""), row.get("moved_from")]
+                if row.get("deleted_at"):
+                    state["tombstones"].append(row["image_id"])
+            state["counts"]["rows"] = len(state["rows"])
+            start_key = result.get("LastEvaluatedKey")
+            return [{**task, "start_key": start_key}] if start_key else []
+
+        fixed, retry = result
+        state["counts"][{"backfill": "backfilled", "prune": "pruned", "purge": "purged"}[task["kind"]]] += fixed
+        if not retry:
+            return []
+        if task["attempt"] + 1 >= FIX_ATTEMPTS:
+            state["counts"]["failed"] += len(retry)
+            return []
+        retry = set(retry)
+        items = [item for item in task["items"] if (item[0] if task["kind"] == "backfill" else item) in retry]
+        return [{**task, "items": items, "attempt": task["attempt"] + 1}]
+
+    def _merge_listing(self, state, task, response):
+        hi = task["hi"]
+        page = [obj for obj in response.get("Contents", []) if hi is None or obj["Key"] <= hi]
+        for obj in page:
+            state["objects"][obj["Key"]] = [obj["Size"], obj["LastModified"].timestamp()]
+        state["counts"]["objects"] = len(state["objects"])
+        if not page or not response.get("IsTruncated") or len(page) < len(response["Contents"]):
+            return []
+
+        last = page[-1]["Key"]
+        follow_ups = [{**task, "after": last}]
+        # While there are too few ranges to keep the pool busy, split the rest of this one. The page's
+        # keys differ from each other at the end of their common prefix; the keys after it most likely
+        # differ from its last key one position earlier, using the same characters. So the split points
+        # are the last key cut short there plus each of those characters. Whatever lies beyond the last
+        # point stays one range, which splits again when it is large.
+        if sum(1 for pending in state["tasks"] if pending["kind"] == "range") < self.workers:
+            depth = len(commonprefix([page[0]["Key"], last]))
+            characters = sorted({obj["Key"][depth] for obj in page if len(obj["Key"]) > depth}) if depth \
+                else SPLIT_CHARACTERS
+            stem = last[:max(depth - 1, 0)]
+            points = [stem + character for character in characters
+                      if stem + character > last and (hi is None or stem + character < hi)]
+            if points:
+                follow_ups = [{**task, "after": last, "hi": points[0]}]
+                follow_ups += [{"kind": "range", "after": start, "hi": end}
+                               for start, end in zip(points, points[1:] + [hi])]
+        return follow_ups
+
+    def _plan_fixes(self, state):
+        """
+        Compares the listing with the scan and queues the fixes.
+        """
+        objects, rows = state["objects"], state["rows"]
+        # Objects in the sharded key layout belong to the name after their shard prefix, and
+        # objects migrate_keys moved stay referenced until it deletes them
+        referenced = {key for row in rows.values() for key in (row[0], *row[2:]) if key}
+        missing = [[key, size, modified] for key, (size, modified) in objects.items()
+                   if (logical_name(key) or key) not in rows and key not in referenced
+                   and not key.startswith(INTERNAL_PREFIXES)]
+        cutoff = datetime.fromisoformat(state["started_at"]) - ORPHAN_GRACE
+        uploaded_before = format_timestamp(cutoff)
+        tombstones = set(state["tombstones"])
+        orphans = [image_id for image_id, (object_key, uploaded_at, *_) in rows.items()
+                   if (object_key or image_id) not in objects and uploaded_at < uploaded_before
+                   and image_id not in tombstones]
+        tombstones = sorted(tombstones)
+        state["counts"].update(missing=len(missing), orphans=len(orphans), tombstones=len(tombstones))
+        state["tasks"] = [
+            {"kind": "backfill", "items": missing[start:start + FIX_CHUNK], "attempt": 0}
+            for start in range(0, len(missing), FIX_CHUNK)
+        ] + [
+            {"kind": "prune", "items": orphans[start:start + FIX_CHUNK], "uploaded_before": uploaded_before, "attempt": 0}
+            for start in range(0, len(orphans), FIX_CHUNK)
+        ] + [
+            {"kind": "purge", "items": tombstones[start:start + FIX_CHUNK], "attempt": 0}
+            for start in range(0, len(tombstones), FIX_CHUNK)
+        ]
+        # The listing and the scan are not needed any more, and would only make checkpoints large
+        state["objects"], state["rows"], state["tombstones"] = {}, {}, []
+        state["phase"] = "fix"
+
+    def _tick(self, state):
+        now = self.clock()
+        if now - self._saved_at >= CHECKPOINT_INTERVAL:
+            self._save(state)
+        if now - self._reported_at >= PROGRESS_INTERVAL:
+            self._reported_at = now
+            self.progress(self._report(state))
+
+    def _report(self, state):
+        return {"phase": state["phase"], **state["counts"], "pending_tasks": len(state["tasks"]),
+                "elapsed_s": round(self.clock() - self.started, 1)}
+
+    def _load(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path) as checkpoint:
+            state = json.load(checkpoint)
+        return None if state["phase"] == "done" else state
+
+    def _save(self, state):
+        """
+        Writes the checkpoint atomically, so a crash mid-write leaves the previous one intact.
+        """
+        self._saved_at = self.clock()
+        if not self.checkpoint_path:
+            return
+        partial = self.checkpoint_path + ".tmp"
+        with open(partial, "w") as checkpoint:
+            json.dump(state, checkpoint, separators=(',', ':'))
+        os.replace(partial, self.checkpoint_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--segments", type=int, default=SCAN_SEGMENTS)
+    parser.add_argument("--checkpoint", help="JSON file to save progress to and resume from")
+    parser.add_argument("--dry-run", action="store_true", help="only report the rows that would be fixed")
+    args = parser.parse_args()
+
+    from assement.src.file_manager import lambda_function
+    reconciler = Reconciler(lambda_function.image_handler, workers=args.workers, segments=args.segments,
+                            checkpoint_path=args.checkpoint, dry_run=args.dry_run,
+                            progress=lambda report: print(json.dumps(report), flush=True))
+    print(json.dumps(reconciler.run()))
+
+
+if __name__ == "__main__":
+    main()
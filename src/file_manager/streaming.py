@@ -0,0 +1,161 @@
+import binascii
+import hashlib
+import io
+import re
+from assement.src.file_manager.concurrency import run_concurrently
+from assement.src.file_manager.metrics import stage
+
+# Decoded bytes produced per read: 48 KB of content from 64 KB of base64
+DECODE_CHUNK_SIZE = 48 * 1024
+# Larger bodies are written as a multipart upload, one part per STREAM_PART_SIZE,
+# so botocore never buffers more than a part per request.
+STREAM_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+STREAM_PART_SIZE = 5 * 1024 * 1024
+# Line breaks and other whitespace in a base64 body, e.g. from MIME-style 76-column lines
+_WHITESPACE = re.compile(r'\s')
+_WHITESPACE_BYTES = re.compile(rb'\s')
+
+
+class Base64Reader(io.RawIOBase):
+    """
+    Seekable, read-only file over the content of a base64 string, decoded a chunk at a time.
+    Every 4 base64 characters decode to 3 bytes, so any offset maps straight to its block and
+    the decoded content never has to exist in memory all at once. Sequential reads from the
+    start also feed a sha256 of the content, so hashing rides along with the S3 write.
+    """
+
+    def __init__(self, encoded, start=0, end=None):
+        """
+        The whole content is decoded once up front, a chunk at a time, so a malformed body is
+        refused before anything is written; that pass, timed as the base64_decode stage, also
+        computes the sha256.
+        :param encoded: the base64 text, as str or bytes; line breaks and missing padding are accepted
+        :param start: first decoded byte this reader covers (for multipart sections)
+        :param end: decoded byte this reader stops before; defaults to the end of the content
+        :raises ValueError: when the text is not valid base64
+        """
+        super().__init__()
+        if end is None:
+            encoded = _without_whitespace(encoded)
+        if isinstance(encoded, (bytes, bytearray)):
+            encoded = memoryview(encoded)  # slices of a memoryview are not copies
+        if len(encoded) % 4 == 1:
+            raise ValueError("Body is not valid base64.")
+        # Missing padding is supplied when the last block is decoded
+        self._padding = -len(encoded) % 4
+        last = encoded[len(encoded) - (len(encoded) % 4 or 4):]
+        last = bytes(last) if isinstance(encoded, memoryview) else last.encode('ascii', 'replace')
+        total = (len(encoded) + self._padding) // 4 * 3 - (last + b'=' * self._padding).count(b'=')
+        self._encoded = encoded
+        self._start = start
+        self._end = total if end is None else end
+        self._position = 0
+        self._sha256 = hashlib.sha256()
+        self._hashed = 0
+        if end is None:
+            buffer = bytearray(DECODE_CHUNK_SIZE)
+            with stage("base64_decode"):
+                while self.readinto(buffer):
+                    pass
+            self._position = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self)
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._position = offset
+        return offset
+
+    def readinto(self, buffer):
+        wanted = min(len(buffer), len(self) - self._position, DECODE_CHUNK_SIZE)
+        if wanted <= 0:
+            return 0
+        absolute = self._start + self._position
+        block, offset = divmod(absolute, 3)
+        blocks = -(-(offset + wanted) // 3)
+        encoded = self._encoded[block * 4:(block + blocks) * 4]
+        if self._padding and (block + blocks) * 4 > len(self._encoded):
+            encoded = bytes(encoded) + b'=' * self._padding if isinstance(encoded, memoryview) \
+                else encoded + '=' * self._padding
+        decoded = binascii.a2b_base64(encoded)
+        if len(decoded) < offset + wanted:
+            raise ValueError("Body is not valid base64.")
+        data = memoryview(decoded)[offset:offset + wanted]
+        buffer[:wanted] = data
+        if self._start == 0 and self._position == self._hashed:
+            self._sha256.update(data)
+            self._hashed += wanted
+        self._position += wanted
+        return wanted
+
+    def section(self, start, end):
+        """
+        A reader over decoded bytes [start, end) of this one, e.g. one part of a multipart upload.
+        """
+        return Base64Reader(self._encoded, self._start + start, self._start + end)
+
+    def sha256(self):
+        """
+        Hex sha256 of the content. Decodes whatever the reads so far have not hashed yet,
+        then restores the position.
+        """
+        if self._start != 0:
+            raise ValueError("Only a whole-content reader can be hashed.")
+        position = self._position
+        self.seek(self._hashed)
+        while self.read(DECODE_CHUNK_SIZE):
+            pass
+        self.seek(position)
+        return self._sha256.hexdigest()
+
+
+def _without_whitespace(encoded):
+    """
+    The base64 text without its line breaks or other whitespace, copied only if it has any.
+    """
+    if isinstance(encoded, str):
+        return ''.join(encoded.split()) if _WHITESPACE.search(encoded) else encoded
+    return bytes(encoded).translate(None, b' \t\n\r\v\f') if _WHITESPACE_BYTES.search(encoded) else encoded
+
+
+def put_stream(s3, bucket_name, key, body, content_type):
+    """
+    Writes bytes or a Base64Reader to S3; a reader above STREAM_MULTIPART_THRESHOLD goes up
+    as a multipart upload with its parts sent concurrently. A failed multipart upload is aborted.
+    """
+    if not isinstance(body, Base64Reader) or len(body) <= STREAM_MULTIPART_THRESHOLD:
+        if isinstance(body, Base64Reader):
+            body.seek(0)
+        s3.put_object(Bucket=bucket_name, Key=key, Body=body, ContentType=content_type)
+        return
+
+    upload_id = s3.create_multipart_upload(Bucket=bucket_name, Key=key, ContentType=content_type)['UploadId']
+    try:
+        starts = range(0, len(body), STREAM_PART_SIZE)
+        results = run_concurrently(*(
+            lambda number=number, start=start: s3.upload_part(
+                Bucket=bucket_name, Key=key, UploadId=upload_id, PartNumber=number,
+                Body=body.section(start, min(start + STREAM_PART_SIZE, len(body)))
+            )
+            for number, start in enumerate(starts, start=1)
+        ))
+        parts = [{"PartNumber": number, "ETag": result.result()["ETag"]} for number, result in enumerate(results, start=1)]
+        s3.complete_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+    except Exception:
+        s3.abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id)
+        raise
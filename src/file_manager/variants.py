@@ -0,0 +1,81 @@
+import hashlib
+import io
+from assement.src.file_manager.key_layout import VARIANT_PREFIX
+
+MAX_DIMENSION = 4096
+DEFAULT_QUALITY = 85
+# Output formats: Pillow format name and content type
+FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+
+def parse_variant(query_params):
+    """
+    Reads the width/height/format/quality download parameters.
+    :return: the variant spec, or None when the original was asked for
+    :raises ValueError: when a parameter is out of range
+    """
+    if not any(query_params.get(name) for name in ("width", "height", "format", "quality")):
+        return None
+    try:
+        width = int(query_params.get('width') or 0)
+        height = int(query_params.get('height') or 0)
+        quality = int(query_params.get('quality') or DEFAULT_QUALITY)
+    except ValueError:
+        raise ValueError("width, height and quality must be integers.")
+    if not (0 <= width <= MAX_DIMENSION and 0 <= height <= MAX_DIMENSION):
+        raise ValueError(f"width and height must be between 0 and {MAX_DIMENSION}.")
+    if not 1 <= quality <= 100:
+        raise ValueError("quality must be between 1 and 100.")
+    image_format = (query_params.get('format') or '').lower() or None
+    if image_format == "jpg":
+        image_format = "jpeg"
+    if image_format is not None and image_format not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}.")
+    return {"width": width, "height": height, "format": image_format, "quality": quality}
+
+
+def resolve_format(spec, content_type):
+    """
+    The output format of a variant: the requested one, else the original's when we can write it, else JPEG.
+    """
+    if spec["format"]:
+        return spec["format"]
+    for name, (_, format_content_type) in FORMATS.items():
+        if format_content_type == content_type:
+            return name
+    return "jpeg"
+
+
+def variant_key(object_key, version, spec, image_format):
+    """
+    Deterministic S3 key of a variant. `version` changes whenever the original is replaced,
+    so a variant of old content is never served for new content.
+    """
+    digest = hashlib.sha1(f"{object_key}|{version}".encode('utf-8')).hexdigest()[:12]
+    return f"{VARIANT_PREFIX}{object_key}/{digest}/{spec['width']}x{spec['height']}q{spec['quality']}.{image_format}"
+
+
+def render_variant(content, spec, image_format):
+    """
+    Resizes the original to fit within width x height (either may be 0 for "any"),
+    keeping the aspect ratio and never upscaling, and encodes it.
+    :return: (encoded bytes, content type)
+    :raises ImportError: when Pillow is not installed
+    """
+    from PIL import Image
+
+    pillow_format, content_type = FORMATS[image_format]
+    with Image.open(io.BytesIO(content)) as image:
+        image.load()
+        width = spec["width"] or image.width
+        height = spec["height"] or image.height
+        image.thumbnail((width, height))
+        if pillow_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format=pillow_format, quality=spec["quality"])
+    return output.getvalue(), content_type
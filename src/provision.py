@@ -0,0 +1,383 @@
+"""
+Brings up the image service's AWS resources: bucket, tables, role, Lambda function, API Gateway
+and bucket notifications.
+
+The resources form a dependency graph of steps; each step starts as soon as the steps it needs
+are done, so independent resources (the bucket, every table, the role) are created at the same
+time. Steps are idempotent: an existing resource is checked against what would be created,
+and is left alone when it matches, so running the provisioning again is quick and safe.
+Each step waits, with the service's waiters, until its resource is usable.
+"""
+import base64
+import hashlib
+import io
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from botocore.exceptions import ClientError
+from assement.src import file_manager
+from assement.src.file_manager import aws_clients
+
+WORKERS = 16
+# Waiter polling for freshly created resources: often, since an environment is waited on by a person
+WAITER_CONFIG = {"Delay": 1, "MaxAttempts": 120}
+RUNTIME = "python3.12"
+TIMEOUT = 15
+MEMORY_SIZE = 128
+# A new role takes a few seconds before Lambda can assume it
+ROLE_ATTEMPTS = 10
+ROLE_PAUSE = 2.0
+# Fixed timestamp for zip entries, so the same sources always give the same package
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+
+
+class ProvisioningError(Exception):
+    """
+    An existing resource does not match what provisioning would create.
+    """
+
+
+class Step:
+    """
+    One resource to bring up.
+    """
+
+    def __init__(self, name, ensure, after=()):
+        """
+        :param name: unique name of the step, used by the steps that come after it
+        :param ensure: called with the outputs of the finished steps; creates the resource or checks
+                       the existing one, and returns ("created" | "updated" | "exists", output)
+        :param after: names of the steps whose resources this one needs
+        """
+        self.name = name
+        self.ensure = ensure
+        self.after = tuple(after)
+
+
+def provision(steps, workers=WORKERS, progress=print):
+    """
+    Runs every step once the steps it comes after have succeeded, as many at a time as are ready.
+    Steps after a failed one are skipped; the others still run.
+    :param progress: called with (step name, result) as each step finishes
+    :return: {step name: {"status", "output", "seconds"}}, status being created, updated, exists,
+             failed (output is the error) or skipped
+    :raises ValueError: when a step comes after an unknown step, or the steps form a cycle
+    """
+    by_name = {step.name: step for step in steps}
+    _check_graph(by_name)
+    results, outputs, started = {}, {}, set()
+
+    def ready():
+        """
+        The steps that can start now; skips those after a failure, which can make more ready.
+        """
+        found, skipped = [], True
+        while skipped:
+            skipped = False
+            for step in steps:
+                if step.name in started or any(name not in results for name in step.after):
+                    continue
+                started.add(step.name)
+                if any(results[name]["status"] in ("failed", "skipped") for name in step.after):
+                    results[step.name] = {"status": "skipped", "output": None, "seconds": 0.0}
+                    progress(step.name, results[step.name])
+                    skipped = True
+                else:
+                    found.append(step)
+        return found
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="provision") as pool:
+        pending = {pool.submit(_run, step, dict(outputs)): step for step in ready()}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = pending.pop(future)
+                results[step.name] = future.result()
+                if results[step.name]["status"] != "failed":
+                    outputs[step.name] = results[step.name]["output"]
+                progress(step.name, results[step.name])
+            pending.update({pool.submit(_run, step, dict(outputs)): step for step in ready()})
+    return {step.name: results[step.name] for step in steps}
+
+
+def _run(step, outputs):
+    started = time.monotonic()
+    try:
+        status, output = step.ensure(outputs)
+    except Exception as e:
+        status, output = "failed", str(e)
+    return {"status": status, "output": output, "seconds": round(time.monotonic() - started, 2)}
+
+
+def _check_graph(by_name):
+    """
+    :raises ValueError: for an unknown dependency or a cycle
+    """
+    for step in by_name.values():
+        unknown = [name for name in step.after if name not in by_name]
+        if unknown:
+            raise ValueError(f"Step '{step.name}' comes after unknown steps {unknown}.")
+    done = set()
+    remaining = dict(by_name)
+    while remaining:
+        ready = [name for name, step in remaining.items() if done.issuperset(step.after)]
+        if not ready:
+            raise ValueError(f"Steps {sorted(remaining)} depend on each other.")
+        done.update(ready)
+        for name in ready:
+            del remaining[name]
+
+
+def build_package(package=file_manager):
+    """
+    Zips a package's modules in memory, under their import path, along with the __init__ modules
+    of its parent packages. Entries have a fixed timestamp, so unchanged sources give the same
+    bytes and the function is not redeployed.
+    :return: the zip file's bytes
+    """
+    root = os.path.dirname(package.__file__)
+    parts = package.__name__.split('.')
+    files = []
+    for depth in range(1, len(parts)):
+        init = os.path.join(root, *[os.pardir] * (len(parts) - depth), '__init__.py')
+        if os.path.exists(init):
+            files.append(('/'.join(parts[:depth] + ['__init__.py']), init))
+    for directory, subdirectories, names in os.walk(root):
+        subdirectories[:] = sorted(name for name in subdirectories if name != '__pycache__')
+        relative = os.path.relpath(directory, root)
+        prefix = '/'.join(parts + ([] if relative == os.curdir else relative.split(os.sep)))
+        files.extend((f"{prefix}/{name}", os.path.join(directory, name)) for name in sorted(names)
+                     if name.endswith('.py'))
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for archive_name, path in files:
+            entry = zipfile.ZipInfo(archive_name, ZIP_DATE)
+            entry.external_attr = 0o644 << 16
+            entry.compress_type = zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as source:
+                archive.writestr(entry, source.read())
+    return buffer.getvalue()
+
+
+def ensure_bucket(s3, bucket_name, region_name):
+    try:
+        s3.head_bucket(Bucket=bucket_name)
+        return "exists", bucket_name
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("404", "NoSuchBucket", "NotFound"):
+            raise
+    params = {} if region_name == 'us-east-1' else \
+        {"CreateBucketConfiguration": {"LocationConstraint": region_name}}
+    s3.create_bucket(Bucket=bucket_name, **params)
+    s3.get_waiter('bucket_exists').wait(Bucket=bucket_name, WaiterConfig=WAITER_CONFIG)
+    return "created", bucket_name
+
+
+def ensure_table(dynamodb, definition):
+    """
+    Creates a table from its create_table arguments, or checks that the existing one has the same
+    key schema and secondary indexes, and waits until the table and its indexes are ACTIVE.
+    :raises ProvisioningError: when the existing table differs
+    """
+    table_name = definition["TableName"]
+    try:
+        table = dynamodb.describe_table(TableName=table_name)["Table"]
+        status = "exists"
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ResourceNotFoundException":
+            raise
+        table = dynamodb.create_table(**definition)["TableDescription"]
+        status = "created"
+    if table["KeySchema"] != definition["KeySchema"]:
+        raise ProvisioningError(f"Table '{table_name}' exists with key schema {table['KeySchema']}, "
+                                f"not {definition['KeySchema']}.")
+    missing = {index["IndexName"] for index in definition.get("GlobalSecondaryIndexes", ())} - \
+              {index["IndexName"] for index in table.get("GlobalSecondaryIndexes", ())}
+    if missing:
+        raise ProvisioningError(f"Table '{table_name}' exists without the indexes {sorted(missing)}.")
+
+    dynamodb.get_waiter('table_exists').wait(TableName=table_name, WaiterConfig=WAITER_CONFIG)
+    for _ in range(WAITER_CONFIG["MaxAttempts"]):
+        table = dynamodb.describe_table(TableName=table_name)["Table"]
+        if all(index.get("IndexStatus", "ACTIVE") == "ACTIVE" for index in table.get("GlobalSecondaryIndexes", ())):
+            return status, table["TableArn"]
+        time.sleep(WAITER_CONFIG["Delay"])
+    raise ProvisioningError(f"The indexes of table '{table_name}' did not become ACTIVE.")
+
+
+def ensure_role(iam, role_name):
+    """
+    The role the Lambda function runs as, assumable by Lambda.
+    """
+    try:
+        return "exists", iam.get_role(RoleName=role_name)["Role"]["Arn"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchEntity":
+            raise
+    trust = {
+        "Version": "2012-10-17",
+        "Statement": [{"Effect": "Allow", "Principal": {"Service": "lambda.amazonaws.com"}, "Action": "sts:AssumeRole"}]
+    }
+    arn = iam.create_role(RoleName=role_name, AssumeRolePolicyDocument=json.dumps(trust))["Role"]["Arn"]
+    iam.get_waiter('role_exists').wait(RoleName=role_name, WaiterConfig=WAITER_CONFIG)
+    return "created", arn
+
+
+def ensure_function(lambda_client, function_name, role_arn, package, handler):
+    """
+    Creates the function from the zip's bytes, or updates its code and handler when they changed,
+    and waits until it is ready to be invoked.
+    """
+    code_sha256 = base64.b64encode(hashlib.sha256(package).digest()).decode('ascii')
+    try:
+        configuration = lambda_client.get_function_configuration(FunctionName=function_name)
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ResourceNotFoundException":
+            raise
+        configuration = None
+
+    if configuration is None:
+        for attempt in range(ROLE_ATTEMPTS):
+            try:
+                arn = lambda_client.create_function(
+                    FunctionName=function_name, Runtime=RUNTIME, Role=role_arn, Handler=handler,
+                    Code={"ZipFile": package}, Timeout=TIMEOUT, MemorySize=MEMORY_SIZE)["FunctionArn"]
+                break
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "InvalidParameterValueException" or attempt == ROLE_ATTEMPTS - 1:
+                    raise
+                time.sleep(ROLE_PAUSE)
+        lambda_client.get_waiter('function_active_v2').wait(FunctionName=function_name, WaiterConfig=WAITER_CONFIG)
+        return "created", arn
+
+    status = "exists"
+    if configuration["CodeSha256"] != code_sha256:
+        lambda_client.update_function_code(FunctionName=function_name, ZipFile=package)
+        lambda_client.get_waiter('function_updated_v2').wait(FunctionName=function_name, WaiterConfig=WAITER_CONFIG)
+        status = "updated"
+    if configuration["Handler"] != handler:
+        lambda_client.update_function_configuration(FunctionName=function_name, Handler=handler)
+        lambda_client.get_waiter('function_updated_v2').wait(FunctionName=function_name, WaiterConfig=WAITER_CONFIG)
+        status = "updated"
+    return status, configuration["FunctionArn"]
+
+
+def ensure_api(apigateway, api_name, function_arn, region_name, stage_name):
+    """
+    A REST API whose root passes every method to the function (the action is a query parameter),
+    deployed to stage_name.
+    :return: status and the API id
+    """
+    api_id = next((api["id"] for page in apigateway.get_paginator('get_rest_apis').paginate()
+                   for api in page["items"] if api["name"] == api_name), None)
+    status = "exists"
+    if api_id is None:
+        api_id = apigateway.create_rest_api(name=api_name, description="Image store API")["id"]
+        status = "created"
+    root_id = next(resource["id"] for page in apigateway.get_paginator('get_resources').paginate(restApiId=api_id)
+                   for resource in page["items"] if resource["path"] == "/")
+    uri = f"arn:aws:apigateway:{region_name}:lambda:path/2015-03-31/functions/{function_arn}/invocations"
+    try:
+        if apigateway.get_integration(restApiId=api_id, resourceId=root_id, httpMethod="ANY").get("uri") == uri:
+            return status, api_id
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NotFoundException":
+            raise
+    try:
+        apigateway.put_method(restApiId=api_id, resourceId=root_id, httpMethod="ANY", authorizationType="NONE")
+    except ClientError as e:
+        # The method is there, with another integration
+        if e.response["Error"]["Code"] != "ConflictException":
+            raise
+    apigateway.put_integration(restApiId=api_id, resourceId=root_id, httpMethod="ANY", type="AWS_PROXY",
+                               integrationHttpMethod="POST", uri=uri)
+    apigateway.create_deployment(restApiId=api_id, stageName=stage_name)
+    return "created" if status == "created" else "updated", api_id
+
+
+def ensure_permission(lambda_client, function_name, statement_id, principal, source_arn):
+    """
+    Lets a service invoke the function on behalf of source_arn.
+    """
+    try:
+        policy = json.loads(lambda_client.get_policy(FunctionName=function_name)["Policy"])
+        if any(statement.get("Sid") == statement_id for statement in policy.get("Statement", ())):
+            return "exists", statement_id
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ResourceNotFoundException":
+            raise
+    try:
+        lambda_client.add_permission(FunctionName=function_name, StatementId=statement_id,
+                                     Action="lambda:InvokeFunction", Principal=principal, SourceArn=source_arn)
+        return "created", statement_id
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ResourceConflictException":
+            raise
+        return "exists", statement_id
+
+
+def ensure_notifications(s3, bucket_name, function_arn):
+    """
+    Sends the bucket's ObjectCreated and ObjectRemoved events to the function, which keeps the
+    listing index snapshot current with them. The bucket's other notifications are kept.
+    """
+    events = ["s3:ObjectCreated:*", "s3:ObjectRemoved:*"]
+    current = s3.get_bucket_notification_configuration(Bucket=bucket_name)
+    current.pop("ResponseMetadata", None)
+    functions = current.get("LambdaFunctionConfigurations", [])
+    if any(config["LambdaFunctionArn"] == function_arn and sorted(config["Events"]) == events for config in functions):
+        return "exists", bucket_name
+    current["LambdaFunctionConfigurations"] = [config for config in functions
+                                               if config["LambdaFunctionArn"] != function_arn] + \
+                                              [{"LambdaFunctionArn": function_arn, "Events": events}]
+    s3.put_bucket_notification_configuration(Bucket=bucket_name, NotificationConfiguration=current)
+    return "created", bucket_name
+
+
+def environment_steps(aws_config, bucket_name, table_definitions, function_name, role_name, api_name,
+                      stage_name="dev", package=None, handler=None):
+    """
+    The steps bringing up the whole service.
+    :param aws_config: endpoint_url, credentials and region_name for the clients
+    :param table_definitions: create_table arguments of every table, from the modules' *_table_definition
+    :param package: the function's zip, by default build_package() of the file_manager package
+    :param handler: the function's handler, by default lambda_function.lambda_handler under its import path
+    """
+    region_name = aws_config.get("region_name", "us-east-1")
+
+    def client(service_name):
+        return aws_clients.client(service_name, **aws_config)
+
+    package = package if package is not None else build_package()
+    handler = handler or f"{file_manager.__name__}.lambda_function.lambda_handler"
+    steps = [Step("bucket", lambda outputs: ensure_bucket(client('s3'), bucket_name, region_name)),
+             Step("role", lambda outputs: ensure_role(client('iam'), role_name))]
+    steps += [Step(f"table:{definition['TableName']}",
+                   lambda outputs, definition=definition: ensure_table(client('dynamodb'), definition))
+              for definition in table_definitions]
+    steps += [
+        Step("function", lambda outputs: ensure_function(client('lambda'), function_name, outputs["role"], package,
+                                                         handler), after=["role"]),
+        Step("api", lambda outputs: ensure_api(client('apigateway'), api_name, outputs["function"],
+                                               region_name, stage_name), after=["function"]),
+        Step("api_permission", lambda outputs: ensure_permission(
+            client('lambda'), function_name, "api-gateway-invoke", "apigateway.amazonaws.com",
+            f"arn:aws:execute-api:{region_name}:{_account(outputs['function'])}:{outputs['api']}/*"),
+             after=["function", "api"]),
+        Step("s3_permission", lambda outputs: ensure_permission(
+            client('lambda'), function_name, "s3-notifications", "s3.amazonaws.com", f"arn:aws:s3:::{bucket_name}"),
+             after=["function", "bucket"]),
+        Step("notifications", lambda outputs: ensure_notifications(client('s3'), bucket_name, outputs["function"]),
+             after=["bucket", "function", "s3_permission"]),
+    ]
+    return steps
+
+
+def _account(function_arn):
+    """
+    The account id in a Lambda function ARN (arn:aws:lambda:<region>:<account>:function:<name>).
+    """
+    return function_arn.split(':')[4]
@@ -0,0 +1,32 @@
+import pytest
+from assement.src.file_manager import aws_clients
+from assement.src.file_manager.db_client import table_definition
+from assement.src.file_manager.file_handler import download_cache
+
+# Client settings for moto's in-process AWS services
+CONFIG = {"endpoint_url": None, "aws_access_key_id": "test", "aws_secret_access_key": "test"}
+
+@pytest.fixture
+def aws():
+    """moto's in-process AWS services, with fresh shared clients and an empty download cache."""
+    moto = pytest.importorskip("moto")
+    with moto.mock_aws():
+        aws_clients.reset()
+        download_cache.clear()
+        yield
+        aws_clients.reset()
+
+@pytest.fixture
+def tables():
+    """create_table arguments of the tables a module needs besides the metadata table; modules override it."""
+    return []
+
+@pytest.fixture
+def bucket(aws, tables):
+    """The image bucket, the ImageMetadata table and the module's tables in moto; yields the S3 client."""
+    s3 = aws_clients.client('s3', **CONFIG)
+    s3.create_bucket(Bucket="image-bucket")
+    dynamodb = aws_clients.client('dynamodb', **CONFIG)
+    for definition in [table_definition("ImageMetadata"), *tables]:
+        dynamodb.create_table(**definition)
+    yield s3
@@ -0,0 +1,92 @@
+import base64
+import json
+from decimal import Decimal
+import pytest
+
+pytest.importorskip("moto")
+
+from assement.src.file_manager import attribute_index
+from assement.src.file_manager.attribute_index import attribute_table_definition, parse_metadata, parse_predicates
+from assement.src.file_manager.file_handler import FileHandler
+from assement.src.file_manager.file_search import FileSearch
+from assement.src.test.conftest import CONFIG
+
+ATTRIBUTES = ("format", "dimensions.width", "tags")
+
+@pytest.fixture
+def tables():
+    return [attribute_table_definition("ImageAttributeIndex")]
+
+@pytest.fixture
+def stores(bucket):
+    """FileHandler and FileSearch sharing an attribute index in moto's in-process S3 and DynamoDB."""
+    config = {**CONFIG, "attribute_table_name": "ImageAttributeIndex", "indexed_attributes": ATTRIBUTES}
+    return (FileHandler(bucket_name="image-bucket", table_name="ImageMetadata", **config),
+            FileSearch(bucket_name="image-bucket", table_name="ImageMetadata", **config))
+
+def _upload(handler, name, metadata):
+    handler.upload({"queryStringParameters": {"fileName": name, "metadata": json.dumps(metadata)},
+                    "body": base64.b64encode(b"x").decode()})
+
+def _query(search, where, **kwargs):
+    response = search.metadata_query(where, **kwargs)
+    return response["statusCode"], json.loads(response["body"])
+
+def _keys(body):
+    return [file["key"] for file in body["files"]]
+
+def test_parse_metadata_and_predicates():
+    """Test that metadata becomes native values and predicates parse numbers as numbers."""
+    assert parse_metadata('{"ratio": 1.5, "tags": ["a"]}') == {"ratio": Decimal("1.5"), "tags": ["a"]}
+    assert parse_metadata("not json") == "not json"
+    for unstorable in ('{"ratio": NaN}', '{"ratio": -Infinity}', '{"huge": 1e126}', '{"tiny": [1e-131]}',
+                       '{"precise": 1.23456789012345678901234567890123456789}'):
+        with pytest.raises(ValueError):
+            parse_metadata(unstorable)
+    assert parse_predicates("format=JPEG; dimensions.width>=1920") == \
+        [("format", "=", "JPEG"), ("dimensions.width", ">=", Decimal(1920))]
+    with pytest.raises(ValueError):
+        parse_predicates("format>=JPEG")
+    with pytest.raises(ValueError):
+        parse_predicates("")
+
+def test_query_intersects_predicates(stores):
+    """Test that an AND of an equality and a range predicate returns only images matching both."""
+    handler, search = stores
+    _upload(handler, "a.jpg", {"format": "JPEG", "dimensions": {"width": 1920.5}, "tags": ["beach", "sun"]})
+    _upload(handler, "b.jpg", {"format": "JPEG", "dimensions": {"width": 800}})
+    _upload(handler, "c.png", {"format": "PNG", "dimensions": {"width": 4000}, "tags": ["sun"]})
+    _upload(handler, "d.jpg", {"format": "JPEG", "dimensions": {"width": -3}})
+
+    status, body = _query(search, "format=JPEG;dimensions.width>=1920")
+    assert status == 200 and _keys(body) == ["a.jpg"]
+    assert body["files"][0]["metadata"]["dimensions"]["width"] == 1920.5
+    assert _keys(_query(search, "dimensions.width<800")[1]) == ["d.jpg"]
+    assert _keys(_query(search, "dimensions.width>1920.5")[1]) == ["c.png"]
+    assert _keys(_query(search, "tags=sun")[1]) == ["a.jpg", "c.png"]
+    assert _query(search, "camera=Canon")[0] == 400
+
+def test_query_follows_overwrites_and_deletes(stores):
+    """Test that overwriting an image moves its postings and deleting it drops them."""
+    handler, search = stores
+    _upload(handler, "a.jpg", {"format": "JPEG"})
+    _upload(handler, "a.jpg", {"format": "PNG"})
+    assert _keys(_query(search, "format=JPEG")[1]) == []
+    assert _keys(_query(search, "format=PNG")[1]) == ["a.jpg"]
+
+    handler.delete_file({"imageName": "a.jpg"})
+    assert _keys(_query(search, "format=PNG")[1]) == []
+
+def test_query_pages_and_checks_broad_predicates_on_rows(stores, monkeypatch):
+    """Test that results page in name order and a too-broad predicate is checked against the rows."""
+    handler, search = stores
+    for i in range(40):
+        _upload(handler, f"{i:02d}.jpg", {"format": "JPEG", "tags": ["rare" if i in (3, 17, 29) else "common"]})
+    # 40 postings over 8 shards overflow at least one shard; the 3 "rare" ones cannot
+    monkeypatch.setattr(attribute_index, "MAX_POSTINGS", 3)
+
+    _, first = _query(search, "format=JPEG;tags=rare", limit=2)
+    _, second = _query(search, "format=JPEG;tags=rare", limit=2, next_token=first["nextToken"])
+    assert _keys(first) + _keys(second) == ["03.jpg", "17.jpg", "29.jpg"]
+    assert second["nextToken"] is None
+    assert _query(search, "format=JPEG")[0] == 400
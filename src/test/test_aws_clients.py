@@ -0,0 +1,13 @@
+from assement.src.file_manager import aws_clients
+from assement.src.file_manager.file_handler import FileHandler
+
+def test_clients_are_lazy_and_shared():
+    """Test that no client exists until first use and equal settings share one client."""
+    aws_clients.reset()
+    first = FileHandler(bucket_name="image-bucket", table_name="ImageMetadata")
+    second = FileHandler(bucket_name="other-bucket", table_name="ImageMetadata")
+    assert first._s3 is None
+
+    assert first.s3 is second.s3
+    assert first.s3.meta.config.retries["mode"] == "adaptive"
+    assert first.db_client.dynamodb is second.db_client.dynamodb
@@ -0,0 +1,64 @@
+import base64
+import hashlib
+import json
+import pytest
+
+pytest.importorskip("moto")
+
+from assement.src.file_manager.blob_store import BLOB_PREFIX, blob_table_definition
+from assement.src.file_manager.file_handler import FileHandler
+from assement.src.test.conftest import CONFIG
+
+@pytest.fixture
+def tables():
+    return [blob_table_definition("ImageBlobs")]
+
+@pytest.fixture
+def handler(bucket):
+    """Deduplicating FileHandler against moto's in-process S3 and DynamoDB."""
+    return FileHandler(bucket_name="image-bucket", table_name="ImageMetadata", blob_table_name="ImageBlobs", **CONFIG)
+
+def _upload(handler, name, content):
+    event = {"queryStringParameters": {"fileName": name, "metadata": "{}"}, "body": base64.b64encode(content).decode()}
+    return json.loads(handler.upload(event)["body"])
+
+def _blobs(handler):
+    return [obj["Key"] for obj in handler.s3.list_objects_v2(Bucket="image-bucket").get("Contents", [])]
+
+def test_identical_content_is_stored_once(handler):
+    """Test that a second upload of the same bytes only adds a reference."""
+    assert _upload(handler, "a.jpg", b"same bytes")["deduplicated"] is False
+    assert _upload(handler, "b.jpg", b"same bytes")["deduplicated"] is True
+
+    blobs = _blobs(handler)
+    assert len(blobs) == 1 and blobs[0].startswith(BLOB_PREFIX)
+    url = json.loads(handler.download({"imageName": "b.jpg"})["body"])["downloadUrl"]
+    assert blobs[0] in url
+
+def test_blob_is_removed_with_its_last_reference(handler):
+    """Test that delete_file keeps a shared blob until the last name is deleted."""
+    _upload(handler, "a.jpg", b"same bytes")
+    _upload(handler, "b.jpg", b"same bytes")
+
+    handler.delete_file({"imageName": "a.jpg"})
+    assert len(_blobs(handler)) == 1
+    handler.delete_file({"imageName": "b.jpg"})
+    assert _blobs(handler) == []
+
+def test_overwriting_a_name_releases_its_old_content(handler):
+    """Test that re-uploading a name with new content drops the old blob."""
+    _upload(handler, "a.jpg", b"old bytes")
+    _upload(handler, "a.jpg", b"new bytes")
+
+    assert len(_blobs(handler)) == 1
+
+def test_pending_blob_is_written_by_the_next_upload(handler):
+    """Test that an upload finding a blob whose first writer has not stored it yet writes the content itself."""
+    digest = hashlib.sha256(b"same bytes").hexdigest()
+    handler.blobs.db_client.table.put_item(Item={"content_hash": digest, "ref_count": 1, "size": 10,
+                                                 "object_key": f"{BLOB_PREFIX}{digest}/pending"})
+
+    assert _upload(handler, "b.jpg", b"same bytes")["deduplicated"] is False
+    assert _blobs(handler) == [f"{BLOB_PREFIX}{digest}/pending"]
+    assert handler.blobs.db_client.table.get_item(Key={"content_hash": digest})["Item"]["stored"] is True
+    assert _upload(handler, "c.jpg", b"same bytes")["deduplicated"] is True
@@ -0,0 +1,34 @@
+from assement.src.file_manager.cache import LRUCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+def test_entries_expire_after_ttl():
+    """Test that an entry is served until its TTL runs out."""
+    clock = FakeClock()
+    cache = LRUCache(clock=clock)
+    cache.put("a", "value", 5, ttl=10)
+
+    assert cache.get("a") == "value"
+    clock.now = 10
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_evicts_least_recently_used_by_count_and_bytes():
+    """Test that both the entry and the byte bounds evict the coldest entry."""
+    cache = LRUCache(max_entries=2, max_bytes=10)
+    cache.put("a", "a", 4, ttl=60)
+    cache.put("b", "b", 4, ttl=60)
+    cache.get("a")
+    cache.put("c", "c", 4, ttl=60)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "a"
+    cache.put("d", "d", 8, ttl=60)
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["evictions"] == 3
@@ -0,0 +1,19 @@
+import threading
+import time
+
+from assement.src.file_manager import concurrency
+from assement.src.file_manager.concurrency import run_concurrently
+
+def test_nested_fan_out_on_a_busy_pool_does_not_deadlock():
+    """Test that calls fanning out again from pool threads finish while every worker is taken."""
+    def outer():
+        # Every outer call is queued before any fans out, as under load
+        time.sleep(0.2)
+        return sum(future.result() for future in run_concurrently(*(lambda: time.sleep(0.01) or 1 for _ in range(3))))
+
+    results = []
+    caller = threading.Thread(target=lambda: results.extend(
+        future.result() for future in run_concurrently(*(outer for _ in range(concurrency.MAX_WORKERS + 8)))))
+    caller.start()
+    caller.join(timeout=10)
+    assert not caller.is_alive() and results == [3] * (concurrency.MAX_WORKERS + 8)
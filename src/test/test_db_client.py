@@ -0,0 +1,167 @@
+import json
+import threading
+import time
+from decimal import Decimal
+import pytest
+from unittest.mock import MagicMock, patch
+from assement.src.file_manager import db_client
+from assement.src.file_manager.db_client import DynamoDBClient, encode_json
+
+def _client():
+    client = DynamoDBClient(table_name="ImageMetadata")
+    client.dynamodb = MagicMock()
+    client.dynamodb.Table.return_value.key_schema = [{"AttributeName": "image_id", "KeyType": "HASH"}]
+    return client
+
+def _queue_while_sending(client, writes):
+    """
+    Makes the first batch wait until every one of writes, run on its own thread, has queued its requests.
+    :return: the threads
+    """
+    queue = db_client._coalescer(client.dynamodb)._queue
+    threads = [threading.Thread(target=write) for write in writes]
+    send = client.dynamodb.batch_write_item.side_effect
+
+    def first_batch(RequestItems):
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while len(queue) < len(writes) and time.monotonic() < deadline:
+            time.sleep(0.001)
+        client.dynamodb.batch_write_item.side_effect = send
+        return {}
+    client.dynamodb.batch_write_item.side_effect = first_batch
+    return threads
+
+@patch("assement.src.file_manager.db_client.time.sleep")
+def test_batch_read_retries_unprocessed_keys(mock_sleep):
+    """Test that UnprocessedKeys are retried until DynamoDB returns them all."""
+    client = _client()
+    client.dynamodb.batch_get_item.side_effect = [
+        {"Responses": {"ImageMetadata": [{"image_id": "a"}]},
+         "UnprocessedKeys": {"ImageMetadata": {"Keys": [{"image_id": "b"}]}}},
+        {"Responses": {"ImageMetadata": [{"image_id": "b"}]}},
+    ]
+    items, unprocessed = client.batch_read_items([{"image_id": "a"}, {"image_id": "b"}])
+
+    assert [item["image_id"] for item in items] == ["a", "b"]
+    assert unprocessed == []
+    mock_sleep.assert_called_once()
+
+@patch("assement.src.file_manager.db_client.time.sleep")
+def test_batch_write_chunks_and_gives_up_after_retries(mock_sleep):
+    """Test that writes go out 25 at a time and persistent UnprocessedItems are returned."""
+    client = _client()
+    stuck = {"DeleteRequest": {"Key": {"image_id": "x"}}}
+    client.dynamodb.batch_write_item.side_effect = lambda RequestItems: (
+        {"UnprocessedItems": {"ImageMetadata": [stuck]}} if stuck in RequestItems["ImageMetadata"] else {})
+    unprocessed = client.batch_write_items(items=[{"image_id": str(i)} for i in range(25)], delete_keys=[{"image_id": "x"}])
+
+    assert unprocessed == [stuck]
+    assert len(client.dynamodb.batch_write_item.call_args_list[0].kwargs["RequestItems"]["ImageMetadata"]) == 25
+
+def test_concurrent_batch_writes_share_batches():
+    """Test that writes queued while a batch is in flight go out together, across tables."""
+    client = _client()
+    search = DynamoDBClient(table_name="ImageSearchIndex")
+    search.dynamodb = client.dynamodb
+    queue = db_client._coalescer(client.dynamodb)._queue
+    results = []
+
+    def first_batch(RequestItems):
+        follower = threading.Thread(target=lambda: results.append(search.batch_write_items(items=[{"gram": "abc"}])))
+        follower.start()
+        deadline = time.monotonic() + 5
+        while not queue and time.monotonic() < deadline:
+            time.sleep(0.001)
+        client.dynamodb.batch_write_item.side_effect = lambda RequestItems: {}
+        return {}
+    client.dynamodb.batch_write_item.side_effect = first_batch
+
+    assert client.batch_write_items(items=[{"image_id": "a"}]) == []
+    calls = client.dynamodb.batch_write_item.call_args_list
+    assert [call.kwargs["RequestItems"] for call in calls] == [
+        {"ImageMetadata": [{"PutRequest": {"Item": {"image_id": "a"}}}]},
+        {"ImageSearchIndex": [{"PutRequest": {"Item": {"gram": "abc"}}}]},
+    ]
+
+def test_coalesced_writes_of_one_key_keep_the_last():
+    """Test that two callers writing the same key in one batch send only the later write, and both return."""
+    client = _client()
+    client.dynamodb.batch_write_item.side_effect = lambda RequestItems: {}
+    results = []
+    threads = _queue_while_sending(client, [
+        lambda: results.append(client.batch_write_items(items=[{"image_id": "a", "size": 1}])),
+        lambda: results.append(client.batch_write_items(items=[{"image_id": "a", "size": 2}, {"image_id": "b"}]))])
+
+    assert client.batch_write_items(items=[{"image_id": "first"}]) == []
+    for thread in threads:
+        thread.join()
+    sent = client.dynamodb.batch_write_item.call_args_list[1].kwargs["RequestItems"]["ImageMetadata"]
+    assert sent == [{"PutRequest": {"Item": {"image_id": "a", "size": 2}}}, {"PutRequest": {"Item": {"image_id": "b"}}}]
+    assert results == [[], []]
+
+def test_failed_batch_is_retried_per_caller():
+    """Test that a batch failing as a whole is sent again per caller, so only the caller at fault gets the error."""
+    client = _client()
+
+    def send(RequestItems):
+        if {"PutRequest": {"Item": {"image_id": "bad"}}} in RequestItems["ImageMetadata"]:
+            raise ValueError("invalid item")
+        return {}
+    client.dynamodb.batch_write_item.side_effect = send
+    outcomes = {}
+
+    def write(name):
+        try:
+            outcomes[name] = client.batch_write_items(items=[{"image_id": name}])
+        except ValueError as e:
+            outcomes[name] = str(e)
+    threads = _queue_while_sending(client, [lambda: write("good"), lambda: write("bad")])
+
+    client.batch_write_items(items=[{"image_id": "first"}])
+    for thread in threads:
+        thread.join()
+    assert outcomes == {"good": [], "bad": "invalid item"}
+
+def test_unexpected_send_error_fails_every_waiting_caller():
+    """Test that a batch breaking off with a non-ClientError fails the callers waiting on it, and sending resumes."""
+    client = _client()
+    client.dynamodb.batch_write_item.side_effect = lambda RequestItems: None  # not a response
+    outcomes = {}
+
+    def write(name):
+        try:
+            outcomes[name] = client.batch_write_items(items=[{"image_id": name}])
+        except AttributeError as e:
+            outcomes[name] = type(e).__name__
+    threads = _queue_while_sending(client, [lambda: write("a"), lambda: write("b")])
+
+    assert client.batch_write_items(items=[{"image_id": "first"}]) == []
+    for thread in threads:
+        thread.join(5)
+    assert outcomes == {"a": "AttributeError", "b": "AttributeError"}
+
+    client.dynamodb.batch_write_item.side_effect = lambda RequestItems: {}
+    assert client.batch_write_items(items=[{"image_id": "c"}]) == []
+
+def test_get_item_projects_through_placeholders():
+    """Test that a projected read names the attributes through placeholders and returns the native item."""
+    client = _client()
+    client.table.get_item.return_value = {"Item": {"size": Decimal(5)}}
+
+    assert client.get_item({"image_id": "a"}, attributes=("size", "metadata")) == {"size": Decimal(5)}
+    kwargs = client.table.get_item.call_args.kwargs
+    assert kwargs["ProjectionExpression"] == "#a0, #a1"
+    assert kwargs["ExpressionAttributeNames"] == {"#a0": "size", "#a1": "metadata"}
+    assert kwargs["ConsistentRead"] is False
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_encode_json_handles_dynamodb_values(monkeypatch, use_orjson):
+    """Test that both encoders turn Decimals and sets into plain JSON."""
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(db_client, "orjson", None)
+    encoded = encode_json({"size": Decimal(5), "ratio": Decimal("1.5"), "variants": {"b", "a"}})
+    assert json.loads(encoded) == {"size": 5, "ratio": 1.5, "variants": ["a", "b"]}
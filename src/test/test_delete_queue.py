@@ -0,0 +1,158 @@
+import base64
+import json
+import pytest
+
+pytest.importorskip("moto")
+
+from assement.src.file_manager import aws_clients
+from assement.src.file_manager.delete_queue import DeleteDrain, LocalQueue, SQSQueue
+from assement.src.file_manager.file_handler import FileHandler
+from assement.src.file_manager.file_search import FileSearch
+from assement.src.file_manager.listing_index import ListingIndex
+from assement.src.file_manager.ngram_index import ngram_table_definition
+from assement.src.test.conftest import CONFIG
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def tables():
+    return [ngram_table_definition("ImageSearchIndex")]
+
+@pytest.fixture
+def stores(bucket):
+    """FileHandler with a LocalQueue and a FileSearch hiding tombstones, in moto's in-process S3 and DynamoDB."""
+    queue = LocalQueue(clock=_Clock())
+    return (FileHandler(bucket_name="image-bucket", table_name="ImageMetadata", search_table_name="ImageSearchIndex",
+                        delete_queue=queue, **CONFIG),
+            FileSearch(bucket_name="image-bucket", table_name="ImageMetadata", search_table_name="ImageSearchIndex",
+                       tombstones=True, **CONFIG),
+            queue)
+
+def _upload(handler, name, content=b"x"):
+    handler.upload({"queryStringParameters": {"fileName": name, "metadata": "{}"}, "body": base64.b64encode(content).decode()})
+
+def _keys(response):
+    return [file["key"] for file in json.loads(response["body"])["files"]]
+
+def _objects(handler):
+    return [obj["Key"] for obj in handler.s3.list_objects_v2(Bucket="image-bucket").get("Contents", [])]
+
+def test_deletes_are_hidden_at_once_and_drained_in_batches(stores):
+    """Test that deletes return 202, hide the images everywhere, and are purged with one call per store."""
+    handler, search, queue = stores
+    for name in ["a.jpg", "b.jpg", "c.jpg", "keep.jpg"]:
+        _upload(handler, name)
+
+    assert handler.delete_file({"imageName": "a.jpg"})["statusCode"] == 202
+    results = json.loads(handler.batch_delete({"body": json.dumps({"imageNames": ["b.jpg", "c.jpg"]})})["body"])["results"]
+    assert [result["statusCode"] for result in results] == [202, 202]
+
+    # The objects are still there, but nothing finds them
+    assert len(_objects(handler)) == 4
+    assert handler.download({"imageName": "a.jpg"})["statusCode"] == 404
+    assert _keys(search.prefix_search("")) == ["keep.jpg"]
+    assert _keys(search.size_search(1, 0)) == ["keep.jpg"]
+    assert _keys(search.text_search("jpg")) == ["keep.jpg"]
+
+    calls = []
+    handler.s3.meta.events.register("before-call.s3.DeleteObjects", lambda **kwargs: calls.append(kwargs))
+    try:
+        assert DeleteDrain(handler, queue, wait=0).drain_once() == 2
+    finally:
+        handler.s3.meta.events.unregister("before-call.s3.DeleteObjects")
+    assert len(calls) == 1 and queue.pending() == 0
+    assert _objects(handler) == ["keep.jpg"]
+    assert handler.db_client.get_item({"image_id": "a.jpg"}) is None
+
+def test_purge_skips_reuploads_and_retries_failures(stores):
+    """Test that a name uploaded again after its delete survives the drain, and a failed purge is redelivered."""
+    handler, _, queue = stores
+    _upload(handler, "again.jpg")
+    _upload(handler, "gone.jpg")
+    handler.batch_delete({"body": json.dumps({"imageNames": ["again.jpg", "gone.jpg"]})})
+    _upload(handler, "again.jpg", b"new")
+
+    drain = DeleteDrain(handler, queue, wait=0)
+    purge = handler.purge
+    handler.purge = lambda names: list(names)
+    assert drain.drain_once() == 1 and queue.pending() == 1
+    handler.purge = purge
+
+    assert drain.drain_once() == 0
+    queue.clock.now += queue.visibility_timeout
+    assert drain.drain_once() == 1 and queue.pending() == 0
+    assert _objects(handler) == ["again.jpg"]
+    assert handler.download({"imageName": "again.jpg"})["statusCode"] == 200
+    # Purging again is a no-op
+    assert handler.purge(["again.jpg", "gone.jpg"]) == [] and _objects(handler) == ["again.jpg"]
+
+def test_sqs_queue_round_trips_names(stores):
+    """Test that the SQS queue splits names into messages and deletes the received ones."""
+    sqs = aws_clients.client('sqs', **CONFIG)
+    queue = SQSQueue(sqs.create_queue(QueueName="deletes")["QueueUrl"], **CONFIG)
+    queue.send([f"{i}.jpg" for i in range(250)])
+
+    received = []
+    while messages := queue.receive():
+        received += messages
+        queue.delete(receipt for receipt, _ in messages)
+    assert sorted(len(names) for _, names in received) == [50, 100, 100]
+    assert sorted(name for _, names in received for name in names) == sorted(f"{i}.jpg" for i in range(250))
+
+def test_an_eager_drain_sees_the_tombstones(bucket):
+    """Test that names reach the queue only once tombstoned, so a drain purging on send removes the object."""
+    class EagerQueue(LocalQueue):
+        def send(self, image_names):
+            seen.extend(handler.db_client.get_item({"image_id": name}, consistent_read=True) for name in image_names)
+            super().send(image_names)
+            DeleteDrain(handler, self, wait=0).drain_once()
+
+    seen = []
+    queue = EagerQueue(clock=_Clock())
+    handler = FileHandler(bucket_name="image-bucket", table_name="ImageMetadata", search_table_name="ImageSearchIndex",
+                          delete_queue=queue, **CONFIG)
+    _upload(handler, "a.jpg")
+    _upload(handler, "keep.jpg")
+
+    assert handler.delete_file({"imageName": "a.jpg"})["statusCode"] == 202
+    assert [bool(row.get("deleted_at")) for row in seen] == [True]
+    assert queue.pending() == 0
+    assert _objects(handler) == ["keep.jpg"]
+    assert handler.db_client.get_item({"image_id": "a.jpg"}) is None
+
+def test_purge_spares_an_upload_made_after_the_read(stores):
+    """Test that a name uploaded again between purge's read and its delete keeps its row and object."""
+    handler, _, _ = stores
+    _upload(handler, "race.jpg")
+    handler.delete_file({"imageName": "race.jpg"})
+
+    read = handler.db_client.batch_read_items
+    def read_then_upload(*args, **kwargs):
+        result = read(*args, **kwargs)
+        _upload(handler, "race.jpg", b"new")
+        return result
+    handler.db_client.batch_read_items = read_then_upload
+
+    assert handler.purge(["race.jpg"]) == []
+    assert _objects(handler) == ["race.jpg"]
+    assert handler.download({"imageName": "race.jpg"})["statusCode"] == 200
+
+def test_another_containers_listing_index_hides_tombstones(stores, bucket):
+    """Test that pages served from a listing index that still holds a tombstoned name leave it out."""
+    handler, search, _ = stores
+    for name in ["a.jpg", "b.jpg", "c.jpg"]:
+        _upload(handler, name)
+    # Built before the delete, as another container's index would be
+    search.listing = ListingIndex("image-bucket")
+    search.listing.rebuild(bucket)
+    handler.delete_file({"imageName": "b.jpg"})
+
+    page = json.loads(search.prefix_search("", limit=2)["body"])
+    assert [file["key"] for file in page["files"]] == ["a.jpg"] and page["nextToken"]
+    rest = json.loads(search.prefix_search("", limit=2, next_token=page["nextToken"])["body"])
+    assert [file["key"] for file in rest["files"]] == ["c.jpg"]
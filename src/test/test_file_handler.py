@@ -0,0 +1,211 @@
+import json
+import base64
+import pytest
+from unittest.mock import MagicMock
+from assement.src.file_manager.file_handler import FileHandler, MAX_UPLOAD_SIZE, MIN_PART_SIZE, download_cache
+from assement.src.file_manager.db_client import search_shard
+
+@pytest.fixture
+def handler():
+    """FileHandler with mocked S3 and DynamoDB clients."""
+    file_handler = FileHandler(bucket_name="image-bucket", table_name="ImageMetadata")
+    file_handler.s3 = MagicMock()
+    file_handler.db_client = MagicMock()
+    file_handler.db_client.replace_item.return_value = None
+    file_handler.db_client.remove_item.return_value = None
+    file_handler.db_client.batch_read_items.return_value = ([], [])
+    download_cache.clear()
+    return file_handler
+
+def test_upload_init_presigns_every_part(handler):
+    """Test that upload_init creates one presigned URL per part."""
+    handler.s3.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+    handler.s3.generate_presigned_url.side_effect = lambda op, Params, ExpiresIn: f"https://s3/{Params['PartNumber']}"
+
+    response = handler.upload_init({"fileName": "big.jpg", "fileSize": str(2 * MIN_PART_SIZE + 1), "partSize": "1"})
+    body = json.loads(response["body"])
+
+    assert response["statusCode"] == 200
+    assert body["uploadId"] == "upload-1"
+    assert body["partSize"] == MIN_PART_SIZE
+    assert [part["partNumber"] for part in body["parts"]] == [1, 2, 3]
+    assert body["partCount"] == 3 and body["nextPartNumberMarker"] is None
+
+def test_part_urls_are_signed_a_page_at_a_time(handler):
+    """Test that upload_init signs only the first page of part URLs and upload_parts signs the next ones."""
+    handler.s3.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+    handler.s3.generate_presigned_url.side_effect = lambda op, Params, ExpiresIn: f"https://s3/{Params['PartNumber']}"
+
+    body = json.loads(handler.upload_init({"fileName": "big.jpg", "fileSize": str(250 * MIN_PART_SIZE),
+                                           "partSize": str(MIN_PART_SIZE)})["body"])
+    assert body["partCount"] == 250 and len(body["parts"]) == 100 and body["nextPartNumberMarker"] == 100
+    page = json.loads(handler.upload_parts({"fileName": "big.jpg", "uploadId": "upload-1", "partCount": "250",
+                                            "partNumberMarker": "100", "maxParts": "1000"})["body"])
+    assert [part["partNumber"] for part in page["parts"]] == list(range(101, 251))
+    assert page["partCount"] == 250 and page["nextPartNumberMarker"] is None
+    assert handler.s3.generate_presigned_url.call_count == 250
+    for params in ({"partNumberMarker": "100"}, {"partCount": "250", "partNumberMarker": "250"}):
+        assert handler.upload_parts({"fileName": "big.jpg", "uploadId": "upload-1", **params})["statusCode"] == 400
+
+    too_big = handler.upload_init({"fileName": "huge.jpg", "fileSize": str(MAX_UPLOAD_SIZE + 1)})
+    assert too_big["statusCode"] == 400
+
+def test_upload_complete_writes_metadata_after_completion(handler):
+    """Test that metadata is only written once the multipart upload is complete."""
+    event = {
+        "queryStringParameters": {"fileName": "big.jpg", "uploadId": "upload-1"},
+        "body": json.dumps({"parts": [{"partNumber": 2, "etag": "b"}, {"partNumber": 1, "etag": "a"}],
+                            "metadata": "{}"})
+    }
+    handler.s3.head_object.return_value = {"ContentLength": 12345, "ContentType": "image/jpeg"}
+    response = handler.upload_complete(event)
+
+    assert response["statusCode"] == 200
+    parts = handler.s3.complete_multipart_upload.call_args.kwargs["MultipartUpload"]["Parts"]
+    assert [part["PartNumber"] for part in parts] == [1, 2]
+    item = handler.db_client.replace_item.call_args.args[0]
+    assert item["image_id"] == "big.jpg"
+    assert item["metadata"] == {}
+    assert item["size"] == 12345
+    assert item["content_type"] == "image/jpeg"
+
+def test_upload_complete_skips_metadata_on_failure(handler):
+    """Test that a failed completion leaves the metadata table untouched."""
+    handler.s3.complete_multipart_upload.side_effect = Exception("NoSuchUpload")
+    event = {
+        "queryStringParameters": {"fileName": "big.jpg", "uploadId": "upload-1"},
+        "body": json.dumps({"parts": [{"partNumber": 1, "etag": "a"}]})
+    }
+    response = handler.upload_complete(event)
+
+    assert response["statusCode"] == 500
+    handler.db_client.replace_item.assert_not_called()
+
+def test_upload_records_search_attributes(handler):
+    """Test that upload stores size, content type, timestamp and shard for the search GSIs."""
+    event = {
+        "queryStringParameters": {"fileName": "photo.png", "metadata": "{}"},
+        "body": base64.b64encode(b"12345").decode('utf-8')
+    }
+    response = handler.upload(event)
+
+    assert response["statusCode"] == 200
+    item = handler.db_client.replace_item.call_args.args[0]
+    assert item["size"] == 5
+    assert item["content_type"] == "image/png"
+    assert item["search_shard"] == search_shard("photo.png")
+    assert item["uploaded_at"].endswith("+00:00")
+
+def test_download_reuses_cached_url_until_invalidated(handler):
+    """Test that a repeat download skips S3 and DynamoDB, and delete_file drops the entry."""
+    handler.s3.generate_presigned_url.return_value = "https://s3/photo.png"
+    handler.db_client.get_item.return_value = {"metadata": {"format": "PNG"}}
+
+    first = handler.download({"imageName": "photo.png"})
+    second = handler.download({"imageName": "photo.png"})
+
+    assert first == second
+    handler.db_client.get_item.assert_called_once()
+    handler.delete_file({"imageName": "photo.png"})
+    handler.download({"imageName": "photo.png"})
+    assert handler.db_client.get_item.call_count == 2
+
+def test_batch_download_reports_each_image(handler):
+    """Test that batch_download reads metadata in one batch and reports missing images."""
+    handler.s3.generate_presigned_url.side_effect = lambda op, Params, ExpiresIn: f"https://s3/{Params['Key']}"
+    handler.db_client.batch_read_items.return_value = ([{"image_id": "a.png", "metadata": "{}"}], [{"image_id": "c.png"}])
+    event = {"body": json.dumps({"imageNames": ["a.png", "b.png", "c.png", "a.png"]})}
+    results = json.loads(handler.batch_download(event)["body"])["results"]
+
+    assert [(result["imageName"], result["statusCode"]) for result in results] == [
+        ("a.png", 200), ("b.png", 404), ("c.png", 503)]
+    assert results[0]["downloadUrl"] == "https://s3/a.png"
+    handler.db_client.batch_read_items.assert_called_once()
+
+def test_batch_delete_keeps_metadata_of_failed_objects(handler, monkeypatch):
+    """Test that batch_delete chunks S3 deletes and only drops metadata for deleted objects."""
+    monkeypatch.setattr("assement.src.file_manager.file_handler.S3_DELETE_LIMIT", 2)
+    names = ["img0.png", "img1.png", "img2.png"]
+    handler.s3.delete_objects.side_effect = [{"Errors": [{"Key": "img0.png", "Message": "AccessDenied"}]}, {}]
+    handler.db_client.batch_write_items.return_value = []
+    results = json.loads(handler.batch_delete({"body": json.dumps({"imageNames": names})})["body"])["results"]
+
+    assert handler.s3.delete_objects.call_count == 2
+    assert results[0] == {"imageName": "img0.png", "statusCode": 500, "error": "AccessDenied"}
+    delete_keys = handler.db_client.batch_write_items.call_args.kwargs["delete_keys"]
+    assert delete_keys == [{"image_id": "img1.png"}, {"image_id": "img2.png"}]
+
+def test_batch_upload_writes_a_repeated_name_once(handler):
+    """Test that a name repeated in one batch is written once, with the content of its last file."""
+    handler.db_client.batch_write_items.return_value = []
+    files = [{"fileName": "a.png", "content": base64.b64encode(b"first").decode(), "metadata": "{}"},
+             {"fileName": "b.png", "content": base64.b64encode(b"other").decode(), "metadata": "{}"},
+             {"fileName": "a.png", "content": base64.b64encode(b"second").decode(), "metadata": "{}"}]
+    results = json.loads(handler.batch_upload({"body": json.dumps({"files": files})})["body"])["results"]
+
+    assert [result["fileName"] for result in results] == ["a.png", "b.png"]
+    items = handler.db_client.batch_write_items.call_args.kwargs["items"]
+    assert [(item["image_id"], item["size"]) for item in items] == [("a.png", 6), ("b.png", 5)]
+
+def test_malformed_content_is_refused_before_any_write(handler):
+    """Test that a body that is not base64 gets a 400 without touching S3 or DynamoDB."""
+    response = handler.upload({"queryStringParameters": {"fileName": "a.png"}, "body": "aGVsbG8!"})
+    assert response["statusCode"] == 400
+    handler.db_client.batch_write_items.return_value = []
+    files = [{"fileName": "b.png", "content": "aGVsbG8!"}]
+    results = json.loads(handler.batch_upload({"body": json.dumps({"files": files})})["body"])["results"]
+    assert results[0]["statusCode"] == 400
+    handler.s3.put_object.assert_not_called()
+    handler.db_client.replace_item.assert_not_called()
+
+def test_unstorable_metadata_numbers_are_refused(handler):
+    """Test that metadata with a number DynamoDB cannot store gets a 400 before anything is written."""
+    body = base64.b64encode(b"hello").decode()
+    response = handler.upload({"queryStringParameters": {"fileName": "a.png", "metadata": '{"ratio": NaN}'},
+                               "body": body})
+    assert response["statusCode"] == 400 and "NaN" in json.loads(response["body"])["error"]
+    handler.db_client.batch_write_items.return_value = []
+    files = [{"fileName": "b.png", "content": body, "metadata": '{"size": 1e200}'}]
+    results = json.loads(handler.batch_upload({"body": json.dumps({"files": files})})["body"])["results"]
+    assert results[0]["statusCode"] == 400
+    handler.s3.put_object.assert_not_called()
+    handler.db_client.replace_item.assert_not_called()
+
+def test_batch_delete_rejects_missing_names(handler):
+    """Test that an empty batch is a client error."""
+    assert handler.batch_delete({"body": json.dumps({"imageNames": []})})["statusCode"] == 400
+
+def test_upload_removes_object_when_metadata_write_fails(handler):
+    """Test that a failed metadata write deletes the S3 object written alongside it."""
+    handler.db_client.replace_item.side_effect = Exception("Throttled")
+    handler.db_client.get_item.return_value = None
+    response = handler.upload({"queryStringParameters": {"fileName": "photo.png"}, "body": ""})
+
+    assert response["statusCode"] == 500
+    assert json.loads(response["body"])["error"] == "Throttled"
+    handler.s3.delete_object.assert_called_once_with(Bucket="image-bucket", Key="photo.png")
+    handler.db_client.restore_item.assert_not_called()
+
+def test_upload_removes_metadata_when_object_write_fails(handler):
+    """Test that a failed S3 write deletes the metadata row written alongside it."""
+    handler.s3.put_object.side_effect = Exception("SlowDown")
+    response = handler.upload({"queryStringParameters": {"fileName": "photo.png"}, "body": ""})
+
+    assert response["statusCode"] == 500
+    key, previous, _ = handler.db_client.restore_item.call_args.args
+    assert (key, previous) == ({"image_id": "photo.png"}, None)
+    handler.s3.delete_object.assert_not_called()
+
+def test_failed_reupload_keeps_the_previous_image(handler):
+    """Test that a half-failed upload over an existing image puts its row back and keeps its object."""
+    previous = {"image_id": "photo.png", "metadata": {"v": 1}, "uploaded_at": "2024-01-01"}
+    handler.db_client.replace_item.return_value = previous
+    handler.s3.put_object.side_effect = Exception("SlowDown")
+    handler.upload({"queryStringParameters": {"fileName": "photo.png"}, "body": ""})
+    assert handler.db_client.restore_item.call_args.args[1] == previous
+
+    handler.s3.put_object.side_effect = None
+    handler.db_client.replace_item.side_effect = Exception("Throttled")
+    handler.db_client.get_item.return_value = {"image_id": "photo.png"}
+    assert handler.upload({"queryStringParameters": {"fileName": "photo.png"}, "body": ""})["statusCode"] == 500
+    handler.s3.delete_object.assert_not_called()
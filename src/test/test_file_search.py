@@ -0,0 +1,133 @@
+import json
+import time
+from datetime import datetime, timezone
+import pytest
+from unittest.mock import MagicMock
+from decimal import Decimal
+from assement.src.file_manager.file_search import FileSearch, MAX_LIST_CALLS, MAX_PAGE_SIZE, encode_token, decode_token
+from assement.src.file_manager.db_client import SEARCH_SHARDS, SIZE_INDEX
+
+def _objects(*keys):
+    return [{"Key": key, "Size": 10, "LastModified": datetime(2024, 12, 1, tzinfo=timezone.utc)} for key in keys]
+
+@pytest.fixture
+def search():
+    """FileSearch with a mocked S3 client."""
+    file_search = FileSearch(bucket_name="image-bucket", table_name="ImageMetadata")
+    file_search.s3 = MagicMock()
+    file_search.db_client = MagicMock()
+    return file_search
+
+def test_prefix_search_follows_continuation_until_page_is_full(search):
+    """Test that listing asks only for the missing keys and returns a cursor."""
+    search.s3.list_objects_v2.side_effect = [
+        {"Contents": _objects("a1", "a2"), "IsTruncated": True, "NextContinuationToken": "t1"},
+        {"Contents": _objects("a3"), "IsTruncated": True, "NextContinuationToken": "t2"},
+    ]
+    body = json.loads(search.prefix_search("a", limit=3)["body"])
+
+    assert [file["key"] for file in body["files"]] == ["a1", "a2", "a3"]
+    assert decode_token(body["nextToken"]) == "t2"
+    calls = search.s3.list_objects_v2.call_args_list
+    assert calls[0].kwargs["MaxKeys"] == 3
+    assert calls[1].kwargs["MaxKeys"] == 1
+    assert calls[1].kwargs["ContinuationToken"] == "t1"
+
+def test_filtered_prefix_search_lists_full_pages_and_stops_at_the_cap(search):
+    """Test that a size filter asks for full pages, cuts a page at its last name and caps the calls."""
+    search.s3.list_objects_v2.return_value = {"Contents": _objects("a1", "a2", "a3"), "IsTruncated": True,
+                                              "NextContinuationToken": "t1"}
+    body = json.loads(search.prefix_search("a", limit=2, min_size=5)["body"])
+    assert [file["key"] for file in body["files"]] == ["a1", "a2"]
+    assert decode_token(body["nextToken"]) == "k:a2"
+    assert search.s3.list_objects_v2.call_args.kwargs["MaxKeys"] == MAX_PAGE_SIZE
+
+    search.s3.list_objects_v2.reset_mock()
+    search.s3.list_objects_v2.return_value = {"Contents": _objects("a1", "a2", "a3"), "IsTruncated": True,
+                                              "NextContinuationToken": "t1"}
+    body = json.loads(search.prefix_search("a", limit=2, min_size=50)["body"])
+    assert body["files"] == [] and decode_token(body["nextToken"]) == "t1"
+    assert search.s3.list_objects_v2.call_count == MAX_LIST_CALLS
+
+def test_prefix_search_resumes_from_token(search):
+    """Test that a nextToken is passed back to S3 and the last page has no token."""
+    search.s3.list_objects_v2.return_value = {"Contents": _objects("a4"), "IsTruncated": False}
+    body = json.loads(search.prefix_search("a", limit=3, next_token=encode_token("t2"))["body"])
+
+    assert body["nextToken"] is None
+    assert search.s3.list_objects_v2.call_args.kwargs["ContinuationToken"] == "t2"
+
+def test_prefix_search_etag_tracks_object_changes(search):
+    """Test that the listing ETag is stable for unchanged objects and changes when one is modified."""
+    search.s3.list_objects_v2.return_value = {"Contents": _objects("a1", "a2"), "IsTruncated": False}
+    first = search.prefix_search("a")["headers"]["ETag"]
+    assert search.prefix_search("a")["headers"]["ETag"] == first
+
+    changed = _objects("a1", "a2")
+    changed[1]["LastModified"] = datetime(2024, 12, 2, tzinfo=timezone.utc)
+    search.s3.list_objects_v2.return_value = {"Contents": changed, "IsTruncated": False}
+    assert search.prefix_search("a")["headers"]["ETag"] != first
+
+def test_prefix_search_rejects_bad_token(search):
+    """Test that a malformed nextToken is a client error."""
+    assert search.prefix_search("a", next_token="%%%")["statusCode"] == 400
+
+def _shard_pages(pages):
+    """query_index stand-in serving {shard: (items, truncated)} and recording the calls."""
+    def query_index(index_name, key_condition, limit, exclusive_start_key=None):
+        shard = key_condition.get_expression()['values'][0].get_expression()['values'][1]
+        items, truncated = pages.get(shard, ([], False))
+        response = {"Items": items[:limit]}
+        if truncated or len(items) > limit:
+            response["LastEvaluatedKey"] = {"image_id": response["Items"][-1]["image_id"]}
+        return response
+    return query_index
+
+def _item(key, size):
+    return {"image_id": key, "size": Decimal(size), "content_type": "image/jpeg", "uploaded_at": "2024-12-01"}
+
+def test_size_search_merges_shards_in_size_order(search):
+    """Test that shard pages are merged by size and the cursor resumes each shard."""
+    search.db_client.query_index.side_effect = _shard_pages({
+        "0": ([_item("a", 10), _item("c", 30)], False),
+        "1": ([_item("b", 20), _item("d", 40)], False),
+    })
+    body = json.loads(search.size_search(5, 100, limit=3)["body"])
+
+    assert [file["key"] for file in body["files"]] == ["a", "b", "c"]
+    assert body["files"][0]["size"] == 10
+    assert search.db_client.query_index.call_args.args[0] == SIZE_INDEX
+    cursors = json.loads(decode_token(body["nextToken"]))
+    assert cursors == {"1": {"image_id": "b", "search_shard": "1", "size": 20}}
+
+def test_size_search_stops_at_truncated_shard(search):
+    """Test that items past the last key of a truncated shard are held back for the next page."""
+    search.db_client.query_index.side_effect = _shard_pages({
+        "0": ([_item("a", 10)], True),
+        "1": ([_item("b", 20)], False),
+    })
+    body = json.loads(search.size_search(0, 100, limit=5)["body"])
+
+    assert [file["key"] for file in body["files"]] == ["a"]
+    assert set(json.loads(decode_token(body["nextToken"]))) == {"0", "1"}
+
+def test_size_search_queries_the_shards_at_the_same_time(search):
+    """Test that every search shard is queried concurrently, not one after another."""
+    serve, running, overlap = _shard_pages({}), [], []
+    def query_index(*args, **kwargs):
+        running.append(1)
+        time.sleep(0.05)
+        overlap.append(len(running))
+        running.pop()
+        return serve(*args, **kwargs)
+    search.db_client.query_index.side_effect = query_index
+    assert search.size_search(0, 100)["statusCode"] == 200
+    assert len(overlap) == SEARCH_SHARDS and max(overlap) > 1
+
+def test_size_search_rejects_inverted_range(search):
+    """Test that maxSize below minSize is a client error."""
+    assert search.size_search(100, 10)["statusCode"] == 400
+
+def test_date_search_rejects_bad_dates(search):
+    """Test that non-ISO dates are a client error."""
+    assert search.date_search("yesterday")["statusCode"] == 400
@@ -1,7 +1,10 @@
 import json
 import base64
+import gzip
+import threading
 import pytest
 from unittest.mock import patch
+from assement.src.file_manager import lambda_function
 from assement.src.file_manager.lambda_function import lambda_handler  # Adjust the import as needed
 
 @pytest.fixture
@@ -90,6 +93,31 @@ def test_list_files(mock_list_files, list_files_event, mock_context):
     response = lambda_handler(list_files_event, mock_context)
     assert response["statusCode"] == 200
 
+@patch("assement.src.file_manager.lambda_function.FileHandler.download")
+def test_download_not_modified(mock_download, download_event, mock_context):
+    """Test that a matching If-None-Match gets a 304 without a body."""
+    mock_download.return_value = {"statusCode": 200, "body": "{}", "headers": {"ETag": 'W/"v1"'}}
+    download_event["headers"] = {"If-None-Match": '"v0", W/"v1"'}
+    response = lambda_handler(download_event, mock_context)
+    assert response["statusCode"] == 304
+    assert response["body"] == ""
+    assert response["headers"]["ETag"] == 'W/"v1"'
+
+@patch("assement.src.file_manager.lambda_function.FileSearch.prefix_search")
+def test_list_files_gzips_large_bodies(mock_list_files, list_files_event, mock_context):
+    """Test that a large listing is gzipped only when the client accepts it."""
+    body = json.dumps({"files": [f"example{i}.jpg" for i in range(200)]})
+    mock_list_files.return_value = {"statusCode": 200, "body": body, "headers": {"ETag": 'W/"v1"'}}
+
+    list_files_event["headers"] = {"accept-encoding": "br, gzip;q=0"}
+    assert "isBase64Encoded" not in lambda_handler(list_files_event, mock_context)
+
+    list_files_event["headers"] = {"Accept-Encoding": "gzip, deflate"}
+    response = lambda_handler(list_files_event, mock_context)
+    assert response["isBase64Encoded"] is True
+    assert response["headers"]["Content-Encoding"] == "gzip"
+    assert gzip.decompress(base64.b64decode(response["body"])).decode() == body
+
 @patch("assement.src.file_manager.lambda_function.FileHandler.delete_file")
 def test_delete_file(mock_delete_file, delete_event, mock_context):
     """Test deleting a file."""
@@ -97,3 +125,68 @@ def test_delete_file(mock_delete_file, delete_event, mock_context):
     response = lambda_handler(delete_event, mock_context)
     assert response["statusCode"] == 200
     mock_delete_file.assert_called_once()
+
+@pytest.fixture
+def upload_init_event():
+    """Fixture for starting a multipart upload."""
+    return {
+        "httpMethod": "POST",
+        "queryStringParameters": {
+            "action": "upload_init",
+            "fileName": "large_image.jpg",
+            "fileSize": str(20 * 1024 * 1024)
+        },
+        "headers": {"Content-Type": "application/json"}
+    }
+
+@patch("assement.src.file_manager.lambda_function.FileHandler.upload_init")
+def test_upload_init(mock_upload_init, upload_init_event, mock_context):
+    """Test starting a multipart upload."""
+    mock_upload_init.return_value = {"statusCode": 200, "body": json.dumps({"uploadId": "abc", "parts": []})}
+    response = lambda_handler(upload_init_event, mock_context)
+    assert response["statusCode"] == 200
+    mock_upload_init.assert_called_once_with(upload_init_event["queryStringParameters"])
+
+def test_warmup_builds_clients(mock_context):
+    """Test that a warmup event initializes the clients without routing an action."""
+    response = lambda_handler({"warmup": True}, mock_context)
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["clients"] == ["dynamodb:ImageAttributeIndex", "dynamodb:ImageMetadata",
+                                                       "dynamodb:ImageSearchIndex", "s3"]
+    # The handlers hold the built clients, so real requests reuse them
+    assert lambda_function.image_handler._s3 is not None and lambda_function.file_search._s3 is not None
+    assert lambda_function.image_handler.db_client._table is not None
+    assert lambda_function.file_search.ngrams.db_client._table is not None
+
+def test_warmup_reports_the_download_cache(mock_context, capsys):
+    """Test that a warmup reports the download cache's counters and records them as metrics."""
+    response = lambda_handler({"warmup": True}, mock_context)
+    assert {"hits", "misses", "evictions", "entries", "bytes"} <= set(json.loads(response["body"])["downloadCache"])
+    record = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert {"download_cache.hit_ratio", "download_cache.entries", "download_cache.bytes"} <= set(record)
+
+@patch("assement.src.file_manager.lambda_function.ListingIndex.apply_notifications")
+def test_s3_notifications_update_the_listing_index(mock_apply, mock_context):
+    """Test that S3 event notifications are routed to the listing index instead of an action."""
+    mock_apply.return_value = 1
+    records = [{"eventSource": "aws:s3", "eventName": "ObjectCreated:Put", "s3": {"object": {"key": "a.jpg", "size": 1}}}]
+    response = lambda_handler({"Records": records}, mock_context)
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["applied"] == 1
+    assert mock_apply.call_args.args[1] == records
+
+@patch("assement.src.file_manager.lambda_function.DeleteDrain.purge_messages")
+def test_malformed_delete_messages_fail_alone(mock_purge, mock_context):
+    """Test that a delete queue message that does not parse is reported, and the rest of the batch is purged."""
+    mock_purge.return_value = []
+    records = [{"eventSource": "aws:sqs", "messageId": "good", "body": json.dumps({"names": ["a.jpg"]})},
+               {"eventSource": "aws:sqs", "messageId": "bad", "body": "not json"},
+               {"eventSource": "aws:sqs", "messageId": "empty", "body": "{}"}]
+    response = lambda_handler({"Records": records}, mock_context)
+    assert response["batchItemFailures"] == [{"itemIdentifier": "bad"}, {"itemIdentifier": "empty"}]
+    mock_purge.assert_called_once_with([("good", ["a.jpg"])])
+
+def test_no_delete_drain_runs_without_a_queue():
+    """Test that importing the function starts no drain thread, and deletes stay synchronous without DELETE_QUEUE_URL."""
+    assert lambda_function.image_handler.delete_queue is None
+    assert "delete-drain" not in {thread.name for thread in threading.enumerate()}
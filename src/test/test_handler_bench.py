@@ -0,0 +1,18 @@
+import pytest
+
+pytest.importorskip("moto")
+
+from assement.src.benchmark import handler_bench
+from assement.src.file_manager import lambda_function
+
+def test_benchmark_runs_every_action(monkeypatch, aws):
+    """Test that a tiny benchmark run drives every action successfully against the stand-in."""
+    # run() repoints the module-level handlers at the stand-in
+    monkeypatch.setattr(lambda_function, "image_handler", lambda_function.image_handler)
+    monkeypatch.setattr(lambda_function, "file_search", lambda_function.file_search)
+    results = handler_bench.run(iterations=2, upload_sizes={"1KB": 1024}, list_sizes=[10], trace_memory=False)
+
+    assert set(results) == {"upload_1KB", "stream_decode_1KB", "download", "download_cached", "list_10_keys",
+                            "list_10_keys_cached", "list_10_keys_indexed", "delete", "delete_queued",
+                            "download_and_fetch", "download_inline"}
+    assert all(scenario["p50_ms"] > 0 for scenario in results.values())
@@ -0,0 +1,85 @@
+import asyncio
+import base64
+import json
+from assement.src.benchmark.load_gen import run_load
+from assement.src.file_manager.http_server import LocalServer
+
+def _echo(events):
+    """A proxy handler that records its events and answers with the parts of them the tests check."""
+    def handler(event, context):
+        events.append(event)
+        return {"statusCode": 200, "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({"query": event["queryStringParameters"], "body": event["body"],
+                                    "isBase64Encoded": event["isBase64Encoded"]})}
+    return handler
+
+async def _exchange(port, data, responses=1):
+    """Sends raw bytes on one connection and reads that many responses."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(data)
+    found = []
+    for _ in range(responses):
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while (line := await reader.readline()).strip():
+            name, _, value = line.decode().partition(":")
+            headers[name.lower()] = value.strip()
+        found.append((status, headers, await reader.readexactly(int(headers.get("content-length", 0)))))
+    writer.close()
+    return found
+
+def test_requests_become_proxy_events_on_a_kept_alive_connection():
+    """Test that pipelined requests on one connection arrive as proxy events, binary and chunked bodies included."""
+    events = []
+
+    async def scenario():
+        server = await LocalServer(_echo(events), port=0, workers=2).start()
+        try:
+            return await _exchange(server.port, (
+                b"GET /?action=list&prefix=a%2Fb&prefix=c HTTP/1.1\r\nHost: x\r\n\r\n"
+                b"POST /?action=upload&fileName=x.png HTTP/1.1\r\nContent-Type: image/png\r\nContent-Length: 4\r\n\r\n\x89PNG"
+                b"POST /?action=batch_delete HTTP/1.1\r\nContent-Type: application/json\r\n"
+                b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n5\r\n{\"nam\r\n5\r\nes\":[\r\n3\r\n\"a\"\r\n2\r\n]}\r\n0\r\n\r\n"
+            ), responses=3)
+        finally:
+            await server.close()
+
+    (listed, _, body), (uploaded, _, _), (deleted, headers, _) = asyncio.run(scenario())
+    assert (listed, uploaded, deleted) == (200, 200, 200)
+    assert json.loads(body)["query"] == {"action": "list", "prefix": "c"}
+    assert events[0]["multiValueQueryStringParameters"]["prefix"] == ["a/b", "c"]
+    assert (events[1]["body"], events[1]["isBase64Encoded"]) == (base64.b64encode(b"\x89PNG").decode(), True)
+    assert (events[2]["body"], events[2]["isBase64Encoded"]) == ('{"names":["a"]}', False)
+    assert headers["connection"] == "close"
+
+def test_oversized_bodies_are_refused_before_they_are_sent():
+    """Test that a body over the limit gets a 413 instead of a 100 Continue, and never reaches the handler."""
+    events = []
+
+    async def scenario():
+        server = await LocalServer(_echo(events), port=0, max_body_bytes=10).start()
+        try:
+            return await _exchange(server.port, b"POST /?action=upload HTTP/1.1\r\nContent-Length: 11\r\n"
+                                                b"Expect: 100-continue\r\n\r\n")
+        finally:
+            await server.close()
+
+    [(status, headers, _)] = asyncio.run(scenario())
+    assert (status, headers["connection"], events) == (413, "close", [])
+
+def test_load_generator_reports_throughput_and_percentiles():
+    """Test that the load generator drives the server concurrently and reports every request."""
+    events = []
+
+    async def scenario():
+        server = await LocalServer(_echo(events), port=0, workers=4).start()
+        try:
+            return await run_load([f"http://127.0.0.1:{server.port}/?action=list&prefix={{i}}"], concurrency=4,
+                                  duration=float("inf"), requests=40)
+        finally:
+            await server.close()
+
+    report = asyncio.run(scenario())
+    assert (report["requests"], report["statuses"], report["errors"]) == (40, {"200": 40}, {})
+    assert report["p50_ms"] <= report["p99_ms"] and report["throughput_per_s"] > 0
+    assert sorted(int(event["queryStringParameters"]["prefix"]) for event in events) == list(range(40))
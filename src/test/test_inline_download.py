@@ -0,0 +1,60 @@
+import base64
+import json
+import pytest
+
+pytest.importorskip("moto")
+
+from assement.src.file_manager.conditional import finalize, parse_range
+from assement.src.file_manager.file_handler import FileHandler
+from assement.src.test.conftest import CONFIG
+
+CONTENT = bytes(range(256)) * 4
+
+@pytest.fixture
+def handler(bucket):
+    """FileHandler returning objects up to 2 KB inline, in moto's in-process S3 and DynamoDB."""
+    file_handler = FileHandler(bucket_name="image-bucket", table_name="ImageMetadata", inline_max_bytes=2048, **CONFIG)
+    for name, content in [("icon.png", CONTENT), ("photo.png", CONTENT * 3)]:
+        file_handler.upload({"queryStringParameters": {"fileName": name, "metadata": "{}"},
+                             "body": base64.b64encode(content).decode()})
+    return file_handler
+
+def test_small_images_come_back_inline(handler):
+    """Test that an inline download returns small images in the body, revalidates them, and signs large ones."""
+    calls = []
+    handler.s3.meta.events.register("before-call.s3.GetObject", lambda **kwargs: calls.append(kwargs))
+    try:
+        first = finalize({}, handler.download({"imageName": "icon.png", "inline": "true"}))
+        again = handler.download({"imageName": "icon.png", "inline": "true"}, {"if-none-match": first["headers"]["ETag"]})
+    finally:
+        handler.s3.meta.events.unregister("before-call.s3.GetObject")
+    assert (first["statusCode"], first["isBase64Encoded"], base64.b64decode(first["body"])) == (200, True, CONTENT)
+    assert first["headers"]["Content-Type"] == "image/png" and "max-age" in first["headers"]["Cache-Control"]
+    assert again["statusCode"] == 304 and len(calls) == 1
+
+    large = handler.download({"imageName": "photo.png", "inline": "true"})
+    assert large["statusCode"] == 200 and "downloadUrl" in json.loads(large["body"])
+
+def test_range_requests_become_ranged_gets(handler):
+    """Test that a Range header returns that slice with a 206, capped at the inline limit, and 416 past the end."""
+    header = handler.download({"imageName": "photo.png"}, {"range": "bytes=0-15"})
+    assert (header["statusCode"], header["headers"]["Content-Range"]) == (206, "bytes 0-15/3072")
+    assert base64.b64decode(header["body"]) == CONTENT[:16]
+
+    rest = handler.download({"imageName": "photo.png"}, {"range": "bytes=512-"})
+    assert rest["headers"]["Content-Range"] == "bytes 512-2559/3072"
+    assert len(base64.b64decode(rest["body"])) == 2048
+
+    tail = handler.download({"imageName": "icon.png"}, {"range": "bytes=-4"})
+    assert base64.b64decode(tail["body"]) == CONTENT[-4:]
+
+    beyond = handler.download({"imageName": "icon.png"}, {"range": "bytes=5000-"})
+    assert (beyond["statusCode"], beyond["headers"]["Content-Range"]) == (416, "bytes */1024")
+
+def test_parse_range_ignores_what_it_cannot_serve():
+    """Test that multi-range and malformed headers are ignored and long ranges are shortened."""
+    assert parse_range("bytes=10-", 100) == "bytes=10-109"
+    assert parse_range("bytes=-500", 100) == "bytes=-100"
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("items=0-1", 100) is None
+    assert parse_range("bytes=9-2", 100) is None
@@ -0,0 +1,141 @@
+import base64
+import json
+import pytest
+
+pytest.importorskip("moto")
+
+from assement.src.file_manager.file_handler import FileHandler
+from assement.src.file_manager import file_search
+from assement.src.file_manager.file_search import FileSearch
+from assement.src.file_manager.key_layout import RESERVED_PREFIXES, logical_name, shard_key, validate_shards
+from assement.src.file_manager.migrate_keys import KeyMigration
+from assement.src.test.conftest import CONFIG
+
+def handler(key_shards):
+    return FileHandler(bucket_name="image-bucket", table_name="ImageMetadata", key_shards=key_shards, **CONFIG)
+
+def upload(file_handler, name):
+    return file_handler.upload({"queryStringParameters": {"fileName": name, "metadata": "{}"},
+                                "body": base64.b64encode(name.encode()).decode()})
+
+def keys(s3):
+    return sorted(obj["Key"] for obj in s3.list_objects_v2(Bucket="image-bucket").get("Contents", []))
+
+def test_shard_keys_map_back_to_names():
+    """Test that sharded keys spread names over the shards and map back to them."""
+    names = [f"2024/05/{i}.jpg" for i in range(200)]
+    assert len({shard_key(name, 16).split("/")[1] for name in names}) == 16
+    assert all(logical_name(shard_key(name, 16)) == name for name in names)
+    assert shard_key("a.jpg", 0) == "a.jpg" and logical_name("a.jpg") is None and logical_name("shards/zz/a") is None
+    with pytest.raises(ValueError):
+        validate_shards(257)
+
+def test_sharded_objects_resolve_through_metadata(bucket):
+    """Test that uploads land under sharded keys and download and delete find them through the row."""
+    legacy, sharded = handler(0), handler(16)
+    upload(legacy, "old.jpg")
+    upload(sharded, "new.jpg")
+    assert keys(bucket) == sorted(["old.jpg", shard_key("new.jpg", 16)])
+
+    for name in ("old.jpg", "new.jpg"):
+        url = json.loads(sharded.download({"imageName": name})["body"])["downloadUrl"]
+        assert url.split("?")[0].endswith(shard_key(name, 16) if name == "new.jpg" else name)
+
+    # Uploading again under the sharded layout removes the object stored under the name
+    upload(sharded, "old.jpg")
+    assert keys(bucket) == sorted([shard_key("old.jpg", 16), shard_key("new.jpg", 16)])
+    assert sharded.delete_file({"imageName": "new.jpg"})["statusCode"] == 200
+    assert json.loads(sharded.batch_delete({"body": json.dumps({"imageNames": ["old.jpg"]})})["body"])["results"][0][
+        "statusCode"] == 200
+    assert keys(bucket) == []
+
+def test_listing_fans_out_over_shards_in_name_order(bucket):
+    """Test that a sharded listing merges every shard and the unmoved objects into pages in name order."""
+    names = sorted(f"2024/{i:03}.jpg" for i in range(40))
+    for i, name in enumerate(names):
+        upload(handler(0 if i % 5 == 0 else 8), name)
+    upload(handler(8), "2023/other.jpg")
+    search = FileSearch(bucket_name="image-bucket", key_shards=8, **CONFIG)
+
+    calls = []
+    search.s3.meta.events.register("before-call.s3.ListObjectsV2", lambda **kwargs: calls.append(kwargs))
+    try:
+        listed, token = [], None
+        while True:
+            page = json.loads(search.prefix_search("2024/", limit=7, next_token=token)["body"])
+            listed += [file["key"] for file in page["files"]]
+            token = page["nextToken"]
+            if not token:
+                break
+    finally:
+        search.s3.meta.events.unregister("before-call.s3.ListObjectsV2")
+    assert listed == names
+    # Each page lists every shard and the unsharded prefix once, concurrently
+    assert len(calls) == 9 * 6
+
+def test_filtered_sharded_listing_caps_its_calls(bucket, monkeypatch):
+    """Test that a sharded listing that filters most keys out stops at the call cap and resumes where it stopped."""
+    monkeypatch.setattr(file_search, "MAX_PAGE_SIZE", 2)
+    monkeypatch.setattr(file_search, "MAX_LIST_CALLS", 6)
+    names = [f"2024/{i:03}.jpg" if i % 7 else f"2024/{i:03}-large.jpg" for i in range(60)]
+    for i, name in enumerate(names):
+        upload(handler(0 if i % 5 == 0 else 4), name)
+    search = FileSearch(bucket_name="image-bucket", key_shards=4, **CONFIG)
+
+    calls = []
+    search.s3.meta.events.register("before-call.s3.ListObjectsV2", lambda **kwargs: calls.append(kwargs))
+    try:
+        listed, pages, token = [], [], None
+        while True:
+            calls.clear()
+            page = json.loads(search.prefix_search("2024/", limit=3, next_token=token, min_size=15)["body"])
+            listed += [file["key"] for file in page["files"]]
+            pages.append((len(page["files"]), len(calls)))
+            token = page["nextToken"]
+            if not token:
+                break
+    finally:
+        search.s3.meta.events.unregister("before-call.s3.ListObjectsV2")
+    assert listed == sorted(name for name in names if "large" in name)
+    # At most two rounds of five concurrent calls per page, and some pages come back short
+    assert all(page_calls <= 10 for _, page_calls in pages)
+    assert any(size < 3 for size, _ in pages[:-1])
+
+def test_migration_moves_objects_and_deletes_them_after_the_grace_period(bucket):
+    """Test that a migration copies objects to their sharded keys, keeps the old ones for the grace
+    period, deletes them on a later run, and has nothing left to do after that."""
+    legacy = handler(0)
+    names = [f"photo-{i}.jpg" for i in range(12)]
+    for name in names:
+        upload(legacy, name)
+    sharded = handler(16)
+
+    assert KeyMigration(sharded, 16, segments=3, dry_run=True, progress=lambda report: None).run()["to_move"] == 12
+    first = KeyMigration(sharded, 16, segments=3, progress=lambda report: None).run()
+    assert first["moved"] == 12 and keys(bucket) == sorted(names + [shard_key(name, 16) for name in names])
+    url = json.loads(sharded.download({"imageName": "photo-3.jpg"})["body"])["downloadUrl"]
+    assert url.split("?")[0].endswith(shard_key("photo-3.jpg", 16))
+
+    assert KeyMigration(sharded, 16, segments=3, progress=lambda report: None).run()["waiting"] == 12
+    second = KeyMigration(sharded, 16, segments=3, grace=0, progress=lambda report: None).run()
+    assert second["deleted"] == 12 and keys(bucket) == sorted(shard_key(name, 16) for name in names)
+    assert KeyMigration(sharded, 16, segments=3, grace=0, progress=lambda report: None).run()["in_place"] == 12
+    obj = bucket.get_object(Bucket="image-bucket", Key=shard_key("photo-3.jpg", 16))
+    assert obj["Body"].read() == b"photo-3.jpg" and obj["ContentType"] == "image/jpeg"
+
+def test_reserved_prefixes_are_rejected_and_not_listed(bucket):
+    """Test that names under the service's own prefixes cannot be written, and its objects are not listed."""
+    file_handler = handler(0)
+    for prefix in RESERVED_PREFIXES:
+        assert upload(file_handler, prefix + "a.jpg")["statusCode"] == 400
+        assert file_handler.upload_init({"fileName": prefix + "a.jpg", "fileSize": "10"})["statusCode"] == 400
+    batch = file_handler.batch_upload({"body": json.dumps({"files": [{"fileName": "blobs/a.jpg", "content": ""},
+                                                                       {"fileName": "a.jpg", "content": ""}]})})
+    assert [result["statusCode"] for result in json.loads(batch["body"])["results"]] == [400, 200]
+    assert keys(bucket) == ["a.jpg"]
+
+    bucket.put_object(Bucket="image-bucket", Key="variants/a.jpg/x/10x10q85.jpeg", Body=b"v")
+    for shards in (0, 16):
+        search = FileSearch(bucket_name="image-bucket", key_shards=shards, **CONFIG)
+        listed = json.loads(search.prefix_search("")["body"])["files"]
+        assert [file["key"] for file in listed] == ["a.jpg"]
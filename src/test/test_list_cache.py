@@ -0,0 +1,103 @@
+import base64
+import json
+import pytest
+
+pytest.importorskip("moto")
+
+from assement.src.file_manager import list_cache
+from assement.src.file_manager.file_handler import FileHandler
+from assement.src.file_manager.file_search import FileSearch
+from assement.src.file_manager.list_cache import ListCache, list_cache_table_definition
+from assement.src.test.conftest import CONFIG
+
+@pytest.fixture
+def tables():
+    return [list_cache_table_definition("ListCache")]
+
+@pytest.fixture
+def list_calls(bucket):
+    """An empty bucket, metadata table and shared list cache table in moto; yields the S3 LIST calls made."""
+    calls = []
+    list_objects = bucket.list_objects_v2
+    bucket.list_objects_v2 = lambda **params: calls.append(params) or list_objects(**params)
+    return calls
+
+def _container(list_cache):
+    """A handler and a search sharing one list cache, as in one Lambda container."""
+    handler = FileHandler(bucket_name="image-bucket", table_name="ImageMetadata", list_cache=list_cache, **CONFIG)
+    search = FileSearch(bucket_name="image-bucket", table_name="ImageMetadata", list_cache=list_cache, **CONFIG)
+    return handler, search
+
+def _upload(handler, name, body=b"123"):
+    handler.upload({"queryStringParameters": {"fileName": name}, "body": base64.b64encode(body).decode()})
+
+def _keys(response):
+    return [file["key"] for file in json.loads(response["body"])["files"]]
+
+def test_writes_invalidate_only_covering_prefixes(list_calls):
+    """Test that repeated listings skip S3 and a write only drops the pages of prefixes covering its name."""
+    cache = ListCache()
+    handler, search = _container(cache)
+    _upload(handler, "a/1.png")
+    _upload(handler, "b/1.png")
+
+    assert _keys(search.prefix_search("a/")) == _keys(search.prefix_search("a/")) == ["a/1.png"]
+    search.prefix_search("b/")
+    assert len(list_calls) == 2
+
+    _upload(handler, "a/2.png")
+    assert _keys(search.prefix_search("a/")) == ["a/1.png", "a/2.png"]
+    search.prefix_search("b/")
+    assert len(list_calls) == 3
+    assert cache.stats()["hit_ratio"] == 0.4
+
+def test_size_search_is_invalidated_by_size(list_calls):
+    """Test that a size search page is only dropped by writes of images within its range."""
+    cache = ListCache()
+    handler, search = _container(cache)
+    _upload(handler, "small.png", b"1")
+    assert _keys(search.size_search(1, 5)) == ["small.png"]
+
+    _upload(handler, "large.png", b"1234567890")
+    assert cache.memory.stats()["entries"] == 1
+    _upload(handler, "small.png", b"12")
+    assert cache.memory.stats()["entries"] == 0
+    handler.delete_file({"imageName": "small.png"})
+    assert _keys(search.size_search(1, 5)) == []
+
+def test_shared_table_serves_and_invalidates_across_containers(list_calls):
+    """Test that a page cached by one container is served to another until a write in either invalidates it."""
+    first_handler, first_search = _container(ListCache("ListCache", endpoint_url=None))
+    second_search = _container(ListCache("ListCache", endpoint_url=None, memory_ttl=0))[1]
+    _upload(first_handler, "a/1.png")
+
+    assert _keys(first_search.prefix_search("a/")) == ["a/1.png"]
+    assert _keys(second_search.prefix_search("a/")) == ["a/1.png"]
+    assert len(list_calls) == 1
+    assert second_search.list_cache.stats()["shared_hits"] == 1
+
+    _upload(first_handler, "b/1.png")
+    second_search.prefix_search("a/")
+    assert len(list_calls) == 1
+    _upload(first_handler, "a/2.png")
+    assert _keys(second_search.prefix_search("a/")) == ["a/1.png", "a/2.png"]
+    assert len(list_calls) == 2
+
+def test_scopes_are_registered_one_item_each_and_expire(list_calls):
+    """Test that each cached scope gets a registry item of its own, refreshed before its pages outlive it."""
+    now = [1000.0]
+    cache = ListCache("ListCache", endpoint_url=None, memory_ttl=0, clock=lambda: now[0])
+    handler, search = _container(cache)
+    for prefix in ("a/", "b/", "c/"):
+        search.prefix_search(prefix)
+    registry = [entry for shard in range(list_cache.REGISTRY_SHARDS) for entry in cache._registry(shard)]
+    assert sorted(entry["entry"] for entry in registry) == ["prefix:a/", "prefix:b/", "prefix:c/"]
+    assert {entry["expires_at"] for entry in registry} == {1000 + list_cache.REGISTRY_TTL}
+
+    # Once its entry has expired, a scope no longer costs writers an increment
+    now[0] += list_cache.REGISTRY_TTL
+    _upload(handler, "a/1.png")
+    generation = cache.db_client.get_item({"scope": "prefix:a/", "entry": list_cache.GENERATION})
+    assert generation is None
+    search.prefix_search("a/")
+    assert cache._registered["prefix:a/"] == now[0] + list_cache.REGISTRY_TTL
@@ -0,0 +1,104 @@
+import base64
+import json
+import pytest
+
+pytest.importorskip("moto")
+
+from assement.src.file_manager.file_handler import FileHandler
+from assement.src.file_manager.file_search import FileSearch
+from assement.src.file_manager.listing_index import ListingIndex, SNAPSHOT_KEY
+from assement.src.test.conftest import CONFIG
+
+@pytest.fixture
+def s3(bucket):
+    """An empty bucket in moto's in-process S3."""
+    return bucket
+
+def _event(name, key, size=0, sequencer="0A"):
+    obj = {"key": key, "sequencer": sequencer}
+    if name.startswith("ObjectCreated"):
+        obj["size"] = size
+    return {"eventSource": "aws:s3", "eventName": name, "eventTime": "2024-05-01T10:00:00.000Z",
+            "s3": {"bucket": {"name": "image-bucket"}, "object": obj}}
+
+def test_scan_ranges_over_prefix_with_size_filter():
+    """Test that a scan returns the prefix range in key order, filtered by size, and reports more pages."""
+    index = ListingIndex("image-bucket")
+    for key, size in [("b1", 5), ("a3", 30), ("a1", 10), ("a2", 20), ("ab", 40)]:
+        index.put(key, size, 0)
+    index.put("a2", 25, 0)
+    assert [key for key, _, _ in index.scan("a", limit=10)[0]] == ["a1", "a2", "a3", "ab"]
+    found, more = index.scan("a", limit=2, min_size=15)
+    assert [(key, size) for key, size, _ in found] == [("a2", 25), ("a3", 30)] and more
+    assert [key for key, _, _ in index.scan("a", start_after="a3", min_size=15, max_size=35)[0]] == []
+    index.remove("a2")
+    assert [key for key, _, _ in index.scan("a", start_after="a1")[0]] == ["a3", "ab"]
+
+def test_notifications_build_update_and_save_the_snapshot(s3):
+    """Test that S3 events seed the snapshot from a listing, apply in sequencer order and persist."""
+    s3.put_object(Bucket="image-bucket", Key="old.png", Body=b"12345")
+    index = ListingIndex("image-bucket")
+    records = [_event("ObjectRemoved:Delete", "new+cat.png", sequencer="0B"),
+               _event("ObjectCreated:Put", "new+cat.png", size=3, sequencer="0A"),
+               _event("ObjectCreated:Put", "kept.png", size=7, sequencer="0C")]
+    assert index.apply_notifications(s3, records) == 3
+    assert index.keys == ["kept.png", "old.png"]
+
+    reloaded = ListingIndex("image-bucket")
+    assert reloaded.ensure_loaded(s3)
+    assert (reloaded.keys, list(reloaded.sizes)) == (["kept.png", "old.png"], [7, 5])
+    assert reloaded.scan("kept")[0][0][2] == "2024-05-01T10:00:00+00:00"
+
+def test_snapshot_events_are_ignored(s3):
+    """Test that notifications for the snapshot itself do not rewrite it."""
+    index = ListingIndex("image-bucket")
+    assert index.apply_notifications(s3, [_event("ObjectCreated:Put", SNAPSHOT_KEY, size=1)]) == 0
+    assert "Contents" not in s3.list_objects_v2(Bucket="image-bucket")
+
+def test_unreadable_snapshot_is_rebuilt(s3):
+    """Test that a snapshot that does not decode is replaced from a listing, leaving internal objects out."""
+    s3.put_object(Bucket="image-bucket", Key=SNAPSHOT_KEY, Body=b"not gzip")
+    s3.put_object(Bucket="image-bucket", Key="a.png", Body=b"12")
+    s3.put_object(Bucket="image-bucket", Key="blobs/0a/1", Body=b"12")
+    assert ListingIndex("image-bucket").ensure_loaded(s3)
+
+    reloaded = ListingIndex("image-bucket")
+    assert reloaded.load(s3) and reloaded.keys == ["a.png"]
+
+def test_concurrent_saves_do_not_lose_events(s3):
+    """Test that a container whose snapshot was overwritten between its read and its save retries on top of it."""
+    first, second = ListingIndex("image-bucket"), ListingIndex("image-bucket")
+    first.apply_notifications(s3, [_event("ObjectCreated:Put", "a.png", size=1)])
+    save = second.save
+    attempts = []
+
+    def racing_save(client):
+        if not attempts:
+            first.apply_notifications(s3, [_event("ObjectCreated:Put", "b.png", size=2)])
+        attempts.append(client)
+        save(client)
+
+    second.save = racing_save
+    second.apply_notifications(s3, [_event("ObjectCreated:Put", "c.png", size=3)])
+    assert len(attempts) == 2
+    assert ListingIndex("image-bucket").ensure_loaded(s3)
+    assert second.keys == ["a.png", "b.png", "c.png"]
+
+def test_prefix_search_uses_the_index_and_sees_local_writes(s3):
+    """Test that listings come from the loaded index, include this container's uploads and page by key."""
+    listing = ListingIndex("image-bucket")
+    listing.apply_notifications(s3, [_event("ObjectCreated:Put", f"img{i}.png", size=i) for i in range(5)])
+    handler = FileHandler(bucket_name="image-bucket", table_name="ImageMetadata", listing=listing, **CONFIG)
+    search = FileSearch(bucket_name="image-bucket", listing=listing, **CONFIG)
+    handler.upload({"queryStringParameters": {"fileName": "img9.png"}, "body": base64.b64encode(b"123456789").decode()})
+
+    # None of img0..img4 exist in S3: only the index knows them
+    page = json.loads(search.prefix_search("img", limit=3, min_size=2)["body"])
+    assert [file["key"] for file in page["files"]] == ["img2.png", "img3.png", "img4.png"]
+    rest = json.loads(search.prefix_search("img", limit=3, next_token=page["nextToken"], min_size=2)["body"])
+    assert [file["key"] for file in rest["files"]] == ["img9.png"] and rest["nextToken"] is None
+
+    # Without the index the same token resumes the S3 listing after that key
+    search.listing = None
+    resumed = json.loads(search.prefix_search("img", next_token=page["nextToken"])["body"])
+    assert [file["key"] for file in resumed["files"]] == ["img9.png"]
@@ -0,0 +1,41 @@
+import json
+from botocore.stub import Stubber
+from assement.src.file_manager import aws_clients, metrics
+from assement.src.file_manager.concurrency import run_concurrently
+from assement.src.file_manager.streaming import Base64Reader
+
+def test_request_emits_emf_with_stages(capsys):
+    """Test that stages recorded on pool threads end up in the request's EMF line."""
+    with metrics.request("batch_upload") as request_metrics:
+        run_concurrently(lambda: Base64Reader("aGVsbG8="), lambda: Base64Reader(b"d29ybGQ="))
+        request_metrics.status_code = 200
+
+    record = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert record["Action"] == "batch_upload"
+    assert record["StatusCode"] == 200
+    assert {"base64_decode", "total"} <= set(record)
+    names = [metric["Name"] for metric in record["_aws"]["CloudWatchMetrics"][0]["Metrics"]]
+    assert "total" in names
+
+def test_client_calls_are_timed_per_operation(capsys):
+    """Test that every botocore call of a registry client is recorded as a stage."""
+    aws_clients.reset()
+    s3 = aws_clients.client('s3', aws_access_key_id="test", aws_secret_access_key="test")
+    with Stubber(s3) as stubber, metrics.request("delete") as request_metrics:
+        stubber.add_response('delete_object', {})
+        s3.delete_object(Bucket="image-bucket", Key="a.jpg")
+
+    assert "s3.DeleteObject" in request_metrics.stages
+
+def test_event_summary_drops_body_and_credentials():
+    """Test that the logged event summary never contains the body or credentials."""
+    summary = json.loads(metrics.summarize_event({
+        "httpMethod": "POST",
+        "queryStringParameters": {"action": "upload", "fileName": "a" * 500},
+        "headers": {"Authorization": "Bearer secret"},
+        "body": "x" * 10000
+    }))
+
+    assert summary["bodyLength"] == 10000
+    assert summary["headers"]["Authorization"] == "[redacted]"
+    assert len(summary["queryStringParameters"]["fileName"]) == metrics.MAX_VALUE_LENGTH
@@ -0,0 +1,80 @@
+import base64
+import json
+import pytest
+
+pytest.importorskip("moto")
+
+from assement.src.file_manager import ngram_index
+from assement.src.file_manager.file_handler import FileHandler
+from assement.src.file_manager.file_search import FileSearch
+from assement.src.file_manager.ngram_index import ngram_table_definition, ngrams
+from assement.src.test.conftest import CONFIG
+
+@pytest.fixture
+def tables():
+    return [ngram_table_definition("ImageSearchIndex")]
+
+@pytest.fixture
+def stores(bucket):
+    """FileHandler and FileSearch sharing a trigram table in moto's in-process S3 and DynamoDB."""
+    return (FileHandler(bucket_name="image-bucket", table_name="ImageMetadata", search_table_name="ImageSearchIndex", **CONFIG),
+            FileSearch(bucket_name="image-bucket", table_name="ImageMetadata", search_table_name="ImageSearchIndex", **CONFIG))
+
+def _upload(handler, name, content=b"x"):
+    handler.upload({"queryStringParameters": {"fileName": name, "metadata": "{}"}, "body": base64.b64encode(content).decode()})
+
+def _search(search, query, **kwargs):
+    return json.loads(search.text_search(query, **kwargs)["body"])
+
+def test_ngrams_are_lowercase_and_distinct():
+    """Test that a name yields its distinct lowercase trigrams."""
+    assert ngrams("AbAbA") == {"aba", "bab"}
+    assert ngrams("ab") == set()
+
+def test_search_finds_substrings_ranked_by_overlap(stores):
+    """Test that a fragment anywhere in a name matches and exact matches rank first."""
+    handler, search = stores
+    for name in ["2024/beach_sunset.jpg", "sunset.png", "sunrise.jpg", "harbour.jpg"]:
+        _upload(handler, name)
+
+    files = _search(search, "SUNSET")["files"]
+    assert [file["key"] for file in files] == ["sunset.png", "2024/beach_sunset.jpg"]
+    assert files[0]["score"] == 1.0 and files[0]["size"] == 1
+
+    # A typo still finds the name through the trigrams it shares
+    assert [file["key"] for file in _search(search, "sunsat")["files"]][:2] == ["sunset.png", "2024/beach_sunset.jpg"]
+
+def test_search_filters_and_paginates(stores):
+    """Test that size filters use the postings and nextToken pages through the ranking."""
+    handler, search = stores
+    for i in range(5):
+        _upload(handler, f"trip/photo{i}.jpg", b"x" * (i + 1))
+
+    assert [file["key"] for file in _search(search, "photo", min_size=3)["files"]] == \
+        ["trip/photo2.jpg", "trip/photo3.jpg", "trip/photo4.jpg"]
+    first = _search(search, "photo", limit=2)
+    second = _search(search, "photo", limit=2, next_token=first["nextToken"])
+    third = _search(search, "photo", limit=2, next_token=second["nextToken"])
+    keys = [file["key"] for page in (first, second, third) for file in page["files"]]
+    assert keys == [f"trip/photo{i}.jpg" for i in range(5)]
+    assert third["nextToken"] is None
+
+def test_deleted_images_leave_the_index(stores):
+    """Test that delete_file and batch_delete remove the postings."""
+    handler, search = stores
+    for name in ["sunset.png", "sunset2.png"]:
+        _upload(handler, name)
+    handler.delete_file({"imageName": "sunset.png"})
+    handler.batch_delete({"body": json.dumps({"imageNames": ["sunset2.png"]})})
+
+    assert _search(search, "sunset")["files"] == []
+
+def test_over_common_trigrams_are_ignored(stores, monkeypatch):
+    """Test that a posting list longer than MAX_POSTINGS does not count towards the score."""
+    handler, search = stores
+    for name in ["a.jpg", "b.jpg", "c.jpg", "cat.png"]:
+        _upload(handler, name)
+    monkeypatch.setattr(ngram_index, "MAX_POSTINGS", 2)
+
+    # ".jp" and "jpg" are over-common, so "cat.jpg" is matched on its remaining trigrams
+    assert [file["key"] for file in _search(search, "cat.jpg")["files"]] == ["cat.png"]
@@ -0,0 +1,60 @@
+import io
+import zipfile
+import pytest
+
+pytest.importorskip("moto")
+
+from assement.src import provision
+from assement.src.file_manager import aws_clients
+from assement.src.file_manager.db_client import table_definition
+from assement.src.file_manager.ngram_index import ngram_table_definition
+from assement.src.test import conftest
+
+CONFIG = {**conftest.CONFIG, "region_name": "us-east-1"}
+
+@pytest.fixture
+def aws(aws):
+    """moto's in-process AWS services, with API Gateway's spec validator."""
+    # moto's API Gateway validates with it
+    pytest.importorskip("openapi_spec_validator")
+
+def steps(package=b"code"):
+    return provision.environment_steps(CONFIG, "image-bucket",
+                                       [table_definition("ImageMetadata"), ngram_table_definition("ImageSearchIndex")],
+                                       "ImageLambdaFunction", "lambda-execution-role", "image_store",
+                                       package=package, handler="lambda_function.lambda_handler")
+
+def test_provisioning_creates_everything_then_only_checks_it(aws):
+    """Test that provisioning creates every resource, and a second run finds them all in place."""
+    first = provision.provision(steps(), progress=lambda name, result: None)
+    assert {name: result["status"] for name, result in first.items()} == dict.fromkeys(first, "created"), first
+    table = aws_clients.client('dynamodb', **CONFIG).describe_table(TableName="ImageMetadata")["Table"]
+    assert table["KeySchema"] == [{"AttributeName": "image_id", "KeyType": "HASH"}]
+    assert len(table["GlobalSecondaryIndexes"]) == 2
+
+    second = provision.provision(steps(), progress=lambda name, result: None)
+    assert {result["status"] for result in second.values()} == {"exists"}, second
+    third = provision.provision(steps(b"new code"), progress=lambda name, result: None)
+    assert third["function"]["status"] == "updated"
+
+def test_failures_skip_only_what_depends_on_them(aws):
+    """Test that a table with another key schema fails its step, leaving the rest of the graph alone."""
+    aws_clients.client('dynamodb', **CONFIG).create_table(
+        TableName="ImageMetadata", KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}], BillingMode="PAY_PER_REQUEST")
+    results = provision.provision(steps(), progress=lambda name, result: None)
+    assert results["table:ImageMetadata"]["status"] == "failed"
+    assert results["notifications"]["status"] == "created"
+
+    ordered = [provision.Step("a", lambda outputs: ("created", 1), after=["b"]),
+               provision.Step("b", lambda outputs: ("created", 2), after=["a"])]
+    with pytest.raises(ValueError):
+        provision.provision(ordered)
+
+def test_package_is_built_in_memory_under_the_import_path():
+    """Test that the function's zip holds the package's modules under their import path, reproducibly."""
+    package = provision.build_package()
+    names = zipfile.ZipFile(io.BytesIO(package)).namelist()
+    assert "assement/src/__init__.py" in names and "assement/src/file_manager/lambda_function.py" in names
+    assert not any("__pycache__" in name or "/test/" in name for name in names)
+    assert provision.build_package() == package
@@ -0,0 +1,53 @@
+from botocore.hooks import HierarchicalEmitter
+from assement.src.file_manager import rate_limit
+from assement.src.file_manager.rate_limit import AdaptiveRateLimiter
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def test_limiter_borrows_then_waits():
+    """Test that a burst beyond the bucket is let through after a wait that pays its debt."""
+    clock = _Clock()
+    limiter = AdaptiveRateLimiter(rate=10, clock=clock, sleep=clock.sleep)
+    assert limiter.acquire(10) == 0
+    assert limiter.acquire(5) == 0.5
+    assert clock.now == 0.5
+    assert limiter.snapshot()["waited_s"] == 0.5
+
+def test_limiter_decreases_once_per_interval_and_recovers():
+    """Test that throttles halve the rate at most once per interval and successes raise it again."""
+    clock = _Clock()
+    limiter = AdaptiveRateLimiter(rate=100, clock=clock, sleep=clock.sleep)
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.rate == 50
+    clock.now += rate_limit.DECREASE_INTERVAL
+    limiter.on_throttle()
+    assert limiter.rate == 25
+    limiter.on_success(25)
+    assert limiter.rate == 25 + rate_limit.INCREASE
+    assert limiter.snapshot()["throttles"] == 3
+
+def test_installed_hooks_feed_throttles_back_per_table():
+    """Test that unprocessed batch items throttle only their table's limiter."""
+    rate_limit.reset()
+    events = HierarchicalEmitter()
+    rate_limit.install(events)
+    context = {}
+    events.emit("before-call.dynamodb.BatchWriteItem", params={"RequestItems": {"A": [{}] * 3, "B": [{}]}},
+                context=context)
+    response = {"UnprocessedItems": {"A": [{}]}}
+    events.emit("needs-retry.dynamodb.BatchWriteItem", response=(None, response),
+                request_dict={"context": context}, attempts=1)
+
+    limits = rate_limit.snapshot()
+    assert limits["A"]["throttles"] == 1 and limits["A"]["rate"] == rate_limit.INITIAL_RATE * rate_limit.DECREASE
+    assert limits["B"]["throttles"] == 0 and limits["B"]["rate"] > rate_limit.INITIAL_RATE
+    rate_limit.reset()
@@ -0,0 +1,65 @@
+import json
+import pytest
+
+pytest.importorskip("moto")
+
+from assement.src.file_manager import reconcile
+from assement.src.file_manager.db_client import search_shard
+from assement.src.file_manager.file_handler import FileHandler
+from assement.src.file_manager.ngram_index import ngram_table_definition
+from assement.src.file_manager.reconcile import Reconciler
+from assement.src.test.conftest import CONFIG
+
+@pytest.fixture
+def tables():
+    return [ngram_table_definition("ImageSearchIndex")]
+
+@pytest.fixture
+def handler(bucket):
+    """FileHandler with a trigram index over moto's in-process S3 and DynamoDB."""
+    return FileHandler(bucket_name="image-bucket", table_name="ImageMetadata", search_table_name="ImageSearchIndex",
+                       **CONFIG)
+
+def _row(image_id, uploaded_at="2020-01-01T00:00:00.000000+00:00"):
+    return {"image_id": image_id, "metadata": {}, "size": 1, "content_type": "image/png", "uploaded_at": uploaded_at,
+            "search_shard": search_shard(image_id)}
+
+def _drifted(handler):
+    """Objects without rows spread over the key space, rows without objects, and one consistent image."""
+    names = [f"{first}{i:02d}.png" for first in "0Aam" for i in range(15)]
+    for name in names + ["blobs/abc/1", "kept.png"]:
+        handler.s3.put_object(Bucket="image-bucket", Key=name, Body=b"xyz")
+    handler.db_client.batch_write_items(items=[_row("kept.png"), _row("gone.png"),
+                                               _row("fresh.png", "2999-01-01T00:00:00.000000+00:00")])
+    return names
+
+def test_reconcile_backfills_and_prunes(handler, monkeypatch):
+    """Test that a run writes rows for unrecorded objects, deletes stale orphans and keeps fresh rows."""
+    monkeypatch.setattr(reconcile, "LIST_PAGE_SIZE", 4)
+    names = _drifted(handler)
+    reports = []
+    report = Reconciler(handler, workers=4, segments=3, progress=reports.append).run()
+
+    assert (report["objects"], report["rows"]) == (len(names) + 2, 3)
+    assert (report["missing"], report["backfilled"], report["orphans"], report["pruned"]) == (60, 60, 1, 1)
+    row = handler.db_client.get_item({"image_id": "a07.png"})
+    assert (row["size"], row["content_type"], row["metadata"]) == (3, "image/png", {})
+    assert handler.db_client.get_item({"image_id": "gone.png"}) is None
+    assert handler.db_client.get_item({"image_id": "fresh.png"}) is not None
+    assert handler.db_client.get_item({"image_id": "blobs/abc/1"}) is None
+    # The backfilled rows are searchable by name
+    assert handler.ngrams.search("m14")[0][0]["image_id"] == "m14.png"
+
+def test_reconcile_resumes_from_checkpoint(handler, tmp_path):
+    """Test that a dry run reports the drift without fixing it, and a run from its checkpoint fixes it."""
+    _drifted(handler)
+    checkpoint = str(tmp_path / "reconcile.json")
+    report = Reconciler(handler, workers=2, segments=2, checkpoint_path=checkpoint, dry_run=True).run()
+    assert (report["phase"], report["missing"], report["backfilled"]) == ("fix", 60, 0)
+    assert handler.db_client.get_item({"image_id": "a07.png"}) is None
+    with open(checkpoint) as saved:
+        assert len(json.load(saved)["tasks"]) == 2
+
+    report = Reconciler(handler, workers=2, segments=2, checkpoint_path=checkpoint).run()
+    assert (report["phase"], report["backfilled"], report["pruned"]) == ("done", 60, 1)
+    assert handler.db_client.get_item({"image_id": "a07.png"}) is not None
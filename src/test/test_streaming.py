@@ -0,0 +1,75 @@
+import base64
+import hashlib
+import os
+import tracemalloc
+import pytest
+from unittest.mock import MagicMock
+from assement.src.file_manager import streaming
+from assement.src.file_manager.streaming import Base64Reader, put_stream
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 4, 100_000])
+def test_reader_decodes_like_b64decode(size):
+    """Test that reads, seeks and sections return the same bytes as a full decode."""
+    content = os.urandom(size)
+    encoded = base64.b64encode(content).decode('ascii')
+    for source in (encoded, encoded.encode('ascii')):
+        reader = Base64Reader(source)
+        assert len(reader) == size
+        assert reader.read() == content
+        reader.seek(size // 3)
+        assert reader.read(7) == content[size // 3:size // 3 + 7]
+        assert reader.section(size // 5, size // 2).read() == content[size // 5:size // 2]
+        assert reader.sha256() == hashlib.sha256(content).hexdigest()
+
+def test_reader_accepts_line_breaks_and_missing_padding():
+    """Test that whitespace is skipped and unpadded text decodes, as with b64decode."""
+    content = os.urandom(1000)
+    encoded = base64.encodebytes(content).decode('ascii').rstrip('=\n')
+    for source in (encoded, encoded.encode('ascii')):
+        reader = Base64Reader(source)
+        assert len(reader) == 1000 and reader.read() == content
+        assert reader.section(990, 1000).read() == content[990:]
+    assert Base64Reader("YWJj\r\nZA").read() == b"abcd"
+
+def test_reader_rejects_invalid_base64():
+    """Test that a malformed body is refused up front, before any of it is read."""
+    for body in ("abcde", "ab!!cdef", "YQ==YWJj", "é" * 4, base64.b64encode(os.urandom(100_000)).decode() + "*"):
+        with pytest.raises(ValueError):
+            Base64Reader(body)
+
+def test_reader_memory_does_not_grow_with_content():
+    """Test that draining an 8 MB body allocates about one chunk, not the content."""
+    reader = Base64Reader(base64.b64encode(os.urandom(8 * 1024 * 1024)))
+    tracemalloc.start()
+    try:
+        reader.sha256()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 1024 * 1024
+
+def test_put_stream_sends_large_bodies_in_parts(monkeypatch):
+    """Test that a body above the threshold is uploaded in parts and completed in order."""
+    monkeypatch.setattr(streaming, "STREAM_MULTIPART_THRESHOLD", 10)
+    monkeypatch.setattr(streaming, "STREAM_PART_SIZE", 4)
+    s3 = MagicMock()
+    s3.create_multipart_upload.return_value = {"UploadId": "u1"}
+    s3.upload_part.side_effect = lambda **kwargs: {"ETag": kwargs["Body"].read().decode()}
+
+    put_stream(s3, "image-bucket", "photo.png", Base64Reader(base64.b64encode(b"abcdefghijk")), "image/png")
+
+    parts = s3.complete_multipart_upload.call_args.kwargs["MultipartUpload"]["Parts"]
+    assert parts == [{"PartNumber": 1, "ETag": "abcd"}, {"PartNumber": 2, "ETag": "efgh"}, {"PartNumber": 3, "ETag": "ijk"}]
+    s3.put_object.assert_not_called()
+
+def test_put_stream_aborts_failed_multipart_upload(monkeypatch):
+    """Test that a failed part aborts the multipart upload."""
+    monkeypatch.setattr(streaming, "STREAM_MULTIPART_THRESHOLD", 2)
+    s3 = MagicMock()
+    s3.create_multipart_upload.return_value = {"UploadId": "u1"}
+    s3.upload_part.side_effect = Exception("SlowDown")
+
+    with pytest.raises(Exception):
+        put_stream(s3, "image-bucket", "photo.png", Base64Reader(base64.b64encode(b"abcdef")), "image/png")
+    s3.abort_multipart_upload.assert_called_once_with(Bucket="image-bucket", Key="photo.png", UploadId="u1")
+    s3.complete_multipart_upload.assert_not_called()
@@ -0,0 +1,94 @@
+import base64
+import io
+import json
+import pytest
+from assement.src.file_manager import file_handler
+from assement.src.file_manager.delete_queue import DeleteDrain, LocalQueue
+from assement.src.file_manager.file_handler import FileHandler, download_cache
+from assement.src.file_manager.variants import VARIANT_PREFIX, parse_variant
+from assement.src.test.conftest import CONFIG
+
+def test_parse_variant_defaults_and_validation():
+    """Test that only variant parameters trigger a variant and bad values are rejected."""
+    assert parse_variant({"imageName": "a.jpg"}) is None
+    assert parse_variant({"width": "200", "format": "JPG"}) == {"width": 200, "height": 0, "format": "jpeg", "quality": 85}
+    with pytest.raises(ValueError):
+        parse_variant({"width": "99999"})
+    with pytest.raises(ValueError):
+        parse_variant({"format": "gif"})
+
+@pytest.fixture
+def handler(bucket):
+    """FileHandler against moto's in-process S3 and DynamoDB."""
+    return FileHandler(bucket_name="image-bucket", table_name="ImageMetadata", **CONFIG)
+
+def _variant_keys(handler):
+    response = handler.s3.list_objects_v2(Bucket="image-bucket", Prefix=VARIANT_PREFIX)
+    return [obj["Key"] for obj in response.get("Contents", [])]
+
+def test_variant_is_rendered_once_and_deleted_with_the_image(handler):
+    """Test that a resized variant is stored on first request, reused, and removed by delete_file."""
+    Image = pytest.importorskip("PIL.Image")
+    png = io.BytesIO()
+    Image.new("RGBA", (400, 200), (255, 0, 0, 128)).save(png, format="PNG")
+    handler.upload({"queryStringParameters": {"fileName": "red.png", "metadata": "{}"},
+                    "body": base64.b64encode(png.getvalue()).decode()})
+
+    first = handler.download({"imageName": "red.png", "width": "100", "format": "jpeg"})
+    download_cache.clear()
+    second = handler.download({"imageName": "red.png", "width": "100", "format": "jpeg"})
+
+    assert first["statusCode"] == second["statusCode"] == 200
+    keys = _variant_keys(handler)
+    assert len(keys) == 1 and keys[0].endswith("100x0q85.jpeg")
+    variant = Image.open(handler.s3.get_object(Bucket="image-bucket", Key=keys[0])["Body"])
+    assert variant.size == (100, 50)
+    assert keys[0] in json.loads(second["body"])["downloadUrl"]
+
+    handler.delete_file({"imageName": "red.png"})
+    assert _variant_keys(handler) == []
+
+def test_purge_deletes_the_variants(bucket):
+    """Test that the delete drain removes the variants of the images it purges."""
+    Image = pytest.importorskip("PIL.Image")
+    queue = LocalQueue()
+    handler = FileHandler(bucket_name="image-bucket", table_name="ImageMetadata", delete_queue=queue, **CONFIG)
+    png = io.BytesIO()
+    Image.new("RGB", (400, 200), (0, 255, 0)).save(png, format="PNG")
+    handler.upload({"queryStringParameters": {"fileName": "green.png", "metadata": "{}"},
+                    "body": base64.b64encode(png.getvalue()).decode()})
+    handler.download({"imageName": "green.png", "width": "100"})
+    assert len(_variant_keys(handler)) == 1
+
+    assert handler.delete_file({"imageName": "green.png"})["statusCode"] == 202
+    assert DeleteDrain(handler, queue, wait=0).drain_once() == 1
+    assert _variant_keys(handler) == []
+
+def test_small_variants_come_back_inline(handler):
+    """Test that an inline download of a thumbnail returns its bytes with the variant's content type."""
+    Image = pytest.importorskip("PIL.Image")
+    png = io.BytesIO()
+    Image.new("RGB", (400, 200), (0, 0, 255)).save(png, format="PNG")
+    handler.upload({"queryStringParameters": {"fileName": "blue.png", "metadata": "{}"},
+                    "body": base64.b64encode(png.getvalue()).decode()})
+
+    response = handler.download({"imageName": "blue.png", "width": "40", "format": "jpeg", "inline": "1"})
+    assert (response["statusCode"], response["headers"]["Content-Type"]) == (200, "image/jpeg")
+    assert Image.open(io.BytesIO(base64.b64decode(response["body"]))).size == (40, 20)
+    cached = handler.download({"imageName": "blue.png", "width": "40", "format": "jpeg", "inline": "1"},
+                              {"if-none-match": response["headers"]["ETag"]})
+    assert cached["statusCode"] == 304
+
+def test_oversized_originals_are_not_read(handler, monkeypatch):
+    """Test that a variant of an original over the size limit is refused with 413 before the object is read."""
+    monkeypatch.setattr(file_handler, "MAX_VARIANT_SOURCE_BYTES", 4)
+    handler.upload({"queryStringParameters": {"fileName": "big.png", "metadata": "{}"},
+                    "body": base64.b64encode(b"12345").decode()})
+    reads = []
+    handler.s3.meta.events.register("before-call.s3.GetObject", lambda **kwargs: reads.append(kwargs))
+    try:
+        response = handler.download({"imageName": "big.png", "width": "100"})
+    finally:
+        handler.s3.meta.events.unregister("before-call.s3.GetObject")
+    assert response["statusCode"] == 413 and reads == []
+    assert _variant_keys(handler) == []